@@ -1,15 +1,52 @@
 import logging
+import multiprocessing
 import sys
-from PyQt6.QtWidgets import QApplication
 
-from src.gui.widgets.splash_screen import SplashScreen
-from src.gui.windows.main_window import MainWindow
-from src.util.logging import configure_root_logger, log_uncaught_exception
+if __name__ == '__main__':
+    # required for the pre-processing process pool in frozen builds, spawned children stop here
+    multiprocessing.freeze_support()
 
-configure_root_logger(logging.INFO)
+    from src.util.cpu_governor import apply_cpu_plan, limit_native_threads, worker_count_option
+    from src.util.settings import SettingsManager
 
+    # numpy and OpenCV size their thread pools when they are first imported, so this has to run before the imports
+    # below. Children of the process pool get the limits through the environment
+    limit_native_threads(worker_count_option(sys.argv[1:]) or SettingsManager().pre_processing_worker_count())
+
+    from PyQt6.QtWidgets import QApplication
+
+    from src.cli import batch, client, service, shards, worker
+    from src.gui.widgets.splash_screen import SplashScreen
+    from src.gui.windows.main_window import MainWindow
+    from src.processing.image_prefetch import shutdown_image_prefetcher
+    from src.processing.ocr_loop import shutdown_ocr_loop
+    from src.processing.process_pool import shutdown_process_pool
+    from src.util.logging import configure_root_logger, log_uncaught_exception
+    from src.util.ocr_cache import shutdown_ocr_cache
+
+    # run the pipeline headless when asked, i.e. "eagle_eye.py batch --form ... --export ... files"
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(batch.main(sys.argv[2:]))
+
+    # claim files from a queued job, i.e. "eagle_eye.py worker <job name>" on each machine helping out
+    if len(sys.argv) > 1 and sys.argv[1] == 'worker':
+        sys.exit(worker.main(sys.argv[2:]))
+
+    # run jobs in the background so they outlive the GUI, i.e. "eagle_eye.py service"
+    if len(sys.argv) > 1 and sys.argv[1] == 'service':
+        sys.exit(service.main(sys.argv[2:]))
+
+    # talk to the background service, i.e. "eagle_eye.py client submit <job name> --follow"
+    if len(sys.argv) > 1 and sys.argv[1] == 'client':
+        sys.exit(client.main(sys.argv[2:]))
+
+    # split a job into bundles for other machines and merge them back, i.e. "eagle_eye.py shard split <job name> ..."
+    if len(sys.argv) > 1 and sys.argv[1] == 'shard':
+        sys.exit(shards.main(sys.argv[2:]))
+
+    configure_root_logger(logging.INFO)
+    apply_cpu_plan()
 
-if __name__ == '__main__':
     app = QApplication(sys.argv)
     app.setQuitOnLastWindowClosed(True)
 
@@ -23,3 +60,7 @@ if __name__ == '__main__':
     window.start()
 
     app.exec()
+    shutdown_process_pool()
+    shutdown_ocr_loop()
+    shutdown_image_prefetcher()
+    shutdown_ocr_cache()
@@ -0,0 +1,97 @@
+import base64
+import cv2
+import json
+import logging
+import numpy as np
+import sys
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src.util.logging import configure_root_logger
+from src.util.processing import words_to_text
+from src.util.types import BoxBounds, OcrWord
+
+# Answers images:annotate calls with a "word" for each blob of ink, named after its size, so mosaic mapping
+# can be checked without the Vision API. Set ocr_api_url to http://127.0.0.1:8766/v1/images:annotate
+# and give google_project_id/google_access_token any value.
+
+HOST = '127.0.0.1'
+PORT = 8766
+
+logger = logging.getLogger(__name__)
+
+
+def find_words(image: np.ndarray) -> list[OcrWord]:
+    _, ink = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    # smear the letters of a word together, but not across the gaps between images
+    ink = cv2.dilate(ink, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 3)))
+    contours, _ = cv2.findContours(ink, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    words = []
+    for contour in contours:
+        x, y, width, height = cv2.boundingRect(contour)
+        text = f'{round(width, -1)}x{round(height, -1)}'
+        words.append(OcrWord(text=text, bounds=BoxBounds(x, y, width, height), space_after=True))
+    return words
+
+
+def word_json(word: OcrWord) -> dict:
+    bounds = word.bounds
+    vertices = [
+        {'x': bounds.x, 'y': bounds.y},
+        {'x': bounds.x + bounds.width, 'y': bounds.y},
+        {'x': bounds.x + bounds.width, 'y': bounds.y + bounds.height},
+        {'x': bounds.x, 'y': bounds.y + bounds.height},
+    ]
+    symbols = [{'text': char} for char in word.text]
+    symbols[-1]['property'] = {'detectedBreak': {'type': 'SPACE'}}
+    return {'boundingBox': {'vertices': vertices}, 'symbols': symbols}
+
+
+def annotate(request: dict) -> dict:
+    buffer = np.frombuffer(base64.b64decode(request['image']['content']), dtype=np.uint8)
+    image = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return {'error': {'code': 3, 'message': 'Bad image data.'}}
+
+    words = find_words(image)
+    if not words:
+        return {}
+
+    text = words_to_text(words)
+    return {
+        'textAnnotations': [{'description': text}],
+        'fullTextAnnotation': {
+            'text': text,
+            'pages': [{'blocks': [{'paragraphs': [{'words': [word_json(word) for word in words]}]}]}],
+        },
+    }
+
+
+class AnnotateHandler(BaseHTTPRequestHandler):
+    def do_POST(self) -> None:
+        if self.path.split('?')[0] != '/v1/images:annotate':
+            self.send_error(404)
+            return
+
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        requests_list = payload.get('requests', [])
+        logger.info(f'Annotating {len(requests_list)} images')
+
+        body = json.dumps({'responses': [annotate(request) for request in requests_list]}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(format % args)
+
+
+if __name__ == '__main__':
+    configure_root_logger(logging.INFO)
+
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+    server = ThreadingHTTPServer((HOST, port), AnnotateHandler)
+    logger.info(f'OCR stand-in listening on http://{HOST}:{port}/v1/images:annotate')
+    server.serve_forever()
@@ -0,0 +1,504 @@
+import argparse
+import logging
+import sys
+import threading
+from collections.abc import Callable, Iterable
+from concurrent.futures import Executor, Future, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src.database import DB_ENGINE
+from src.database.input_file import InputFile
+from src.database.job import Job
+from src.database.reference_form import ReferenceForm
+from src.processing.control import ProcessingControl
+from src.processing.export import build_export_df
+from src.processing.file_stages import (
+    PRE_PROCESSING_STEP, PROCESSING_STEP, STEP_TASK_STAGES, build_file_pipeline, get_item_statuses,
+)
+from src.processing.form_changes import requeue_changed_regions
+from src.processing.image_prefetch import prefetch_input_images, shutdown_image_prefetcher
+from src.processing.job_setup import create_job, add_input_file
+from src.processing.memory_budget import admit_file, format_bytes, get_rss_monitor
+from src.processing.ocr_loop import shutdown_ocr_loop
+from src.processing.pipeline import PipelineItem
+from src.processing.pre_process_worker import pre_process_file, run_pre_processing
+from src.processing.process_pool import get_process_pool, shutdown_process_pool
+from src.processing.process_worker import process_file
+from src.processing.task_queue import (
+    cancel_tasks,
+    get_unfinished_file_ids,
+    queue_tasks,
+    release_stale_leases,
+    run_task,
+    start_lease_heartbeat,
+)
+from src.util.cpu_governor import apply_cpu_plan
+from src.util.export import ExportMode
+from src.util.logging import NamedLoggerAdapter, configure_root_logger, get_current_logfile
+from src.util.ocr_cache import shutdown_ocr_cache
+from src.util.settings import SettingsManager
+from src.util.status import FileStatus
+from src.util.types import TaskStage
+
+logger = logging.getLogger(__name__)
+
+EXIT_SUCCESS = 0
+EXIT_FILE_ERRORS = 1
+EXIT_USAGE_ERROR = 2
+EXIT_CANCELLED = 130
+
+INPUT_FILE_SUFFIXES = ('.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp')
+
+StepFunction = Callable[[int, int, ProcessingControl], FileStatus | None]
+
+
+class BatchError(Exception):
+    pass
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='eagle_eye.py batch',
+        description='Run the full processing pipeline on a set of files without the GUI',
+    )
+    parser.add_argument('inputs', nargs='*', type=Path, help='Input files or directories of input files')
+    parser.add_argument('--form', help='Name of the reference form to process the files with')
+    parser.add_argument(
+        '--resume',
+        metavar='JOB_NAME',
+        help='Finish the unfinished work of an earlier job instead of creating a new one',
+    )
+    parser.add_argument('--export', type=Path, help='Path of the .csv or .xlsx file to export to')
+    parser.add_argument('--job-name', help='Name of the job to create (default: batch_<timestamp>)')
+    parser.add_argument(
+        '--export-mode',
+        choices=[mode.name.lower() for mode in ExportMode],
+        default=ExportMode.FULL.name.lower(),
+        help='Which results to export (default: full)',
+    )
+    parser.add_argument('--workers', type=int, help='Number of pre-processing workers')
+    parser.add_argument('--ocr-workers', type=int, help='Number of OCR processing workers')
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help='Run files through the staged pipeline so OCR starts on each file as soon as it is aligned',
+    )
+    parser.add_argument(
+        '--queue-only',
+        action='store_true',
+        help='Set up the job and queue its files for "eagle_eye.py worker" processes instead of running it here',
+    )
+    parser.add_argument('--verbose', action='store_true', help='Print all log messages to the console')
+
+    return parser.parse_args(argv)
+
+
+def collect_input_files(inputs: Iterable[Path]) -> list[Path]:
+    files = []
+    for path in inputs:
+        if path.is_dir():
+            files.extend(
+                sorted(child for child in path.rglob('*') if child.is_file() and child.suffix.lower() in INPUT_FILE_SUFFIXES)
+            )
+        elif path.is_file():
+            files.append(path)
+        else:
+            raise BatchError(f'Input path does not exist: {path}')
+
+    if not files:
+        raise BatchError('No input files were found')
+
+    return files
+
+
+def get_reference_form_id(session: Session, form_name: str) -> int:
+    form = session.scalars(select(ReferenceForm).where(ReferenceForm.name == form_name)).first()
+    if form is None:
+        available = ', '.join(f'"{name}"' for name in session.scalars(select(ReferenceForm.name)).all())
+        raise BatchError(f'Unknown reference form "{form_name}", available forms: {available}')
+
+    return form.id
+
+
+def set_up_job(job_name: str, form_name: str, files: list[Path]) -> int:
+    # look up the form first so a bad name does not leave an empty job behind
+    with Session(DB_ENGINE) as session:
+        form_id = get_reference_form_id(session, form_name)
+
+    job_id = create_job(job_name)
+    with Session(DB_ENGINE) as session:
+        job = session.get(Job, job_id)
+        job.reference_form = session.get(ReferenceForm, form_id)
+        session.commit()
+
+        for file in files:
+            add_input_file(session, job, file)
+
+    return job_id
+
+
+def get_job_id(job_name: str) -> int:
+    with Session(DB_ENGINE) as session:
+        job = session.scalars(select(Job).where(Job.name == job_name)).first()
+        if job is None:
+            raise BatchError(f'Unknown job "{job_name}"')
+
+        return job.id
+
+
+def check_export_path(export_path: Path) -> None:
+    if export_path.exists():
+        raise BatchError(f'Export file already exists: {export_path}')
+    if export_path.suffix.lower() not in ('.csv', '.xlsx'):
+        raise BatchError(f'Unknown export format: "{export_path.suffix}" (expected .csv or .xlsx)')
+
+
+def get_file_name(file_id: int) -> str:
+    with Session(DB_ENGINE) as session:
+        return session.get(InputFile, file_id).path.name
+
+
+def get_future_status(step_name: str, file_id: int, future: Future) -> FileStatus | None:
+    try:
+        return future.result()
+    except Exception:
+        logger.exception(f'{step_name} failed for input file {file_id}')
+        return FileStatus.FAILED
+
+
+def print_progress(step_name: str, count: int, total: int, file_id: int, status: FileStatus | None) -> None:
+    status_name = status.name if status is not None else 'SKIPPED'
+    print(f'{step_name} [{count:>{len(str(total))}}/{total}] {get_file_name(file_id)}: {status_name}')
+
+
+def run_step(
+        step_name: str,
+        job_id: int,
+        file_ids: list[int],
+        step_function: StepFunction,
+        executor: Executor,
+        control: ProcessingControl,
+        prefetch: bool = True,
+) -> dict[int, FileStatus]:
+    statuses: dict[int, FileStatus] = {}
+    stage = STEP_TASK_STAGES[step_name]
+    queue_tasks(job_id, stage, file_ids)
+
+    prefetch_count = SettingsManager().prefetch_images if prefetch else 0
+
+    def run_file(index: int) -> FileStatus | None:
+        # the executor starts files in order, so read the images of the next few while this one runs
+        if prefetch_count:
+            prefetch_input_images(stage, file_ids[index + 1:index + 1 + prefetch_count])
+        return step_function(job_id, file_ids[index], control)
+
+    futures = {executor.submit(run_file, index): file_id for index, file_id in enumerate(file_ids)}
+
+    try:
+        for count, future in enumerate(as_completed(futures), start=1):
+            file_id = futures[future]
+            status = get_future_status(step_name, file_id, future)
+            if status is not None:
+                statuses[file_id] = status
+
+            print_progress(step_name, count, len(file_ids), file_id, status)
+    except KeyboardInterrupt:
+        # stop the running files at their next checkpoint and drop the rest
+        print('Cancelling, waiting for the running files to stop')
+        control.cancel()
+        executor.shutdown(cancel_futures=True)
+        raise
+
+    return statuses
+
+
+def run_pipelined(
+        job_id: int,
+        file_ids: list[int],
+        aligned_file_ids: list[int],
+        align_workers: int,
+        ocr_workers: int,
+        process_pool: Executor | None,
+        control: ProcessingControl,
+) -> tuple[dict[int, FileStatus], dict[int, FileStatus]]:
+    pre_process_statuses: dict[int, FileStatus] = {}
+    process_statuses: dict[int, FileStatus] = {}
+    finished_count = 0
+    lock = threading.Lock()
+
+    def item_finished(item: PipelineItem) -> None:
+        nonlocal finished_count
+        statuses = get_item_statuses(item)
+
+        with lock:
+            finished_count += 1
+            if PRE_PROCESSING_STEP in statuses:
+                pre_process_statuses[item.file_id] = statuses[PRE_PROCESSING_STEP]
+            if PROCESSING_STEP in statuses:
+                process_statuses[item.file_id] = statuses[PROCESSING_STEP]
+
+            summary = ', '.join(f'{step}: {status.name}' for step, status in statuses.items()) or 'SKIPPED'
+            if item.cancelled_stage is not None:
+                summary = 'CANCELLED'
+            total = len(file_ids) + len(aligned_file_ids)
+            print(f'[{finished_count:>{len(str(total))}}/{total}] {get_file_name(item.file_id)}: {summary}')
+
+    queue_tasks(job_id, TaskStage.PRE_PROCESSING, file_ids)
+
+    # each stage runs on its own workers, so files flow into OCR as soon as they are aligned
+    pipeline = build_file_pipeline(align_workers, ocr_workers, item_finished, process_pool)
+    pipeline.start()
+    try:
+        for file_id in file_ids:
+            pipeline.submit(PipelineItem(job_id, file_id, NamedLoggerAdapter(logger, f'Batch: {file_id}'), control))
+
+        # files an earlier run aligned but never finished go straight to OCR
+        for file_id in aligned_file_ids:
+            item = PipelineItem(job_id, file_id, NamedLoggerAdapter(logger, f'Batch: {file_id}'), control)
+            pipeline.submit(item, stage_name='prepare')
+
+        pipeline.wait()
+    except KeyboardInterrupt:
+        # the stages drain anything cancelled without running it
+        print('Cancelling, waiting for the running files to stop')
+        control.cancel()
+        raise
+    finally:
+        pipeline.shutdown()
+
+    for stats in pipeline.stats():
+        print(
+            f'Stage "{stats.name}": {stats.completed} done, {stats.failed} failed, '
+            f'{stats.busy_seconds:.1f}s busy across {stats.workers} workers'
+        )
+
+    return pre_process_statuses, process_statuses
+
+
+def threaded_pre_process(job_id: int, file_id: int, control: ProcessingControl) -> FileStatus | None:
+    log = NamedLoggerAdapter(logger, f'Batch: {file_id}')
+    return run_task(
+        job_id,
+        file_id,
+        TaskStage.PRE_PROCESSING,
+        lambda: pre_process_file(job_id, file_id, log, control),
+    )
+
+
+def child_pre_process(job_id: int, file_id: int, control: ProcessingControl) -> FileStatus | None:
+    def pre_process() -> FileStatus | None:
+        with admit_file(job_id, TaskStage.PRE_PROCESSING, control):
+            control.checkpoint()
+            status_name = get_process_pool().submit(run_pre_processing, job_id, file_id).result()
+        return None if status_name is None else FileStatus[status_name]
+
+    return run_task(job_id, file_id, TaskStage.PRE_PROCESSING, pre_process)
+
+
+def threaded_process(job_id: int, file_id: int, control: ProcessingControl) -> FileStatus | None:
+    log = NamedLoggerAdapter(logger, f'Batch: {file_id}')
+    return run_task(job_id, file_id, TaskStage.PROCESSING, lambda: process_file(job_id, file_id, log, control))
+
+
+def count_validation_failures(job_id: int) -> tuple[int, int]:
+    failed = 0
+    total = 0
+
+    with Session(DB_ENGINE) as session:
+        job = session.get(Job, job_id)
+        for file in job.input_files:
+            if file.process_result is None:
+                continue
+
+            for region in file.process_result.regions.values():
+                for group in region.groups:
+                    for field in group.fields:
+                        sub_field = field.text_field or field.checkbox_field \
+                                    or field.multi_checkbox_field or field.circled_field
+                        if sub_field is None or sub_field.validation_result is None:
+                            continue
+
+                        total += 1
+                        if sub_field.validation_result.result is False:
+                            failed += 1
+
+    return failed, total
+
+
+def export_job(job_id: int, mode: ExportMode, export_path: Path) -> None:
+    with Session(DB_ENGINE) as session:
+        export_df = build_export_df(mode, session.get(Job, job_id))
+
+    if export_path.suffix.lower() == '.csv':
+        export_df.to_csv(export_path, index=False)
+    else:
+        export_df.to_excel(export_path, index=False)
+
+
+def run_job(
+        job_id: int,
+        stream: bool,
+        pre_process_workers: int,
+        process_workers: int,
+        use_processes: bool,
+        control: ProcessingControl,
+) -> tuple[dict[int, FileStatus], dict[int, FileStatus]]:
+    if stream:
+        # files still waiting on pre-processing get to OCR through the pipeline
+        pre_process_ids = get_unfinished_file_ids(job_id, TaskStage.PRE_PROCESSING)
+        aligned_file_ids = [
+            file_id
+            for file_id in get_unfinished_file_ids(job_id, TaskStage.PROCESSING)
+            if file_id not in pre_process_ids
+        ]
+
+        return run_pipelined(
+            job_id,
+            pre_process_ids,
+            aligned_file_ids,
+            pre_process_workers,
+            process_workers,
+            get_process_pool() if use_processes else None,
+            control,
+        )
+
+    # Pre-process
+    pre_process_function = child_pre_process if use_processes else threaded_pre_process
+    with ThreadPoolExecutor(max_workers=pre_process_workers) as executor:
+        pre_process_statuses = run_step(
+            PRE_PROCESSING_STEP,
+            job_id,
+            get_unfinished_file_ids(job_id, TaskStage.PRE_PROCESSING),
+            pre_process_function,
+            executor,
+            control,
+            # child processes read their own images
+            prefetch=not use_processes,
+        )
+
+    # OCR everything that aligned
+    aligned_file_ids = get_unfinished_file_ids(job_id, TaskStage.PROCESSING)
+    with ThreadPoolExecutor(max_workers=process_workers) as executor:
+        process_statuses = run_step(PROCESSING_STEP, job_id, aligned_file_ids, threaded_process, executor, control)
+
+    return pre_process_statuses, process_statuses
+
+
+def queue_job(job_id: int) -> tuple[int, int]:
+    # workers claim these, aligned files that never finished OCR go straight to processing
+    pre_process_ids = get_unfinished_file_ids(job_id, TaskStage.PRE_PROCESSING)
+    aligned_file_ids = [
+        file_id
+        for file_id in get_unfinished_file_ids(job_id, TaskStage.PROCESSING)
+        if file_id not in pre_process_ids
+    ]
+
+    queue_tasks(job_id, TaskStage.PRE_PROCESSING, pre_process_ids)
+    queue_tasks(job_id, TaskStage.PROCESSING, aligned_file_ids)
+    return len(pre_process_ids), len(aligned_file_ids)
+
+
+def run_batch(args: argparse.Namespace) -> int:
+    settings = SettingsManager()
+
+    # check everything we can before doing any work
+    if args.queue_only:
+        if args.export is not None or args.stream:
+            raise BatchError('--export and --stream can not be used with --queue-only')
+    elif args.export is None:
+        raise BatchError('--export is needed unless the job is only being queued')
+    else:
+        check_export_path(args.export)
+    if not settings.valid_api_config():
+        raise BatchError('The Google Vision API is not configured, run the GUI to set it up')
+
+    if args.resume is not None:
+        if args.inputs or args.form is not None:
+            raise BatchError('Input files and --form can not be used with --resume')
+
+        job_name = args.resume
+        job_id = get_job_id(job_name)
+        print(f'Resuming job "{job_name}"')
+
+        requeued = requeue_changed_regions(job_id)
+        if requeued:
+            print(f'The reference form was edited, {requeued} files will have their changed regions processed again')
+    else:
+        if not args.inputs or args.form is None:
+            raise BatchError('Input files and --form are needed to start a new job')
+
+        files = collect_input_files(args.inputs)
+        job_name = args.job_name or f'batch_{datetime.now():%Y%m%d_%H%M%S}'
+        print(f'Creating job "{job_name}" with {len(files)} input files')
+
+        job_id = set_up_job(job_name, args.form, files)
+
+    if args.queue_only:
+        pre_process_count, process_count = queue_job(job_id)
+        print(f'Queued {pre_process_count} files for pre-processing and {process_count} for OCR')
+        print(f'Start workers with: eagle_eye.py worker "{job_name}"')
+        return EXIT_SUCCESS
+
+    pre_process_workers = args.workers or settings.pre_processing_worker_count()
+    process_workers = args.ocr_workers or settings.processing_worker_count()
+
+    # OCR workers mostly wait on the network, only the alignment workers are sized against the cores
+    apply_cpu_plan(pre_process_workers)
+
+    control = ProcessingControl()
+    try:
+        pre_process_statuses, process_statuses = run_job(
+            job_id,
+            args.stream,
+            pre_process_workers,
+            process_workers,
+            settings.pre_processing_use_processes,
+            control,
+        )
+    except KeyboardInterrupt:
+        # anything left over is picked back up by --resume
+        cancel_tasks(job_id)
+        print(f'Cancelled, run with --resume "{job_name}" to finish the job')
+        return EXIT_CANCELLED
+
+    # process wide, so a stage that ran alongside others shares their peak
+    for label, peak in get_rss_monitor().peaks().items():
+        print(f'Peak memory while running {label}: {format_bytes(peak)}')
+
+    failed_fields, total_fields = count_validation_failures(job_id)
+    print(f'Validation: {failed_fields} of {total_fields} fields failed validation')
+
+    export_job(job_id, ExportMode[args.export_mode.upper()], args.export)
+    print(f'Exported results to: {args.export}')
+
+    failed_files = [
+        file_id
+        for file_id, status in (pre_process_statuses | process_statuses).items()
+        if status is FileStatus.FAILED
+    ]
+    if failed_files:
+        print(f'{len(failed_files)} files failed, see the log for details: {get_current_logfile()}')
+        return EXIT_FILE_ERRORS
+
+    return EXIT_SUCCESS
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    configure_root_logger(logging.INFO, console_level=None if args.verbose else logging.WARNING)
+
+    try:
+        release_stale_leases()
+        start_lease_heartbeat()
+        return run_batch(args)
+    except BatchError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return EXIT_USAGE_ERROR
+    finally:
+        shutdown_process_pool()
+        shutdown_ocr_loop()
+        shutdown_image_prefetcher()
+        shutdown_ocr_cache()
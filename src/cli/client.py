@@ -0,0 +1,107 @@
+import argparse
+import sys
+from pathlib import Path
+
+from src.util.export import ExportMode
+from src.util.service_client import ServiceClient, ServiceError
+
+from .batch import EXIT_FILE_ERRORS, EXIT_SUCCESS, EXIT_USAGE_ERROR
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='eagle_eye.py client',
+        description='Control jobs running in the background service (start it with "eagle_eye.py service")',
+    )
+    parser.add_argument('--port', type=int, help='Port the service listens on (default: from the settings)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    submit = commands.add_parser('submit', help='Start a job in the service, or attach to it if it is running')
+    submit.add_argument('job_name', help='Name of the job (create it in the GUI or with "batch --queue-only")')
+    submit.add_argument('--follow', action='store_true', help='Print file results until the job stops')
+
+    commands.add_parser('status', help='List the jobs the service has run')
+
+    for command, help_text in (
+            ('follow', 'Print file results until the job stops'),
+            ('pause', 'Pause a running job'),
+            ('resume', 'Resume a paused job'),
+            ('cancel', 'Cancel a running job'),
+    ):
+        command_parser = commands.add_parser(command, help=help_text)
+        command_parser.add_argument('job_name', help='Name of the job')
+
+    export = commands.add_parser('export', help='Export the results of a job the service ran')
+    export.add_argument('job_name', help='Name of the job')
+    export.add_argument(
+        '--export',
+        type=Path,
+        required=True,
+        help='Path of the .csv or .xlsx file to export to, inside the export directory of the service',
+    )
+    export.add_argument(
+        '--export-mode',
+        choices=[mode.name.lower() for mode in ExportMode],
+        default=ExportMode.FULL.name.lower(),
+        help='Which results to export (default: full)',
+    )
+
+    return parser.parse_args(argv)
+
+
+def print_job(job: dict) -> None:
+    counts = ', '.join(f'{name}: {count}' for name, count in sorted(job['counts'].items())) or 'no files done yet'
+    flag = ' (cancelling)' if job['cancelling'] else ' (paused)' if job['paused'] else ''
+    print(f'{job["job_name"]}: {job["state"]}{flag}, {counts}, {job["open_tasks"]} files open')
+
+
+def follow_job(client: ServiceClient, job: dict) -> int:
+    # detaching with Ctrl+C leaves the job running in the service
+    try:
+        for event in client.follow(job['job_id']):
+            print(f'{event["stage"]} {event["file_name"]}: {event["status"]}')
+    except KeyboardInterrupt:
+        print(f'Detached, "{job["job_name"]}" keeps running in the service')
+        return EXIT_SUCCESS
+
+    job = client.job(job['job_id'])
+    print_job(job)
+    return EXIT_FILE_ERRORS if job['counts'].get('FAILED') or job['state'] == 'ERROR' else EXIT_SUCCESS
+
+
+def run_command(client: ServiceClient, args: argparse.Namespace) -> int:
+    match args.command:
+        case 'submit':
+            job = client.submit(args.job_name)
+            print(f'Job "{job["job_name"]}" is running in the service')
+            return follow_job(client, job) if args.follow else EXIT_SUCCESS
+        case 'status':
+            jobs = client.jobs()
+            for job in jobs:
+                print_job(job)
+            if not jobs:
+                print('The service has not run any jobs')
+        case 'follow':
+            return follow_job(client, client.find_job(args.job_name))
+        case 'pause':
+            print_job(client.pause(client.find_job(args.job_name)['job_id']))
+        case 'resume':
+            print_job(client.resume(client.find_job(args.job_name)['job_id']))
+        case 'cancel':
+            print_job(client.cancel(client.find_job(args.job_name)['job_id']))
+        case 'export':
+            job = client.find_job(args.job_name)
+            result = client.export(job['job_id'], args.export, args.export_mode)
+            print(f'Exported results to: {result["path"]}')
+
+    return EXIT_SUCCESS
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+
+    try:
+        return run_command(ServiceClient(args.port), args)
+    except ServiceError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return EXIT_USAGE_ERROR
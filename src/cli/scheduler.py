@@ -0,0 +1,221 @@
+import logging
+import threading
+from collections import Counter
+from typing import Any
+
+from src.processing.control import ProcessingCancelled, ProcessingControl
+from src.processing.task_queue import cancel_tasks, count_open_tasks
+from src.util.status import FileStatus
+from src.util.types import ServiceJobState, TaskStage
+
+from .batch import get_file_name
+from .worker import IDLE_POLL_SECONDS, claim_next_task, run_claimed_task
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledJob:
+    def __init__(self, job_id: int, job_name: str):
+        self.job_id = job_id
+        self.job_name = job_name
+        # jobs share the scheduler's threads, a paused one hands its files back instead of sitting on them
+        self.control = ProcessingControl(release_when_paused=True)
+        self.state = ServiceJobState.RUNNING
+        self.counts: Counter[str] = Counter()
+
+        # owned by the scheduler's lock
+        self.in_flight = 0
+        self.last_claim = 0
+
+        self._events: list[dict[str, Any]] = []
+        self._condition = threading.Condition()
+
+    def is_running(self) -> bool:
+        return self.state is ServiceJobState.RUNNING
+
+    def is_cancelling(self) -> bool:
+        return self.is_running() and self.control.is_cancelled()
+
+    def record(self, stage: TaskStage, file_id: int, status: FileStatus | None) -> None:
+        status_name = status.name if status is not None else 'SKIPPED'
+        with self._condition:
+            self.counts[status_name] += 1
+            self._events.append({
+                'stage': stage.name,
+                'file_id': file_id,
+                'file_name': get_file_name(file_id),
+                'status': status_name,
+            })
+            self._condition.notify_all()
+
+    def finish(self, state: ServiceJobState) -> None:
+        with self._condition:
+            if not self.is_running():
+                return
+            self.state = state
+            self._condition.notify_all()
+        logger.info(f'Job {self.job_id} is {state.name}')
+
+    def events_since(self, since: int, timeout: float) -> tuple[list[dict[str, Any]], int]:
+        # long poll, returns as soon as there is something new or the job stops
+        with self._condition:
+            self._condition.wait_for(lambda: len(self._events) > since or not self.is_running(), timeout=timeout)
+            return self._events[since:], len(self._events)
+
+    def summary(self) -> dict[str, Any]:
+        with self._condition:
+            counts = dict(self.counts)
+
+        return {
+            'job_id': self.job_id,
+            'job_name': self.job_name,
+            'state': self.state.name,
+            'paused': self.control.is_paused(),
+            'cancelling': self.is_cancelling(),
+            'counts': counts,
+            'in_flight': self.in_flight,
+            'open_tasks': count_open_tasks(self.job_id),
+        }
+
+
+class JobScheduler:
+    def __init__(self, thread_count: int):
+        self._thread_count = max(1, thread_count)
+        self._jobs: dict[int, ScheduledJob] = {}
+        self._claim_sequence = 0
+        self._stopping = False
+
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._threads = [
+            threading.Thread(target=self._work, name=f'scheduler-{idx}', daemon=True)
+            for idx in range(self._thread_count)
+        ]
+
+    def thread_count(self) -> int:
+        return self._thread_count
+
+    def start(self) -> None:
+        for thread in self._threads:
+            thread.start()
+        logger.info(f'Started the job scheduler with {self._thread_count} threads')
+
+    def jobs(self) -> list[ScheduledJob]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def get(self, job_id: int) -> ScheduledJob | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def add(self, job: ScheduledJob) -> None:
+        with self._wake:
+            self._jobs[job.job_id] = job
+            self._wake.notify_all()
+
+    def wake(self) -> None:
+        # something changed that may let idle threads claim work, i.e. a job was resumed
+        with self._wake:
+            self._wake.notify_all()
+
+    def _candidates(self) -> list[ScheduledJob]:
+        # fair share: the job with the fewest files in flight goes first, ties go to whoever waited longest
+        with self._lock:
+            return sorted(
+                (
+                    job for job in self._jobs.values()
+                    if job.is_running() and not job.control.is_paused() and not job.control.is_cancelled()
+                ),
+                key=lambda job: (job.in_flight, job.last_claim),
+            )
+
+    def _claim_next(self) -> tuple[ScheduledJob, TaskStage, int] | None:
+        for job in self._candidates():
+            claimed = claim_next_task(job.job_id)
+            if claimed is None:
+                self._check_finished(job)
+                continue
+
+            with self._lock:
+                self._claim_sequence += 1
+                job.in_flight += 1
+                job.last_claim = self._claim_sequence
+
+            stage, file_id = claimed
+            return job, stage, file_id
+
+        return None
+
+    def _check_finished(self, job: ScheduledJob) -> None:
+        # other workers can still queue OCR or leave expired leases behind, only finish once nothing is open
+        with self._lock:
+            # files handed back on shutdown stay queued for whoever runs the job next
+            if job.in_flight or self._stopping:
+                return
+            cancelled = job.control.is_cancelled()
+
+        if cancelled:
+            # nothing should pick the job up again until it is submitted again
+            cancel_tasks(job.job_id)
+            job.finish(ServiceJobState.CANCELLED)
+            return
+
+        if count_open_tasks(job.job_id):
+            return
+
+        with self._lock:
+            if not job.in_flight:
+                job.finish(ServiceJobState.FINISHED)
+
+    def _run_claimed(self, job: ScheduledJob, stage: TaskStage, file_id: int) -> None:
+        try:
+            job.record(stage, file_id, run_claimed_task(job.job_id, file_id, stage, job.control))
+        except ProcessingCancelled:
+            pass
+        finally:
+            with self._wake:
+                job.in_flight -= 1
+                self._wake.notify_all()
+
+        self._check_finished(job)
+
+    def _work(self) -> None:
+        while True:
+            with self._lock:
+                if self._stopping:
+                    return
+
+            try:
+                claimed = self._claim_next()
+            except Exception:
+                logger.exception('Failed to claim a task')
+                claimed = None
+
+            if claimed is None:
+                with self._wake:
+                    if not self._stopping:
+                        self._wake.wait(IDLE_POLL_SECONDS)
+                continue
+
+            self._run_claimed(*claimed)
+
+    def cancel(self, job: ScheduledJob) -> None:
+        if not job.is_running():
+            return
+
+        # running files give up at their next checkpoint, the last one to stop marks the job as cancelled
+        job.control.cancel()
+        self._check_finished(job)
+
+    def shutdown(self) -> None:
+        # running files are handed back to the queue, submitting their job again picks them up
+        with self._wake:
+            self._stopping = True
+            for job in self._jobs.values():
+                job.control.cancel()
+            self._wake.notify_all()
+
+        for thread in self._threads:
+            thread.join()
+        for job in self.jobs():
+            job.finish(ServiceJobState.CANCELLED)
@@ -0,0 +1,299 @@
+import argparse
+import hmac
+import json
+import logging
+import sys
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+from src.processing.image_prefetch import shutdown_image_prefetcher
+from src.processing.ocr_loop import shutdown_ocr_loop
+from src.processing.process_pool import shutdown_process_pool
+from src.processing.task_queue import release_stale_leases, start_lease_heartbeat
+from src.util.cpu_governor import apply_cpu_plan
+from src.util.export import ExportMode
+from src.util.logging import configure_root_logger
+from src.util.ocr_cache import shutdown_ocr_cache
+from src.util.paths import LocalPaths
+from src.util.service_client import EVENTS_WAIT_SECONDS, SERVICE_HOST, SERVICE_TOKEN_HEADER, create_service_token
+from src.util.settings import SettingsManager
+
+from .batch import (
+    EXIT_SUCCESS, EXIT_USAGE_ERROR, BatchError, check_export_path, export_job, get_job_id, queue_job,
+)
+from .scheduler import JobScheduler, ScheduledJob
+
+logger = logging.getLogger(__name__)
+
+# a page in a browser can reach localhost too, it can only be told apart by the name it used to get here
+LOCAL_HOST_NAMES = ('127.0.0.1', 'localhost', '[::1]')
+
+
+class ServiceRequestError(Exception):
+    def __init__(self, status: HTTPStatus, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class JobService:
+    def __init__(self, thread_count: int):
+        # every job shares the scheduler's threads, so a new job slows the others down instead of piling on top of them
+        self.scheduler = JobScheduler(thread_count)
+        self._submit_lock = threading.Lock()
+
+    def start(self) -> None:
+        self.scheduler.start()
+
+    def jobs(self) -> list[ScheduledJob]:
+        return self.scheduler.jobs()
+
+    def get(self, job_id: int) -> ScheduledJob:
+        job = self.scheduler.get(job_id)
+        if job is None:
+            raise ServiceRequestError(HTTPStatus.NOT_FOUND, f'The service has not run job {job_id}')
+        return job
+
+    def submit(self, job_name: str) -> ScheduledJob:
+        try:
+            job_id = get_job_id(job_name)
+        except BatchError as e:
+            raise ServiceRequestError(HTTPStatus.NOT_FOUND, str(e))
+
+        with self._submit_lock:
+            # everyone asking for a running job shares it
+            existing = self.scheduler.get(job_id)
+            if existing is not None and existing.is_cancelling():
+                raise ServiceRequestError(
+                    HTTPStatus.CONFLICT,
+                    f'Job "{job_name}" is still being cancelled, submit it again once it stops',
+                )
+            if existing is not None and existing.is_running():
+                return existing
+
+            pre_process_count, process_count = queue_job(job_id)
+            logger.info(f'Queued {pre_process_count} files for pre-processing and {process_count} for OCR')
+
+            job = ScheduledJob(job_id, job_name)
+            self.scheduler.add(job)
+            return job
+
+    def resume(self, job_id: int) -> ScheduledJob:
+        job = self.get(job_id)
+        job.control.resume()
+        self.scheduler.wake()
+        return job
+
+    def cancel(self, job_id: int) -> ScheduledJob:
+        job = self.get(job_id)
+        self.scheduler.cancel(job)
+        return job
+
+    def shutdown(self) -> None:
+        self.scheduler.shutdown()
+
+
+class ServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port: int, service: JobService, token: str, export_dir: Path):
+        super().__init__((SERVICE_HOST, port), ServiceRequestHandler)
+        self.service = service
+        self.token = token
+        self.export_dir = export_dir
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    server: ServiceServer
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f'{self.address_string()}: {format % args}')
+
+    def _send_json(self, status: HTTPStatus, body: dict[str, Any]) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _check_request(self) -> None:
+        host = self.headers.get('Host', '')
+        port = str(self.server.server_address[1])
+        if host not in LOCAL_HOST_NAMES and host not in [f'{name}:{port}' for name in LOCAL_HOST_NAMES]:
+            raise ServiceRequestError(HTTPStatus.FORBIDDEN, f'Unknown host: {host}')
+
+        if not hmac.compare_digest(self.headers.get(SERVICE_TOKEN_HEADER, '').encode(), self.server.token.encode()):
+            raise ServiceRequestError(HTTPStatus.UNAUTHORIZED, 'Missing or wrong service token')
+
+        # browsers can send forms and plain text anywhere, JSON needs a request they are not allowed to make
+        has_body = int(self.headers.get('Content-Length', 0)) > 0
+        if self.command == 'POST' and (has_body or 'Content-Type' in self.headers):
+            if self.headers.get_content_type() != 'application/json':
+                raise ServiceRequestError(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, 'Request body must be JSON')
+
+    def _read_json(self) -> dict[str, Any]:
+        length = int(self.headers.get('Content-Length', 0))
+        if not length:
+            return {}
+
+        try:
+            return json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            raise ServiceRequestError(HTTPStatus.BAD_REQUEST, 'Request body is not valid JSON')
+
+    def _parse_path(self) -> tuple[list[str], dict[str, list[str]]]:
+        url = urlparse(self.path)
+        return [part for part in url.path.split('/') if part], parse_qs(url.query)
+
+    def _job_id(self, value: str) -> int:
+        if not value.isdigit():
+            raise ServiceRequestError(HTTPStatus.NOT_FOUND, f'Unknown job: {value}')
+        return int(value)
+
+    def _handle(self, route) -> None:
+        try:
+            self._check_request()
+            parts, query = self._parse_path()
+            self._send_json(HTTPStatus.OK, route(parts, query))
+        except ServiceRequestError as e:
+            self._send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            logger.exception(f'Service request failed: {self.command} {self.path}')
+            self._send_json(HTTPStatus.INTERNAL_SERVER_ERROR, {'error': str(e)})
+
+    def do_GET(self) -> None:
+        self._handle(self._route_get)
+
+    def do_POST(self) -> None:
+        self._handle(self._route_post)
+
+    def _route_get(self, parts: list[str], query: dict[str, list[str]]) -> dict[str, Any]:
+        service = self.server.service
+
+        match parts:
+            case ['jobs']:
+                return {'jobs': [job.summary() for job in service.jobs()]}
+            case ['jobs', job_id]:
+                return service.get(self._job_id(job_id)).summary()
+            case ['jobs', job_id, 'events']:
+                job = service.get(self._job_id(job_id))
+                since = query.get('since', ['0'])[0]
+                if not since.isdigit():
+                    raise ServiceRequestError(HTTPStatus.BAD_REQUEST, f'Bad event index: {since}')
+                events, next_index = job.events_since(int(since), EVENTS_WAIT_SECONDS)
+                return {'events': events, 'next': next_index, 'running': job.is_running()}
+            case _:
+                raise ServiceRequestError(HTTPStatus.NOT_FOUND, f'Unknown path: {self.path}')
+
+    def _route_post(self, parts: list[str], query: dict[str, list[str]]) -> dict[str, Any]:
+        service = self.server.service
+
+        match parts:
+            case ['jobs']:
+                body = self._read_json()
+                if not body.get('job_name'):
+                    raise ServiceRequestError(HTTPStatus.BAD_REQUEST, 'A job_name is needed')
+                return service.submit(body['job_name']).summary()
+            case ['jobs', job_id, 'pause']:
+                job = service.get(self._job_id(job_id))
+                job.control.pause()
+                return job.summary()
+            case ['jobs', job_id, 'resume']:
+                return service.resume(self._job_id(job_id)).summary()
+            case ['jobs', job_id, 'cancel']:
+                return service.cancel(self._job_id(job_id)).summary()
+            case ['jobs', job_id, 'export']:
+                return self._export(self._job_id(job_id))
+            case _:
+                raise ServiceRequestError(HTTPStatus.NOT_FOUND, f'Unknown path: {self.path}')
+
+    def _export(self, job_id: int) -> dict[str, Any]:
+        job = self.server.service.get(job_id)
+        if job.is_running():
+            raise ServiceRequestError(HTTPStatus.CONFLICT, f'Job {job_id} is still running')
+
+        body = self._read_json()
+        try:
+            # relative paths are taken from the export directory, nothing is written outside of it
+            export_dir = self.server.export_dir
+            export_path = (export_dir / body['path']).resolve()
+            if not export_path.is_relative_to(export_dir):
+                raise ServiceRequestError(HTTPStatus.FORBIDDEN, f'Exports can only be written under: {export_dir}')
+
+            mode = ExportMode[body.get('mode', ExportMode.FULL.name).upper()]
+            check_export_path(export_path)
+        except (KeyError, BatchError) as e:
+            raise ServiceRequestError(HTTPStatus.BAD_REQUEST, f'Bad export request: {e}')
+
+        export_path.parent.mkdir(parents=True, exist_ok=True)
+
+        export_job(job_id, mode, export_path)
+        return {'path': str(export_path)}
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='eagle_eye.py service',
+        description='Run jobs in a background service that keeps going when the GUI or a client is closed',
+    )
+    parser.add_argument('--port', type=int, help='Localhost port to listen on (default: from the settings)')
+    parser.add_argument(
+        '--threads',
+        type=int,
+        help='Number of files to work on at once, shared fairly between the running jobs (default: one per core)',
+    )
+    parser.add_argument(
+        '--export-dir',
+        type=Path,
+        help='Directory clients can export results to (default: "exports" in the working directory)',
+    )
+    parser.add_argument('--verbose', action='store_true', help='Print all log messages to the console')
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    configure_root_logger(logging.INFO, console_level=None if args.verbose else logging.WARNING)
+
+    settings = SettingsManager()
+    if not settings.valid_api_config():
+        print('Error: The Google Vision API is not configured, run the GUI to set it up', file=sys.stderr)
+        return EXIT_USAGE_ERROR
+
+    port = args.port or settings.service_port
+    thread_count = args.threads or settings.pre_processing_worker_count()
+    release_stale_leases()
+    start_lease_heartbeat()
+    apply_cpu_plan(thread_count)
+
+    export_dir = (args.export_dir or LocalPaths.exports_directory()).resolve()
+    export_dir.mkdir(parents=True, exist_ok=True)
+
+    service = JobService(thread_count)
+    try:
+        server = ServiceServer(port, service, create_service_token(), export_dir)
+    except OSError as e:
+        print(f'Error: Could not listen on port {port}: {e}', file=sys.stderr)
+        return EXIT_USAGE_ERROR
+
+    print(f'Processing service listening on http://{SERVICE_HOST}:{port}, press Ctrl+C to stop')
+    print(f'Results are exported to: {export_dir}')
+    service.start()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Stopping, handing the running files back to the queue')
+    finally:
+        server.server_close()
+        service.shutdown()
+        shutdown_process_pool()
+        shutdown_ocr_loop()
+        shutdown_image_prefetcher()
+        shutdown_ocr_cache()
+
+    return EXIT_SUCCESS
@@ -0,0 +1,66 @@
+import argparse
+import logging
+import sys
+from pathlib import Path
+
+from src.processing.job_shards import ShardError, merge_shard, relocate_bundle, split_job
+from src.util.logging import configure_root_logger
+
+from .batch import EXIT_SUCCESS, EXIT_USAGE_ERROR, BatchError, get_job_id
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='eagle_eye.py shard',
+        description='Split a job into bundles that can be processed on other machines, then merge their results back',
+    )
+    parser.add_argument('--verbose', action='store_true', help='Print all log messages to the console')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    split = commands.add_parser('split', help='Split the unfinished files of a job into shard bundles')
+    split.add_argument('job_name', help='Name of the job to split')
+    split.add_argument('--shards', type=int, required=True, help='Number of bundles to split the job into')
+    split.add_argument('--output', type=Path, required=True, help='Directory to write the bundles to')
+
+    relocate = commands.add_parser('relocate', help='Point a bundle at where it was copied to, run before processing it')
+    relocate.add_argument('bundle', type=Path, help='Shard bundle directory')
+
+    merge = commands.add_parser('merge', help='Merge the results of processed bundles back into their job')
+    merge.add_argument('bundles', nargs='+', type=Path, help='Shard bundle directories')
+
+    return parser.parse_args(argv)
+
+
+def run_command(args: argparse.Namespace) -> int:
+    match args.command:
+        case 'split':
+            bundle_dirs = split_job(get_job_id(args.job_name), args.shards, args.output)
+            for bundle_dir in bundle_dirs:
+                print(f'Wrote shard bundle: {bundle_dir}')
+            print(
+                f'On each machine run "shard relocate <bundle>", then process the job with EAGLE_EYE_WORKING_DIR '
+                f'set to the bundle, i.e. "eagle_eye.py worker "{args.job_name}""'
+            )
+        case 'relocate':
+            relocate_bundle(args.bundle)
+            print(f'Updated the paths in: {args.bundle}')
+        case 'merge':
+            for bundle_dir in args.bundles:
+                summary = merge_shard(bundle_dir)
+                print(
+                    f'Merged {summary.file_count} input files ({summary.result_rows} result rows) '
+                    f'from {bundle_dir} into job "{summary.job_name}"'
+                )
+
+    return EXIT_SUCCESS
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    configure_root_logger(logging.INFO, console_level=None if args.verbose else logging.WARNING)
+
+    try:
+        return run_command(args)
+    except (BatchError, ShardError) as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return EXIT_USAGE_ERROR
@@ -0,0 +1,191 @@
+import argparse
+import logging
+import sys
+import threading
+from collections import Counter
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from src.processing.control import ProcessingCancelled, ProcessingControl
+from src.processing.image_prefetch import prefetch_input_images, shutdown_image_prefetcher
+from src.processing.ocr_loop import shutdown_ocr_loop
+from src.processing.pre_process_worker import pre_process_file
+from src.processing.process_worker import process_file
+from src.processing.task_queue import (
+    TASK_OWNER,
+    claim_task,
+    count_open_tasks,
+    finish_task,
+    get_pending_file_ids,
+    queue_tasks,
+    release_stale_leases,
+    release_task,
+    start_lease_heartbeat,
+)
+from src.util.cpu_governor import apply_cpu_plan
+from src.util.logging import NamedLoggerAdapter, configure_root_logger, get_current_logfile
+from src.util.ocr_cache import shutdown_ocr_cache
+from src.util.settings import SettingsManager, current_settings
+from src.util.status import FileStatus
+from src.util.types import TaskStage
+
+from .batch import EXIT_CANCELLED, EXIT_FILE_ERRORS, EXIT_SUCCESS, EXIT_USAGE_ERROR, BatchError, get_file_name, get_job_id
+
+logger = logging.getLogger(__name__)
+
+# how long an idle worker waits before checking for new or expired tasks
+IDLE_POLL_SECONDS = 5
+
+# finishing aligned files first gets results into the DB as early as possible
+CLAIM_ORDER = (TaskStage.PROCESSING, TaskStage.PRE_PROCESSING)
+
+TaskFunction = Callable[[int, int, NamedLoggerAdapter, ProcessingControl], FileStatus | None]
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog='eagle_eye.py worker',
+        description='Claim and process files from a queued job, alongside any other workers sharing the job',
+    )
+    parser.add_argument('job_name', help='Name of the job to work on (queue it with "batch --queue-only")')
+    parser.add_argument('--threads', type=int, help='Number of files to work on at once (default: one per core)')
+    parser.add_argument('--verbose', action='store_true', help='Print all log messages to the console')
+
+    return parser.parse_args(argv)
+
+
+def pre_process_claimed(
+        job_id: int,
+        file_id: int,
+        log: NamedLoggerAdapter,
+        control: ProcessingControl,
+) -> FileStatus | None:
+    status = pre_process_file(job_id, file_id, log, control)
+
+    # queue the OCR before this task closes, so no worker ever sees the job as empty in between
+    if status in (FileStatus.SUCCESS, FileStatus.WARNING):
+        queue_tasks(job_id, TaskStage.PROCESSING, [file_id])
+    return status
+
+
+STAGE_FUNCTIONS: dict[TaskStage, TaskFunction] = {
+    TaskStage.PRE_PROCESSING: pre_process_claimed,
+    TaskStage.PROCESSING: process_file,
+}
+
+
+def run_claimed_task(job_id: int, file_id: int, stage: TaskStage, control: ProcessingControl) -> FileStatus | None:
+    log = NamedLoggerAdapter(logger, f'Worker: {file_id}')
+
+    try:
+        status = STAGE_FUNCTIONS[stage](job_id, file_id, log, control)
+    except ProcessingCancelled:
+        # hand the file back so another worker can pick it up
+        release_task(file_id, stage)
+        raise
+    except Exception:
+        log.exception(f'Unhandled exception during {stage.name}')
+        status = FileStatus.FAILED
+
+    finish_task(file_id, stage, status)
+    return status
+
+
+def claim_next_task(job_id: int) -> tuple[TaskStage, int] | None:
+    for stage in CLAIM_ORDER:
+        file_id = claim_task(job_id, stage)
+        if file_id is not None:
+            # start reading the images of the files likely to be claimed next
+            prefetch_count = current_settings().prefetch_images
+            if prefetch_count:
+                prefetch_input_images(stage, get_pending_file_ids(job_id, stage, prefetch_count))
+            return stage, file_id
+    return None
+
+
+class JobWorker:
+    def __init__(self, job_id: int, thread_count: int):
+        self._job_id = job_id
+        self._thread_count = max(1, thread_count)
+
+        self.control = ProcessingControl()
+        self._lock = threading.Lock()
+        self.counts: Counter[str] = Counter()
+
+    def _record(self, stage: TaskStage, file_id: int, status: FileStatus | None) -> None:
+        status_name = status.name if status is not None else 'SKIPPED'
+        with self._lock:
+            self.counts[status_name] += 1
+            print(f'{stage.name} {get_file_name(file_id)}: {status_name}')
+
+    def _work(self) -> None:
+        while not self.control.is_cancelled():
+            claimed = claim_next_task(self._job_id)
+            if claimed is None:
+                # other workers can still queue OCR or leave expired leases behind, only stop once nothing is open
+                if not count_open_tasks(self._job_id):
+                    return
+                self.control.wait_for_cancel(IDLE_POLL_SECONDS)
+                continue
+
+            stage, file_id = claimed
+            try:
+                status = run_claimed_task(self._job_id, file_id, stage, self.control)
+            except ProcessingCancelled:
+                return
+            self._record(stage, file_id, status)
+
+    def run(self) -> None:
+        with ThreadPoolExecutor(max_workers=self._thread_count, thread_name_prefix='worker') as executor:
+            futures = [executor.submit(self._work) for _ in range(self._thread_count)]
+            try:
+                wait(futures)
+            except KeyboardInterrupt:
+                print('Stopping, handing the running files back to the queue')
+                self.control.cancel()
+                raise
+
+            # surface anything that blew up outside of a task
+            for future in futures:
+                future.result()
+
+
+def run_worker(args: argparse.Namespace) -> int:
+    settings = SettingsManager()
+    if not settings.valid_api_config():
+        raise BatchError('The Google Vision API is not configured, run the GUI to set it up')
+
+    job_id = get_job_id(args.job_name)
+    thread_count = args.threads or settings.pre_processing_worker_count()
+    apply_cpu_plan(thread_count)
+    print(f'Worker {TASK_OWNER} joining job "{args.job_name}" with {thread_count} threads')
+
+    worker = JobWorker(job_id, thread_count)
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        return EXIT_CANCELLED
+
+    print(', '.join(f'{name}: {count}' for name, count in sorted(worker.counts.items())) or 'No files left to process')
+    if worker.counts[FileStatus.FAILED.name]:
+        print(f'Some files failed, see the log for details: {get_current_logfile()}')
+        return EXIT_FILE_ERRORS
+
+    return EXIT_SUCCESS
+
+
+def main(argv: list[str]) -> int:
+    args = parse_args(argv)
+    configure_root_logger(logging.INFO, console_level=None if args.verbose else logging.WARNING)
+
+    try:
+        release_stale_leases()
+        start_lease_heartbeat()
+        return run_worker(args)
+    except BatchError as e:
+        print(f'Error: {e}', file=sys.stderr)
+        return EXIT_USAGE_ERROR
+    finally:
+        shutdown_ocr_loop()
+        shutdown_image_prefetcher()
+        shutdown_ocr_cache()
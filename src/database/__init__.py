@@ -5,6 +5,9 @@ from sqlalchemy.orm import DeclarativeBase
 from ..util.paths import LocalPaths
 
 
+DB_LOCK_TIMEOUT = 30  # seconds
+
+
 class OrmBase(DeclarativeBase):
     pass
 
@@ -12,16 +15,25 @@ class OrmBase(DeclarativeBase):
 # TODO: A more elegant solution?
 from .job import Job
 from .reference_form import ReferenceForm
+from .processing_task import ProcessingTask
+from .result_fingerprint import ResultFingerprint
+from .page_ocr_words import PageOcrWords
+from .region_fingerprint import RegionFingerprint
 
 
 def create_db(path: Path, overwrite: bool = False) -> sqlalchemy.Engine:
-    engine = sqlalchemy.create_engine(f'sqlite+pysqlite:///{path}', echo=False)
+    # worker threads share the DB file, so wait on a locked DB instead of failing right away
+    engine = sqlalchemy.create_engine(
+        f'sqlite+pysqlite:///{path}',
+        echo=False,
+        connect_args={'timeout': DB_LOCK_TIMEOUT},
+    )
 
     if overwrite:
         path.unlink(missing_ok=True)
 
-    if not path.exists():
-        OrmBase.metadata.create_all(engine)
+    # only creates missing tables, so existing DBs pick up any new tables
+    OrmBase.metadata.create_all(engine)
 
     return engine
 
@@ -24,3 +24,13 @@ class InputFile(MappedAsDataclass, OrmBase):
 
     pre_process_result: Mapped[PreProcessResult] = relationship(init=False, back_populates="input_file")
     process_result: Mapped[ProcessResult] = relationship(init=False, back_populates="input_file")
+
+    #
+    # Custom Functions
+    #
+    def fully_processed(self) -> bool:
+        # results are saved a region at a time, so a file is only done once every region is in
+        if self.process_result is None:
+            return False
+
+        return len(self.process_result.regions) == len(self.job.reference_form.regions)
@@ -29,7 +29,7 @@ class Job(MappedAsDataclass, OrmBase):
 
     def _processing_statuses(self) -> list[bool]:
         # ignore container files
-        return [(file.process_result is not None) for file in self.input_files if not file.container_file]
+        return [file.fully_processed() for file in self.input_files if not file.container_file]
 
     def any_pre_processed(self) -> bool:
         statuses = self._pre_processing_statuses()
@@ -50,7 +50,7 @@ class Job(MappedAsDataclass, OrmBase):
     def all_verified(self) -> bool:
         all_verified = True
         for file in self.input_files:
-            if file.process_result is None:
+            if not file.fully_processed():
                 all_verified = False
                 break
             else:
@@ -0,0 +1,22 @@
+import datetime
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column, MappedAsDataclass
+
+from src.util.types import BoxBounds, OcrWord
+
+from . import OrmBase
+from .util import DbBoxBounds, DbOcrWords
+
+
+class PageOcrWords(MappedAsDataclass, OrmBase):
+    __tablename__ = "page_ocr_words"
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    # only used to clean up after the file, the words are found by the image they came from
+    input_file_id: Mapped[int] = mapped_column(ForeignKey("input_file.id"))
+
+    # the aligned image and OCR endpoint the words came from, and the part of the page that was OCR'd
+    fingerprint: Mapped[str] = mapped_column(index=True)
+    bounds: Mapped[BoxBounds] = mapped_column(DbBoxBounds)
+    words: Mapped[list[OcrWord]] = mapped_column(DbOcrWords)
+    created: Mapped[datetime.datetime] = mapped_column(default_factory=datetime.datetime.now)
@@ -0,0 +1,23 @@
+import datetime
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, MappedAsDataclass
+
+from src.util.types import TaskStage, TaskState
+
+from . import OrmBase
+
+
+class ProcessingTask(MappedAsDataclass, OrmBase):
+    __tablename__ = "processing_task"
+    __table_args__ = (UniqueConstraint("input_file_id", "stage"),)
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    job_id: Mapped[int] = mapped_column(ForeignKey("job.id"))
+    input_file_id: Mapped[int] = mapped_column(ForeignKey("input_file.id"))
+
+    stage: Mapped[TaskStage]
+    state: Mapped[TaskState] = mapped_column(default=TaskState.PENDING)
+    attempts: Mapped[int] = mapped_column(default=0)
+
+    lease_owner: Mapped[str | None] = mapped_column(nullable=True, default=None)
+    leased_at: Mapped[datetime.datetime | None] = mapped_column(nullable=True, default=None)
@@ -0,0 +1,18 @@
+import datetime
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, MappedAsDataclass
+
+from . import OrmBase
+
+
+class RegionFingerprint(MappedAsDataclass, OrmBase):
+    __tablename__ = "region_fingerprint"
+    __table_args__ = (UniqueConstraint("input_file_id", "region_local_id"),)
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    input_file_id: Mapped[int] = mapped_column(ForeignKey("input_file.id"))
+    region_local_id: Mapped[int]
+
+    # a hash of the form region the processed region was built from
+    fingerprint: Mapped[str]
+    created: Mapped[datetime.datetime] = mapped_column(default_factory=datetime.datetime.now)
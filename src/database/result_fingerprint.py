@@ -0,0 +1,21 @@
+import datetime
+from sqlalchemy import ForeignKey, UniqueConstraint
+from sqlalchemy.orm import Mapped, mapped_column, MappedAsDataclass
+
+from src.util.status import FileStatus
+from src.util.types import TaskStage
+
+from . import OrmBase
+
+
+class ResultFingerprint(MappedAsDataclass, OrmBase):
+    __tablename__ = "result_fingerprint"
+    __table_args__ = (UniqueConstraint("input_file_id", "stage"),)
+
+    id: Mapped[int] = mapped_column(init=False, primary_key=True)
+    input_file_id: Mapped[int] = mapped_column(ForeignKey("input_file.id"))
+
+    stage: Mapped[TaskStage]
+    fingerprint: Mapped[str] = mapped_column(index=True)
+    status: Mapped[FileStatus]
+    created: Mapped[datetime.datetime] = mapped_column(default_factory=datetime.datetime.now)
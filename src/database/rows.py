@@ -0,0 +1,137 @@
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Any
+from sqlalchemy import Connection, Table, delete, insert, select, update
+
+from . import OrmBase
+from .input_file import InputFile
+from .job import Job
+from .processing_task import ProcessingTask
+from .reference_form import ReferenceForm
+from .util import DbPath
+
+# keeps each IN clause well under SQLite's variable limit
+ID_CHUNK_SIZE = 500
+
+Rows = dict[Table, list[dict[str, Any]]]
+
+
+def table_of(model: type[OrmBase]) -> Table:
+    return model.__table__
+
+
+def chunks(ids: Iterable[int]) -> Iterator[list[int]]:
+    ids = list(ids)
+    for start in range(0, len(ids), ID_CHUNK_SIZE):
+        yield ids[start:start + ID_CHUNK_SIZE]
+
+
+def split_tables() -> tuple[list[Table], list[Table]]:
+    # everything that hangs off an input file is a result, the rest of the tables hang off the reference form
+    skipped = {table_of(ReferenceForm), table_of(Job), table_of(InputFile), table_of(ProcessingTask)}
+    result_tables: list[Table] = []
+    form_tables: list[Table] = []
+
+    # sorted parents first, so a table's parents are always classified before it
+    for table in OrmBase.metadata.sorted_tables:
+        if table in skipped:
+            continue
+
+        parents = {fk.column.table for fk in table.foreign_keys}
+        if parents & ({table_of(InputFile)} | set(result_tables)):
+            result_tables.append(table)
+        else:
+            form_tables.append(table)
+
+    return form_tables, result_tables
+
+
+def select_subtree(connection: Connection, root: Table, root_ids: Iterable[int], tables: list[Table]) -> Rows:
+    # rows of the root plus every row in the tables that points at a row already picked up
+    kept_ids = {root: set(root_ids)}
+    rows: Rows = {}
+
+    for table in [root, *tables]:
+        if table is root:
+            table_rows = [
+                dict(row._mapping)
+                for chunk in chunks(kept_ids[root])
+                for row in connection.execute(select(table).where(table.c.id.in_(chunk)))
+            ]
+        else:
+            parent_fks = [fk for fk in table.foreign_keys if fk.column.table in kept_ids]
+            if not parent_fks:
+                continue
+
+            # a row can point at picked up rows through more than one key, keep it once
+            rows_by_id = {}
+            for fk in parent_fks:
+                for chunk in chunks(kept_ids[fk.column.table]):
+                    for row in connection.execute(select(table).where(fk.parent.in_(chunk))):
+                        rows_by_id[row.id] = dict(row._mapping)
+            table_rows = list(rows_by_id.values())
+
+        rows[table] = sorted(table_rows, key=lambda row: row['id'])
+        kept_ids[table] = {row['id'] for row in table_rows}
+
+    return rows
+
+
+def insert_rows(
+        connection: Connection,
+        rows: Rows,
+        tables: Iterable[Table],
+        keep_ids: bool,
+        id_maps: dict[Table, dict[int, int]],
+        rebase: Callable[[Path], Path] | None = None,
+) -> int:
+    text_field_table = OrmBase.metadata.tables['processed_text_field']
+
+    inserted = 0
+    for table in tables:
+        id_map = id_maps.setdefault(table, {})
+        path_columns = [column.name for column in table.columns if isinstance(column.type, DbPath)]
+
+        for row in rows.get(table, []):
+            values = dict(row)
+            old_id = values['id'] if keep_ids else values.pop('id')
+
+            for fk in table.foreign_keys:
+                parent_map = id_maps.get(fk.column.table)
+                if parent_map is not None and values[fk.parent.name] is not None:
+                    values[fk.parent.name] = parent_map[values[fk.parent.name]]
+
+            # links to the previous file's field are not a foreign key, anything outside the copy is dropped
+            if table is text_field_table and values['linked_field_id'] is not None:
+                values['linked_field_id'] = id_map.get(values['linked_field_id'])
+
+            if rebase is not None:
+                for name in path_columns:
+                    if values[name] is not None:
+                        values[name] = rebase(values[name])
+
+            result = connection.execute(insert(table).values(values))
+            id_map[old_id] = old_id if keep_ids else result.inserted_primary_key[0]
+            inserted += 1
+
+    return inserted
+
+
+def delete_rows(connection: Connection, rows: Rows, tables: list[Table]) -> None:
+    # children first
+    for table in reversed(tables):
+        for chunk in chunks(row['id'] for row in rows.get(table, [])):
+            connection.execute(delete(table).where(table.c.id.in_(chunk)))
+
+
+def delete_subtree(connection: Connection, root: Table, root_ids: Iterable[int], tables: list[Table]) -> None:
+    rows = select_subtree(connection, root, root_ids, tables)
+
+    # links from the next file's fields are not a foreign key, they would point at nothing
+    text_field_table = OrmBase.metadata.tables['processed_text_field']
+    for chunk in chunks(row['id'] for row in rows.get(text_field_table, [])):
+        connection.execute(
+            update(text_field_table).where(text_field_table.c.linked_field_id.in_(chunk)).values(linked_field_id=None)
+        )
+
+    delete_rows(connection, rows, [root, *tables])
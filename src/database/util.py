@@ -1,8 +1,9 @@
+import json
 from collections.abc import Iterable
 from pathlib import Path
 from sqlalchemy import types
 
-from src.util.types import BoxBounds
+from src.util.types import BoxBounds, OcrWord
 
 
 class DbBoxBounds(types.TypeDecorator):
@@ -49,3 +50,23 @@ class DbPath(types.TypeDecorator):
 
     def process_result_value(self, value: str | None, dialect) -> BoxBounds | None:
         return Path(value) if value is not None else value
+
+
+class DbOcrWords(types.TypeDecorator):
+    impl = types.Text
+
+    def process_bind_param(self, value: Iterable[OcrWord] | None, dialect) -> str | None:
+        if value is not None:
+            # a flat list per word keeps a page of words to a few KB
+            value = json.dumps([[word.text, *word.bounds, word.space_after] for word in value], separators=(',', ':'))
+
+        return value
+
+    def process_result_value(self, value: str | None, dialect) -> list[OcrWord] | None:
+        if value is None:
+            return value
+
+        return [
+            OcrWord(text=text, bounds=BoxBounds(x, y, width, height), space_after=space_after)
+            for text, x, y, width, height, space_after in json.loads(value)
+        ]
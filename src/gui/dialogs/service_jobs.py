@@ -0,0 +1,121 @@
+import logging
+from typing import Any
+
+from PyQt6.QtCore import pyqtSlot, QTimer
+from PyQt6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QDialog, QTableWidget, QTableWidgetItem, QProgressBar, QLabel,
+    QHeaderView, QAbstractItemView,
+)
+
+from src.util.service_client import ServiceClient, ServiceError
+
+logger = logging.getLogger(__name__)
+
+REFRESH_INTERVAL_MS = 2000
+
+
+class ServiceJobs(QDialog):
+    def __init__(self, parent: QWidget | None = None):
+        super().__init__(parent)
+        self.setWindowTitle('Background Jobs')
+        self.setMinimumWidth(650)
+
+        self._client = ServiceClient()
+        self._job_ids: list[int] = []
+
+        self.status_label = QLabel()
+
+        self.job_table = QTableWidget(0, 4, self)
+        self.job_table.setHorizontalHeaderLabels(('Job', 'State', 'Progress', 'Failed'))
+        self.job_table.horizontalHeader().setSectionResizeMode(2, QHeaderView.ResizeMode.Stretch)
+        self.job_table.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
+        self.job_table.setSelectionMode(QAbstractItemView.SelectionMode.SingleSelection)
+        self.job_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+
+        self.pause_button = QPushButton('Pause')
+        self.pause_button.pressed.connect(lambda: self.run_job_action(self._client.pause))
+        self.resume_button = QPushButton('Resume')
+        self.resume_button.pressed.connect(lambda: self.run_job_action(self._client.resume))
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.pressed.connect(lambda: self.run_job_action(self._client.cancel))
+
+        self.close_button = QPushButton('Close')
+        self.close_button.pressed.connect(self.close)
+
+        # the service is polled while the dialog is open
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(REFRESH_INTERVAL_MS)
+        self.refresh_timer.timeout.connect(self.refresh)
+
+        self._set_up_layout()
+        self.refresh()
+        self.refresh_timer.start()
+
+    def _set_up_layout(self) -> None:
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.pause_button)
+        button_layout.addWidget(self.resume_button)
+        button_layout.addWidget(self.cancel_button)
+        button_layout.addStretch()
+        button_layout.addWidget(self.close_button)
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.status_label)
+        layout.addWidget(self.job_table)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def _set_job_row(self, row: int, job: dict[str, Any]) -> None:
+        # tasks are counted for both stages, OCR tasks join the total as files finish aligning
+        done = sum(job['counts'].values())
+        total = done + job['open_tasks']
+
+        state = job['state']
+        if job['cancelling']:
+            state += ' (cancelling)'
+        elif job['paused']:
+            state += ' (paused)'
+
+        self.job_table.setItem(row, 0, QTableWidgetItem(job['job_name']))
+        self.job_table.setItem(row, 1, QTableWidgetItem(state))
+        self.job_table.setItem(row, 3, QTableWidgetItem(str(job['counts'].get('FAILED', 0))))
+
+        progress = self.job_table.cellWidget(row, 2)
+        if progress is None:
+            progress = QProgressBar()
+            self.job_table.setCellWidget(row, 2, progress)
+        progress.setRange(0, max(total, 1))
+        progress.setValue(done if total else 1)
+        progress.setFormat(f'{done} / {total} tasks (%p%)')
+
+    @pyqtSlot()
+    def refresh(self) -> None:
+        try:
+            jobs = self._client.jobs()
+        except ServiceError as e:
+            self.status_label.setText(str(e))
+            self.job_table.setRowCount(0)
+            self._job_ids = []
+            return
+
+        running = sum(1 for job in jobs if job['state'] == 'RUNNING')
+        self.status_label.setText(f'{running} jobs running, {len(jobs) - running} stopped')
+
+        self.job_table.setRowCount(len(jobs))
+        self._job_ids = [job['job_id'] for job in jobs]
+        for row, job in enumerate(jobs):
+            self._set_job_row(row, job)
+
+    def run_job_action(self, action) -> None:
+        row = self.job_table.currentRow()
+        if row < 0 or row >= len(self._job_ids):
+            return
+
+        try:
+            action(self._job_ids[row])
+        except ServiceError as e:
+            logger.warning(f'Background job action failed: {e}')
+            self.status_label.setText(str(e))
+            return
+
+        self.refresh()
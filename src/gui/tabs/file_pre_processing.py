@@ -1,10 +1,16 @@
-from PyQt6.QtCore import pyqtSlot
 from sqlalchemy.orm import Session
 
+from PyQt6.QtCore import pyqtSlot, pyqtSignal
+from PyQt6.QtWidgets import QCheckBox
+
 from src.database import DB_ENGINE
 from src.database.job import Job
 from src.processing.pre_process_worker import PreProcessingWorker
-from src.util.types import FileDetails
+from src.processing.process_pool import get_process_pool
+from src.processing.task_queue import get_unfinished_file_ids
+from src.util.settings import SettingsManager
+from src.util.status import FileStatus
+from src.util.types import FileDetails, TaskStage
 
 from .processing_step import ProcessingStep
 from ..widgets.file.file_status_list import FileStatusItem, ListMode
@@ -12,12 +18,36 @@ from ..widgets.pre_processing_details import PreProcessingDetails
 
 
 class FilePreProcessing(ProcessingStep):
+    fileAligned = pyqtSignal(int)
+
     def __init__(self):
         super().__init__(
             step_button_text='Pre-Process Files',
             details_cls=PreProcessingDetails,
+            worker_count=SettingsManager().pre_processing_worker_count(),
+            task_stage=TaskStage.PRE_PROCESSING,
         )
 
+        self.stream_processing = QCheckBox('Start OCR As Files Align')
+        self.stream_processing.setToolTip('Send each file to OCR processing as soon as it has been aligned')
+        self.button_layout.insertWidget(1, self.stream_processing)
+        self.check_api_config()
+
+    def check_api_config(self) -> None:
+        # streaming into OCR needs a working API config, it stays opt-in so the usual two step flow is unchanged
+        self.stream_processing.setDisabled(not SettingsManager().valid_api_config())
+
+    def set_view_only(self, view_only: bool) -> None:
+        super().set_view_only(view_only)
+        self.stream_processing.setVisible(not view_only)
+
+    def update_control_state(self) -> None:
+        super().update_control_state()
+        self.stream_processing.setVisible(not self.process_file_button.isHidden())
+
+    def streaming_enabled(self) -> bool:
+        return self.stream_processing.isEnabled() and self.stream_processing.isChecked()
+
     def load_job(self, job: Job | int | None, load_all: bool = False) -> None:
         super().load_job(job)
         if job is None:
@@ -30,7 +60,8 @@ class FilePreProcessing(ProcessingStep):
 
             # If any files had a pre-processing result, add them all
             if load_all or job.any_pre_processed():
-                self.file_list.load_job(ListMode.PRE_PROCESS, job)
+                unfinished_ids = get_unfinished_file_ids(job.id, TaskStage.PRE_PROCESSING)
+                self.file_list.load_job(ListMode.PRE_PROCESS, job, unfinished_ids)
 
         # Run GUI updates based if all our items are complete
         self.update_control_state()
@@ -40,9 +71,21 @@ class FilePreProcessing(ProcessingStep):
         self.file_list.add_files(files)
         self.update_control_state()
 
+    @pyqtSlot(int, FileStatus)
+    def worker_status_update(self, db_id: int, status: FileStatus) -> None:
+        super().worker_status_update(db_id, status)
+
+        if status in (FileStatus.SUCCESS, FileStatus.WARNING) and self.streaming_enabled():
+            self.fileAligned.emit(db_id)
+
+    def prefetch_images(self, file_ids: list[int]) -> None:
+        # child processes read their own images
+        if not SettingsManager().pre_processing_use_processes:
+            super().prefetch_images(file_ids)
+
     def start_worker(self, item: FileStatusItem) -> None:
-        worker = PreProcessingWorker(self._job_db_id, item.get_id(), self.thread_mutex)
+        process_pool = get_process_pool() if SettingsManager().pre_processing_use_processes else None
+        worker = PreProcessingWorker(self._job_db_id, item.get_id(), process_pool=process_pool, control=self.control)
         worker.updateStatus.connect(self.worker_status_update)
-        worker.processingComplete.connect(self.worker_complete)
-        
+
         super().start_thread(item, worker)
@@ -1,12 +1,16 @@
 from sqlalchemy.orm import Session
 
+from PyQt6.QtCore import pyqtSlot
 from PyQt6.QtGui import QIcon
 
 from src.database import DB_ENGINE
+from src.database.input_file import InputFile
 from src.database.job import Job
 from src.processing.process_worker import ProcessWorker
+from src.processing.task_queue import get_unfinished_file_ids
 from src.util.resources import GENERIC_ICON_PATH
 from src.util.settings import SettingsManager
+from src.util.types import TaskStage
 
 from .processing_step import ProcessingStep
 from ..widgets.file.file_status_list import FileStatusItem, ListMode
@@ -17,8 +21,14 @@ class FileProcessing(ProcessingStep):
         super().__init__(
             step_button_text='Process Files',
             details_cls=None,  # TODO: Should we show any details?
+            worker_count=SettingsManager().processing_worker_count(),
+            task_stage=TaskStage.PROCESSING,
         )
 
+        # set while files are being streamed in from pre-processing
+        self._streaming: bool = False
+        self._streamed: bool = False
+
         self.check_api_config()
 
     def check_api_config(self) -> None:
@@ -36,6 +46,8 @@ class FileProcessing(ProcessingStep):
 
     def load_job(self, job: Job | int | None) -> None:
         super().load_job(job)
+        self._streaming = False
+        self._streamed = False
         if job is None:
             return
 
@@ -43,14 +55,65 @@ class FileProcessing(ProcessingStep):
             job = session.get(Job, job) if isinstance(job, int) else job
             self._job_db_id = job.id
 
-            self.file_list.load_job(ListMode.PROCESS, job)
+            unfinished_ids = get_unfinished_file_ids(job.id, TaskStage.PROCESSING)
+            self.file_list.load_job(ListMode.PROCESS, job, unfinished_ids)
 
         # Run GUI updates based if all our items are complete
         self.update_control_state()
 
+    def update_control_state(self) -> None:
+        super().update_control_state()
+
+        # more files can still arrive from pre-processing, which is also what starts them
+        if self._streaming:
+            self.continue_button.setVisible(False)
+            self.process_file_button.setDisabled(True)
+
+    def has_streamed(self) -> bool:
+        return self._streamed
+
+    def start_stream(self, job_id: int) -> None:
+        if not self._streamed:
+            self.load_job(job_id)
+
+        self._streaming = True
+        self._streamed = True
+        self.control.reset()
+
+    @pyqtSlot()
+    def end_stream(self) -> None:
+        self._streaming = False
+        if not self.worker_pool.is_busy():
+            self.update_control_state()
+
+    @pyqtSlot()
+    def cancel_stream(self) -> None:
+        # files that already started OCR are stopped too, not just the ones still to come
+        self._streaming = False
+        if self.worker_pool.is_busy():
+            self.cancel_processing()
+        else:
+            self.control.cancel()
+            self.update_control_state()
+
+    @pyqtSlot(int)
+    def queue_file(self, file_id: int) -> None:
+        # stragglers that finish aligning after a cancel are left for the next run
+        if self.control.is_cancelled():
+            return
+
+        with Session(DB_ENGINE) as session:
+            file = session.get(InputFile, file_id)
+            linked_file = None
+            if file.linked_input_file_id is not None:
+                linked_file = session.get(InputFile, file.linked_input_file_id)
+
+            item = self.file_list.add_input_file(file, linked_file)
+
+        self._start_item_processing(item)
+
     def start_worker(self, item: FileStatusItem) -> None:
-        worker = ProcessWorker(self._job_db_id, item.get_id(), self.thread_mutex)
+        worker = ProcessWorker(self._job_db_id, item.get_id(), control=self.control)
         worker.updateStatus.connect(self.worker_status_update)
-        worker.processingComplete.connect(self.worker_complete)
 
         super().start_thread(item, worker)
@@ -5,6 +5,8 @@ from PyQt6.QtCore import pyqtSlot, pyqtSignal
 from PyQt6.QtWidgets import QWidget, QTabWidget, QVBoxLayout
 
 from src.database import Job, DB_ENGINE
+from src.database.input_file import InputFile
+from src.util.status import FileStatus, is_finished
 from src.util.validation import get_verified_icon
 
 from ..widgets.ocr_results.file_ocr_results import FileOcrResults
@@ -14,11 +16,17 @@ logger = logging.getLogger(__name__)
 
 class OcrResultCheck(QWidget):
     continueToNextStep = pyqtSignal()
+    fileOpened = pyqtSignal(int)
 
     def __init__(self):
         super().__init__()
+        self._tab_file_ids: list[int] = []
+        self._filled_file_ids: set[int] = set()
 
         self.file_tabs = QTabWidget()
+        # only a tab the user picks counts, adding tabs while loading also changes the current one
+        self.file_tabs.tabBarClicked.connect(self.handle_file_tab_opened)
+        self.file_tabs.currentChanged.connect(self.handle_current_tab_change)
 
         self._set_up_layout()
 
@@ -28,10 +36,21 @@ class OcrResultCheck(QWidget):
         self.setLayout(layout)
 
     def load_job(self, job: Job | int | None) -> None:
-        self.file_tabs.clear()
-        if job is None:
-            return
+        self._tab_file_ids.clear()
+        self._filled_file_ids.clear()
+
+        # tabs are added empty, only the one that ends up shown is filled in here
+        self.file_tabs.blockSignals(True)
+        try:
+            self.file_tabs.clear()
+            if job is not None:
+                self._add_file_tabs(job)
+        finally:
+            self.file_tabs.blockSignals(False)
 
+        self._fill_tab(self.file_tabs.currentIndex())
+
+    def _add_file_tabs(self, job: Job | int) -> None:
         with Session(DB_ENGINE) as session:
             job = session.get(Job, job) if isinstance(job, int) else job
 
@@ -42,8 +61,8 @@ class OcrResultCheck(QWidget):
 
                 file_tab = FileOcrResults()
                 file_tab.verificationChange.connect(self.handle_verification_change)
-                file_tab.load_input_file(file)
 
+                self._tab_file_ids.append(file.id)
                 tab_idx = self.file_tabs.addTab(file_tab, file.path.name)
 
                 # Add an icon to reflect the verification status
@@ -51,6 +70,45 @@ class OcrResultCheck(QWidget):
                     all_verified = all([region.human_verified for region in file.process_result.regions.values()])
                     self.file_tabs.setTabIcon(tab_idx, get_verified_icon(all_verified))
 
+    def _fill_tab(self, index: int) -> None:
+        # building a file's results is slow, so it waits until its tab is shown
+        if not 0 <= index < len(self._tab_file_ids):
+            return
+
+        file_id = self._tab_file_ids[index]
+        if file_id in self._filled_file_ids:
+            return
+
+        self._filled_file_ids.add(file_id)
+        self.file_tabs.widget(index).load_input_file(file_id)
+
+    @pyqtSlot(int)
+    def handle_current_tab_change(self, index: int) -> None:
+        self._fill_tab(index)
+
+    @pyqtSlot(int)
+    def handle_file_tab_opened(self, index: int) -> None:
+        # lets processing move a file that is not done yet to the front of its queue
+        if 0 <= index < len(self._tab_file_ids):
+            self.fileOpened.emit(self._tab_file_ids[index])
+
+    @pyqtSlot(int, FileStatus)
+    def file_processed(self, file_id: int, status: FileStatus) -> None:
+        # files can finish while results are being checked, a tab that is not shown is filled in once it is opened
+        if file_id not in self._tab_file_ids or not is_finished(status):
+            return
+
+        tab_idx = self._tab_file_ids.index(file_id)
+        self._filled_file_ids.discard(file_id)
+        if tab_idx == self.file_tabs.currentIndex():
+            self._fill_tab(tab_idx)
+
+        with Session(DB_ENGINE) as session:
+            file = session.get(InputFile, file_id)
+            if file.process_result is not None:
+                all_verified = all([region.human_verified for region in file.process_result.regions.values()])
+                self.file_tabs.setTabIcon(tab_idx, get_verified_icon(all_verified))
+
     @pyqtSlot(bool, bool)
     def handle_verification_change(self, new_status: bool, continue_check: bool) -> None:
         current_idx = self.file_tabs.currentIndex()
@@ -65,3 +123,4 @@ class OcrResultCheck(QWidget):
             else:
                 # Move to the next tab
                 self.file_tabs.setCurrentIndex(current_idx + 1)
+                self.handle_file_tab_opened(current_idx + 1)
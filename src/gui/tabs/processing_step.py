@@ -1,27 +1,56 @@
+import logging
 from typing import Type
 
-from PyQt6.QtCore import pyqtSlot, QThread, QMutex, pyqtSignal, QObject
+from PyQt6.QtCore import pyqtSlot, pyqtSignal, QObject
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QPushButton, QCheckBox, QHBoxLayout, QTreeWidgetItem, QTreeWidgetItemIterator,
 )
 
 from src.database.job import Job
+from src.processing.control import ProcessingControl
+from src.processing.image_prefetch import prefetch_input_images
+from src.processing.memory_budget import format_bytes, get_rss_monitor
+from src.processing.task_queue import cancel_tasks, queue_tasks
+from src.processing.worker_pool import WorkerPool
+from src.util.settings import SettingsManager
 from src.util.status import FileStatus, is_finished
+from src.util.types import TaskStage
 
 from src.gui.widgets.file.file_status_list import FileStatusList, FileStatusItem
 
+logger = logging.getLogger(__name__)
+
 
 class ProcessingStep(QWidget):
     continueToNextStep = pyqtSignal()
-
-    def __init__(self, step_button_text: str, details_cls: Type[QWidget] | None):
+    processingStarted = pyqtSignal()
+    processingFinished = pyqtSignal()
+    processingCancelled = pyqtSignal()
+    fileStatusChanged = pyqtSignal(int, FileStatus)
+
+    def __init__(
+            self,
+            step_button_text: str,
+            details_cls: Type[QWidget] | None,
+            worker_count: int,
+            task_stage: TaskStage,
+    ):
         super().__init__()
         self._job_db_id: int | None = None
         self._step_button_text = step_button_text
+        self._task_stage = task_stage
+
+        # shared with every worker this step starts, lets a run be paused or cancelled between steps
+        self.control = ProcessingControl()
 
-        self.thread_idx: int = 0
-        self.thread_mutex: QMutex = QMutex()
-        self.threads: dict[int, tuple[QThread, QObject]] = {}
+        # files a reviewer asked for, they go ahead of everything else
+        self._priority_ids: set[int] = set()
+
+        self.worker_pool = WorkerPool(worker_count, self)
+        self.worker_pool.allTasksComplete.connect(self.update_control_state)
+        self.worker_pool.allTasksComplete.connect(self.processingFinished)
+        self.worker_pool.allTasksComplete.connect(self.log_memory_usage)
+        self.worker_pool.set_prefetch(self.prefetch_images, SettingsManager().prefetch_images)
 
         self.file_list = FileStatusList()
         self.file_list.currentItemChanged.connect(self.selected_file_changed)
@@ -38,6 +67,12 @@ class ProcessingStep(QWidget):
         self.continue_button = QPushButton('Continue')
         self.continue_button.pressed.connect(self.continueToNextStep)
 
+        self.pause_button = QPushButton('Pause')
+        self.pause_button.pressed.connect(self.toggle_pause)
+
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.pressed.connect(self.cancel_processing)
+
         self._initial_state()
         self._set_up_layout()
 
@@ -49,17 +84,22 @@ class ProcessingStep(QWidget):
         # Hide the next step button
         self.continue_button.setVisible(False)
 
+        # Nothing is running yet
+        self.update_run_buttons()
+
     def _set_up_layout(self) -> None:
         layout = QVBoxLayout()
         layout.addWidget(self.file_list)
         layout.addWidget(self.step_details)
 
-        button_layout = QHBoxLayout()
-        button_layout.addStretch()
-        button_layout.addWidget(self.auto_process)
-        button_layout.addWidget(self.process_file_button)
-        button_layout.addWidget(self.continue_button)
-        layout.addLayout(button_layout)
+        self.button_layout = QHBoxLayout()
+        self.button_layout.addStretch()
+        self.button_layout.addWidget(self.auto_process)
+        self.button_layout.addWidget(self.pause_button)
+        self.button_layout.addWidget(self.cancel_button)
+        self.button_layout.addWidget(self.process_file_button)
+        self.button_layout.addWidget(self.continue_button)
+        layout.addLayout(self.button_layout)
 
         self.setLayout(layout)
 
@@ -68,8 +108,24 @@ class ProcessingStep(QWidget):
         self.auto_process.setVisible(not view_only)
         self.process_file_button.setVisible(not view_only)
         self.continue_button.setVisible(not view_only)
+        if view_only:
+            self.pause_button.setVisible(False)
+            self.cancel_button.setVisible(False)
+
+    def update_run_buttons(self) -> None:
+        running = self.worker_pool.is_busy()
+        self.pause_button.setVisible(running)
+        self.cancel_button.setVisible(running)
+        if not running:
+            self.pause_button.setText('Pause')
+            self.pause_button.setDisabled(False)
+            self.cancel_button.setDisabled(False)
 
     def update_control_state(self) -> None:
+        # the checks below read the item statuses, so apply anything still waiting first
+        self.file_list.flush_status_updates()
+        self.update_run_buttons()
+
         # Check if we have no files
         if not self.file_list.topLevelItemCount():
             self._initial_state()
@@ -89,6 +145,7 @@ class ProcessingStep(QWidget):
 
     def load_job(self, job: Job | int | None) -> None:
         self.file_list.clear()
+        self._priority_ids.clear()
         self._job_db_id = None if job is None else job.id if isinstance(job, Job) else job
 
     def all_items_processed(self) -> bool:
@@ -112,25 +169,49 @@ class ProcessingStep(QWidget):
 
         self.process_file_button.setText(text)
 
+    @pyqtSlot(int)
+    def prioritize_file(self, file_id: int) -> None:
+        self._priority_ids.add(file_id)
+        if self.worker_pool.prioritize(file_id):
+            logger.info(f'Moved file {file_id} to the front of the queue')
+
     @pyqtSlot(QTreeWidgetItem, QTreeWidgetItem)
     def selected_file_changed(self, current: FileStatusItem, _: FileStatusItem) -> None:
+        # someone looking at a file probably wants it next
+        if current is not None and not is_finished(current.get_status()):
+            self.prioritize_file(current.get_id())
+
         if self.step_details is not None:
             if current is None:
                 self.step_details.reset()
             else:
                 self.step_details.load_file(current.get_id())
 
-    def _start_item_processing(self, item: FileStatusItem) -> None:
-        if is_finished(item.get_status()):
+    def _start_items(self, items: list[FileStatusItem]) -> None:
+        items = [item for item in items if not is_finished(item.get_status())]
+        if not items:
             return
 
-        item.set_status(item.get_id(), FileStatus.IN_PROGRESS)
-        self.start_worker(item)
+        # requested files first, otherwise keep the list order
+        items.sort(key=lambda item: item.get_id() not in self._priority_ids)
+
+        # record the work up front so it can be picked back up if the app goes down
+        queue_tasks(self._job_db_id, self._task_stage, [item.get_id() for item in items])
+
+        for item in items:
+            self.file_list.set_file_status(item.get_id(), FileStatus.IN_PROGRESS)
+            self.start_worker(item)
+
+        self.update_run_buttons()
+
+    def _start_item_processing(self, item: FileStatusItem) -> None:
+        self._start_items([item])
 
     @pyqtSlot()
     def start_processing(self) -> None:
         assert self._job_db_id is not None, 'Attempt to start pre-processing without a Job ID'
         self.reset_threads()
+        self.control.reset()
 
         if not self.file_list.topLevelItemCount():
             return
@@ -140,48 +221,78 @@ class ProcessingStep(QWidget):
             return
 
         self.process_file_button.setDisabled(True)
+        self.processingStarted.emit()
+
         if self.auto_process.isChecked():
+            items = []
             iterator = QTreeWidgetItemIterator(self.file_list)
             while iterator.value():
-                self._start_item_processing(iterator.value())
+                items.append(iterator.value())
                 iterator += 1
+            self._start_items(items)
         else:
             self._start_item_processing(selected_items[0])
 
+        # nothing needed processing, so the pool will never report being done
+        if not self.worker_pool.is_busy():
+            self.update_control_state()
+            self.processingFinished.emit()
+
+    @pyqtSlot()
+    def log_memory_usage(self) -> None:
+        peak = get_rss_monitor().peaks().get(self._task_stage.name)
+        if peak is not None:
+            logger.info(f'Peak memory while running {self._task_stage.name}: {format_bytes(peak)}')
+
+    @pyqtSlot()
+    def toggle_pause(self) -> None:
+        # running files stop at their next checkpoint until resumed
+        if self.control.is_paused():
+            self.control.resume()
+            self.pause_button.setText('Pause')
+        else:
+            self.control.pause()
+            self.pause_button.setText('Resume')
+
+    @pyqtSlot()
+    def cancel_processing(self) -> None:
+        if not self.worker_pool.is_busy() or self.control.is_cancelled():
+            return
+
+        # running files give up at their next checkpoint and report themselves as pending
+        self.control.cancel()
+        for file_id in self.worker_pool.cancel_pending():
+            self.worker_status_update(file_id, FileStatus.PENDING)
+
+        cancel_tasks(self._job_db_id, self._task_stage)
+        self.cancel_button.setDisabled(True)
+        self.pause_button.setDisabled(True)
+        self.processingCancelled.emit()
+
+        if not self.worker_pool.is_busy():
+            self.update_control_state()
+            self.processingFinished.emit()
+
     #
     # THREAD CODE
     #
 
     def reset_threads(self) -> None:
-        for thread, worker in self.threads.values():
-            thread.quit()
-            thread.wait()
-        self.threads.clear()
+        self.worker_pool.clear()
 
     @pyqtSlot(int, FileStatus)
     def worker_status_update(self, db_id: int, status: FileStatus) -> None:
-        # send the new status to all top level items
-        for idx in range(self.file_list.topLevelItemCount()):
-            self.file_list.topLevelItem(idx).set_status(db_id, status)
+        # bursts from the workers are applied together rather than repainting the list for each one
+        self.file_list.queue_file_status(db_id, status)
+        self.fileStatusChanged.emit(db_id, status)
 
         # update the details of this status matches the details
         if self.step_details is not None and db_id == self.step_details.loaded_id():
             self.step_details.load_file(db_id)
 
-    @pyqtSlot(int)
-    def worker_complete(self, db_id: int) -> None:
-        thread, _ = self.threads.pop(db_id)
-        thread.quit()
-
-        if not self.threads:
-            self.update_control_state()
-
-    def start_thread(self, item: FileStatusItem, worker: QWidget) -> None:
-        thread = QThread(self)
-        worker.moveToThread(thread)
-
-        thread.started.connect(worker.start)
-        thread.finished.connect(worker.deleteLater)
+    def prefetch_images(self, file_ids: list[int]) -> None:
+        prefetch_input_images(self._task_stage, file_ids)
 
-        thread.start()
-        self.threads[item.get_id()] = (thread, worker)
+    def start_thread(self, item: FileStatusItem, worker: QObject) -> None:
+        # the pool queues the worker until one of its threads is free
+        self.worker_pool.submit(item.get_id(), worker, priority=item.get_id() in self._priority_ids)
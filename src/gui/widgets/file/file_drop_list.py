@@ -1,5 +1,4 @@
 import logging
-import shutil
 import uuid
 from pathlib import Path
 from sqlalchemy import select
@@ -8,12 +7,12 @@ from typing import Iterable
 
 from PyQt6.QtCore import QSize, QMimeData, QMimeDatabase, QUrl, pyqtSlot
 from PyQt6.QtGui import QIcon, QDragEnterEvent, QDragMoveEvent, QDropEvent
-from PyQt6.QtPdf import QPdfDocument
 from PyQt6.QtWidgets import QWidget, QListWidget, QListWidgetItem
 
 from src.database import DB_ENGINE
 from src.database.input_file import InputFile
 from src.database.job import Job
+from src.processing.job_setup import add_input_file
 from src.util.paths import LocalPaths, is_pdf, safe_dir_delete
 from src.util.resources import FILE_TYPE_ICON_PATH
 from src.util.types import FileDetails
@@ -119,44 +118,11 @@ class FileDropList(QListWidget):
             # Add it to the job in the DB
             with Session(DB_ENGINE) as session:
                 job = session.get(Job, self._job_db_id)
+                input_file = add_input_file(session, job, file_path)
 
-                input_file = InputFile(path=file_path)
-                job.input_files.append(input_file)
-
-                # commit so that we get a primary key assigned
-                session.commit()
                 db_id = input_file.id
-
-                # Copy the file into our internal storage
-                input_file_directory = LocalPaths.input_file_directory(self._job_db_uuid, db_id)
-                input_file_directory.mkdir()
-                input_file.path = input_file_directory / file_path.name
-
-                logger.info(f'Copying: "{file_path}" -> "{input_file.path}"')
-                shutil.copy(file_path, input_file.path)
                 file_path = input_file.path
 
-                # if this is a PDF, create an input file per-page
-                if is_pdf(input_file.path):
-                    input_file.container_file = True
-
-                    document = QPdfDocument(None)
-                    document.load(str(file_path))
-
-                    for idx in range(document.pageCount()):
-                        page_path = input_file.path.with_name(f'{input_file.path.stem}_page{idx+1}.png')
-
-                        page_file = InputFile(path=page_path)
-                        page_file.linked_input_file_id = input_file.id
-                        job.input_files.append(page_file)
-                        session.commit()
-
-                        page_file_directory = LocalPaths.input_file_directory(self._job_db_uuid, page_file.id)
-                        page_file_directory.mkdir()
-                        page_file.path = page_file_directory / page_path.name
-
-                session.commit()
-
         logger.info(f'Adding file: {file_path}')
         self.addItem(FileItem(db_id, file_path))
 
@@ -1,8 +1,9 @@
 import logging
+from collections import Counter
 from enum import Enum
-from typing import Iterable
+from typing import Collection, Iterable
 
-from PyQt6.QtCore import QSize
+from PyQt6.QtCore import QSize, QTimer, pyqtSlot
 from PyQt6.QtGui import QIcon, QMovie
 from PyQt6.QtWidgets import QTreeWidget, QTreeWidgetItem, QHeaderView, QLabel
 
@@ -15,6 +16,9 @@ from src.util.types import FileDetails
 
 ICON_SIZE = QSize(40, 40)
 
+# worker updates that arrive within this window are applied together
+STATUS_UPDATE_INTERVAL_MS = 100
+
 logger = logging.getLogger(__name__)
 
 
@@ -34,6 +38,11 @@ class FileStatusItem(QTreeWidgetItem):
         self._db_id = file.id
         self.status: FileStatus = initial_status
 
+        # statuses of our children, kept up to date as they change so the rollup does not rescan them
+        self._child_statuses: Counter[FileStatus] = Counter()
+        if isinstance(parent, FileStatusItem):
+            parent._child_statuses[initial_status] += 1
+
         self.setExpanded(True)
 
         icon_file_name = 'pdf_icon.png' if is_pdf(file.path) else 'image_icon.png'
@@ -61,22 +70,30 @@ class FileStatusItem(QTreeWidgetItem):
             self.treeWidget().setItemWidget(self, 2, None)
             self.setIcon(2, status_icon)
 
-    def set_status(self, db_id: int,  status: FileStatus) -> None:
-        if db_id != self._db_id:
-            for child_idx in range(self.childCount()):
-                self.child(child_idx).set_status(db_id, status)
-
-            # if we have children, our status is determined by theirs
-            if self.childCount():
-                child_statuses = [self.child(idx).get_status() for idx in range(self.childCount())]
-                if any([(status == FileStatus.FAILED) for status in child_statuses]):
-                    self._set_own_status(FileStatus.FAILED)
-                elif any([(status == FileStatus.WARNING) for status in child_statuses]):
-                    self._set_own_status(FileStatus.WARNING)
-                elif all([(status == FileStatus.SUCCESS) for status in child_statuses]):
-                    self._set_own_status(FileStatus.SUCCESS)
-        else:
-            self._set_own_status(status)
+    def set_status(self, status: FileStatus) -> None:
+        old_status = self.status
+        if status == old_status:
+            return
+
+        self._set_own_status(status)
+
+        parent = self.parent()
+        if isinstance(parent, FileStatusItem):
+            parent._child_statuses[old_status] -= 1
+            parent._child_statuses[status] += 1
+            parent.update_rollup()
+
+    def update_rollup(self) -> None:
+        # if we have children, our status is determined by theirs
+        if not self.childCount():
+            return
+
+        if self._child_statuses[FileStatus.FAILED]:
+            self.set_status(FileStatus.FAILED)
+        elif self._child_statuses[FileStatus.WARNING]:
+            self.set_status(FileStatus.WARNING)
+        elif self._child_statuses[FileStatus.SUCCESS] == self.childCount():
+            self.set_status(FileStatus.SUCCESS)
 
     def get_status(self) -> FileStatus:
         return self.status
@@ -87,6 +104,13 @@ class FileStatusList(QTreeWidget):
         super().__init__()
         self._files_by_id: dict[int, FileStatusItem] = {}
 
+        # bursts of worker updates are batched into one repaint
+        self._pending_statuses: dict[int, FileStatus] = {}
+        self._status_timer = QTimer(self)
+        self._status_timer.setSingleShot(True)
+        self._status_timer.setInterval(STATUS_UPDATE_INTERVAL_MS)
+        self._status_timer.timeout.connect(self.flush_status_updates)
+
         self.setIconSize(ICON_SIZE)
         self.setHeaderLabels(('Type', 'Name', 'Status'))
 
@@ -104,7 +128,62 @@ class FileStatusList(QTreeWidget):
         for file in files:
             self.add_file(file)
 
-    def load_job(self, mode: ListMode, job: Job) -> None:
+    def get_item(self, db_id: int) -> FileStatusItem | None:
+        return self._files_by_id.get(db_id, None)
+
+    def clear(self) -> None:
+        super().clear()
+        self._files_by_id.clear()
+        self._pending_statuses.clear()
+        self._status_timer.stop()
+
+    def set_file_status(self, db_id: int, status: FileStatus) -> None:
+        # applied right away, replacing anything still waiting for this file
+        self._pending_statuses.pop(db_id, None)
+        if (item := self.get_item(db_id)) is not None:
+            item.set_status(status)
+
+    def queue_file_status(self, db_id: int, status: FileStatus) -> None:
+        self._pending_statuses[db_id] = status
+        if not self._status_timer.isActive():
+            self._status_timer.start()
+
+    @pyqtSlot()
+    def flush_status_updates(self) -> None:
+        self._status_timer.stop()
+        if not self._pending_statuses:
+            return
+
+        updates, self._pending_statuses = self._pending_statuses, {}
+        self.setUpdatesEnabled(False)
+        try:
+            for db_id, status in updates.items():
+                if (item := self.get_item(db_id)) is not None:
+                    item.set_status(status)
+        finally:
+            self.setUpdatesEnabled(True)
+
+    def add_input_file(self, file: InputFile, linked_file: InputFile | None = None) -> FileStatusItem:
+        if file.id in self._files_by_id:
+            return self._files_by_id[file.id]
+
+        # nest files that are linked to other files, adding the parent if it is not here yet
+        parent_item: QTreeWidget | QTreeWidgetItem = self
+        if linked_file is not None:
+            parent_item = self._files_by_id.get(linked_file.id, None)
+            if parent_item is None:
+                parent_item = FileStatusItem(self, linked_file, FileStatus.PENDING)
+                self._files_by_id[linked_file.id] = parent_item
+
+            self.setRootIsDecorated(True)
+
+        item = FileStatusItem(parent_item, file, FileStatus.PENDING)
+        self._files_by_id[file.id] = item
+        if isinstance(parent_item, FileStatusItem):
+            parent_item.update_rollup()
+        return item
+
+    def load_job(self, mode: ListMode, job: Job, unfinished_ids: Collection[int] = ()) -> None:
         pending_files = []
 
         had_sub_items = False
@@ -141,18 +220,21 @@ class FileStatusList(QTreeWidget):
                     if not file.pre_process_result.successful_alignment:
                         continue
 
-                if file.process_result is not None:
+                if file.fully_processed():
                     initial_status = FileStatus.SUCCESS
 
+            # files that were cut off part way through need to be run again
+            if file.id in unfinished_ids:
+                initial_status = FileStatus.PENDING
+
             item = FileStatusItem(parent_item, file, initial_status)
             self._files_by_id[file.id] = item
 
         # TODO: process any remaining pending files
 
-        # update the status for all top level items
-        # TODO: this feels hacky
+        # roll the child statuses up into their containers
         for idx in range(self.topLevelItemCount()):
-            self.topLevelItem(idx).set_status(-1, FileStatus.PENDING)
+            self.topLevelItem(idx).update_rollup()
 
         # disable the top level items having an expand/collapse button if we had no sub-items
         self.setRootIsDecorated(had_sub_items)
@@ -45,5 +45,11 @@ class JobManager(QWidget):
             self.job_name.setText(job.name)
             self.processing_pipeline.load_job(job_id)
 
+    def get_job_name(self) -> str | None:
+        return self.job_name.text() if self._job_db_id is not None else None
+
+    def resume_processing(self) -> None:
+        self.processing_pipeline.resume_processing()
+
     def reload_reference_forms(self) -> None:
         self.processing_pipeline.reload_reference_forms()
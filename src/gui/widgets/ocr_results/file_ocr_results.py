@@ -49,6 +49,7 @@ class FileOcrResults(QWidget):
 
     def load_input_file(self, input_file: InputFile | int | None) -> None:
         self.tabs.clear()
+        self.region_widgets.clear()
         self.region_validation.clear()
         if input_file is None:
             return
@@ -79,8 +80,10 @@ class FileOcrResults(QWidget):
             self._initial_show = True
             return
 
-        region = self.region_widgets[new_index]
-        region.handle_tab_shown()
+        # the results of a file that finished again are reloaded while it is shown
+        region = self.region_widgets.get(new_index)
+        if region is not None:
+            region.handle_tab_shown()
 
     @pyqtSlot(bool, bool)
     def handle_verification_change(self, new_status: bool, continue_check: bool) -> None:
@@ -13,6 +13,10 @@ from src.gui.tabs.file_processing import FileProcessing
 from src.gui.tabs.ocr_result_check import OcrResultCheck
 from src.gui.tabs.reference_form_picker import ReferenceFormPicker
 from src.gui.tabs.result_export import ResultExport
+from src.processing.form_changes import requeue_changed_regions
+from src.processing.task_queue import get_unfinished_file_ids
+from src.util.settings import SettingsManager
+from src.util.types import TaskStage
 
 logger = logging.getLogger(__name__)
 
@@ -45,7 +49,15 @@ class ProcessingPipeline(QTabWidget):
         self.reference_form_picker.continueToNextStep.connect(self.reference_form_picking_done)
         self.file_picker.continueToNextStep.connect(self.file_picking_done)
         self.pre_processing.continueToNextStep.connect(self.pre_processing_done)
+        self.pre_processing.processingStarted.connect(self.pre_processing_started)
+        self.pre_processing.processingFinished.connect(self.processing.end_stream)
+        self.pre_processing.fileAligned.connect(self.processing.queue_file)
+        self.pre_processing.processingCancelled.connect(self.pre_processing_cancelled)
         self.processing.continueToNextStep.connect(self.processing_done)
+        self.processing.processingStarted.connect(self.open_result_check)
+        self.processing.fileStatusChanged.connect(self.result_check.file_processed)
+        self.result_check.fileOpened.connect(self.pre_processing.prioritize_file)
+        self.result_check.fileOpened.connect(self.processing.prioritize_file)
         self.result_check.continueToNextStep.connect(self.result_check_done)
 
     def _initial_state(self) -> None:
@@ -58,6 +70,9 @@ class ProcessingPipeline(QTabWidget):
     def load_job(self, job_id: int) -> None:
         self._initial_state()
 
+        # regions of the reference form that were edited since the files were processed have to be done again
+        requeue_changed_regions(job_id)
+
         with Session(DB_ENGINE) as session:
             job: Job | None = session.get(Job, job_id)
             self._job_id = job_id
@@ -85,6 +100,20 @@ class ProcessingPipeline(QTabWidget):
             if job.all_processed():
                 self.gui_move_to_result_check()
 
+    def resume_processing(self) -> None:
+        # pick up the files that were cut off when the app last closed
+        if get_unfinished_file_ids(self._job_id, TaskStage.PRE_PROCESSING):
+            self.pre_processing.load_job(self._job_id, load_all=True)
+            self.gui_move_to_pre_processing()
+            self.pre_processing.set_view_only(False)
+            self.pre_processing.start_processing()
+
+        elif get_unfinished_file_ids(self._job_id, TaskStage.PROCESSING):
+            self.processing.check_api_config()
+            self.gui_move_to_processing()
+            if SettingsManager().valid_api_config():
+                self.processing.start_processing()
+
     def reload_reference_forms(self) -> None:
         self.reference_form_picker.load_reference_forms()
 
@@ -138,9 +167,30 @@ class ProcessingPipeline(QTabWidget):
         self.pre_processing.load_job(self._job_id, load_all=True)
         self.gui_move_to_pre_processing()
 
+    @pyqtSlot()
+    def pre_processing_started(self) -> None:
+        # let the OCR tab be viewed while files stream into it
+        if self.pre_processing.streaming_enabled():
+            self.processing.start_stream(self._job_id)
+            self.setTabEnabled(3, True)
+            self.open_result_check()
+
+    @pyqtSlot()
+    def open_result_check(self) -> None:
+        # reviewers can start on finished files while the rest are processed, opening a file bumps it up the queue
+        self.result_check.load_job(self._job_id)
+        self.setTabEnabled(4, True)
+
+    @pyqtSlot()
+    def pre_processing_cancelled(self) -> None:
+        if self.processing.has_streamed():
+            self.processing.cancel_stream()
+
     @pyqtSlot()
     def pre_processing_done(self) -> None:
-        self.processing.load_job(self._job_id)
+        # streamed files are already loaded (and may still be processing)
+        if not self.processing.has_streamed():
+            self.processing.load_job(self._job_id)
         self.processing.check_api_config()
         self.gui_move_to_processing()
 
@@ -6,12 +6,15 @@ from sqlalchemy.orm import Session
 from sqlalchemy.sql.expression import func
 
 from PyQt6.QtCore import pyqtSlot, Qt
+from PyQt6.QtWidgets import QMessageBox
 
 from src.database import DB_ENGINE
 from src.database.copy import copy_reference_form
 from src.database.job import Job
 from src.database.reference_form import ReferenceForm
-from src.util.paths import LocalPaths
+from src.processing.job_setup import create_job
+from src.processing.task_queue import get_interrupted_job_ids, release_stale_leases, start_lease_heartbeat
+from src.util.service_client import ServiceClient, ServiceError, ServiceUnavailable
 from src.util.types import FormLinkingMethod, FormAlignmentMethod
 
 from .base import BaseWindow
@@ -21,6 +24,7 @@ from ..dialogs.bug_reporter import BugReporter
 from ..dialogs.job_selector import JobDetails, JobSelector
 from ..dialogs.reference_form_importer import ReferenceFormImporter
 from ..dialogs.reference_form_selector import ReferenceFormSelector
+from ..dialogs.service_jobs import ServiceJobs
 from ..dialogs.vision_api_config import VisionApiConfig
 from ..widgets.job_manager import JobManager
 from ..wizards.first_start_wizard import FirstStartWizard
@@ -29,18 +33,6 @@ from ..wizards.reference_form_wizard import ReferenceFormWizard
 logger = logging.getLogger(__name__)
 
 
-def create_job(job_name: str) -> int:
-    with Session(DB_ENGINE) as session:
-        new_job = Job(name=job_name, uuid=uuid.uuid4())
-        session.add(new_job)
-        session.commit()
-
-        LocalPaths.set_up_job_directory(new_job.uuid)
-
-        logger.info(f'Created new job with ID: {new_job.id}')
-        return new_job.id
-
-
 def get_latest_job_id() -> int:
     with Session(DB_ENGINE) as session:
         return session.execute(select(func.max(Job.id))).fetchone()[0]
@@ -65,6 +57,9 @@ class MainWindow(BaseWindow):
         file_menu.addAction('New Job').triggered.connect(lambda: self.handle_change_job(True))
         file_menu.addAction('Open Job').triggered.connect(lambda: self.handle_change_job(False))
         file_menu.addSeparator()
+        file_menu.addAction('Run Job In Background Service').triggered.connect(self.handle_run_in_service)
+        file_menu.addAction('Background Jobs').triggered.connect(lambda: ServiceJobs(self).show())
+        file_menu.addSeparator()
         file_menu.addAction('Exit').triggered.connect(self.close)
 
         form_menu = self.menuBar().addMenu('Reference Form')
@@ -106,6 +101,32 @@ class MainWindow(BaseWindow):
 
         self.load_job(selector.get_selected_job())
 
+    @pyqtSlot()
+    def handle_run_in_service(self) -> None:
+        job_name = self.job_widget.get_job_name()
+        if job_name is None:
+            return
+
+        try:
+            ServiceClient().submit(job_name)
+        except ServiceUnavailable:
+            QMessageBox.warning(
+                self,
+                'Background Service',
+                'The background service is not running, start it with:\npython eagle_eye.py service',
+            )
+            return
+        except ServiceError as e:
+            QMessageBox.warning(self, 'Background Service', str(e))
+            return
+
+        QMessageBox.information(
+            self,
+            'Background Service',
+            f'Job "{job_name}" is running in the background service and keeps going if Eagle Eye is closed.\n'
+            f'Follow it with: python eagle_eye.py client follow "{job_name}"',
+        )
+
     @pyqtSlot()
     def handle_view_reference_form(self) -> None:
         form_selector = ReferenceFormSelector(self)
@@ -162,6 +183,36 @@ class MainWindow(BaseWindow):
         else:
             self.job_widget.load_job(details.db_id)
 
+    def resume_interrupted_job(self) -> bool:
+        job_ids = get_interrupted_job_ids()
+
+        # jobs the background service is working on were not interrupted
+        try:
+            service_job_ids = {job['job_id'] for job in ServiceClient().jobs() if job['state'] == 'RUNNING'}
+        except ServiceError:
+            service_job_ids = set()
+        job_ids = [job_id for job_id in job_ids if job_id not in service_job_ids]
+
+        if not job_ids:
+            return False
+
+        with Session(DB_ENGINE) as session:
+            job_name = session.get(Job, job_ids[0]).name
+
+        result = QMessageBox.question(
+            self,
+            'Resume Job',
+            f'Processing of job "{job_name}" did not finish the last time Eagle Eye was closed.\n'
+            'Do you want to resume it?',
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+        )
+        if result != QMessageBox.StandardButton.Yes:
+            return False
+
+        self.load_job(JobDetails(db_id=job_ids[0], job_name=None))
+        self.job_widget.resume_processing()
+        return True
+
     def start(
             self,
             auto_new_job: bool = False,
@@ -169,10 +220,16 @@ class MainWindow(BaseWindow):
     ) -> None:
         self.show()
 
+        # anything this machine was working on when it went down can be run again
+        release_stale_leases()
+        start_lease_heartbeat()
+
         if auto_new_job:
             details = JobDetails(db_id=None, job_name=str(uuid.uuid4()))
         elif load_latest_job:
             details = JobDetails(db_id=get_latest_job_id(), job_name=None)
+        elif self.resume_interrupted_job():
+            return
         else:
             selector = JobSelector(self, allow_new_jobs=True)
             if not selector.exec():
@@ -7,8 +7,10 @@ from sqlalchemy.orm import Session
 from src.database.pre_processing.pre_process_result import PreProcessResult
 from src.database.pre_processing.rotation_attempt import RotationAttempt
 from src.util.logging import NamedLoggerAdapter
+from src.util.processing import write_image
 from src.util.status import FileStatus
 
+from .control import ProcessingControl, checkpoint
 from .util import (
     AlignmentMark, find_alignment_marks, rotate_image, group_by_normalized_position, alignment_marks_to_points,
 )
@@ -44,6 +46,7 @@ def reference_mark_alignment(
         test_image: np.ndarray,
         alignment_mark_count: int,
         result: PreProcessResult,
+        control: ProcessingControl | None = None,
 ) -> FileStatus:
     matches_path, aligned_path, overlaid_path = build_image_paths(working_directory)
 
@@ -61,6 +64,8 @@ def reference_mark_alignment(
     # Work through each rotation angle and check for alignment marks
     detected_marks: dict[float, list[AlignmentMark]] = {}
     for rotation_angle in ALLOWED_ROTATIONS:
+        checkpoint(control)
+
         # Rotate the image
         rotated_image = test_image
         if rotation_angle != 0:
@@ -78,7 +83,7 @@ def reference_mark_alignment(
             cv2.rectangle(color_rotation_image, start, end, (0, 0, 255), 2)
 
         rotated_path = working_directory / f'rotation_{rotation_angle}.png'
-        cv2.imwrite(str(rotated_path), color_rotation_image)
+        write_image(rotated_path, color_rotation_image)
 
         # Save the attempt in the DB
         result.rotation_attempts[rotation_angle] = RotationAttempt(
@@ -132,7 +137,7 @@ def reference_mark_alignment(
         None,
     )
     logger.info(f'Writing matches image: {matches_path}')
-    cv2.imwrite(str(matches_path), matched_image)
+    write_image(matches_path, matched_image)
     result.matches_image_path = matches_path
 
     # Compute the homography matrix and align the images using it
@@ -140,14 +145,14 @@ def reference_mark_alignment(
     (h, w) = reference_image.shape[:2]
     aligned_image = cv2.warpPerspective(input_image_rotated, matrix_h, (w, h))
     logger.info(f'Writing aligned image: {aligned_path}')
-    cv2.imwrite(str(aligned_path), aligned_image)
+    write_image(aligned_path, aligned_image)
     result.aligned_image_path = aligned_path
 
     # Save an overlaid image to assist in debugging
     overlaid_image = aligned_image.copy()
     cv2.addWeighted(reference_image, 0.5, aligned_image, 0.5, 0, overlaid_image)
     logger.info(f'Writing overlaid image: {overlaid_path}')
-    cv2.imwrite(str(overlaid_path), overlaid_image)
+    write_image(overlaid_path, overlaid_image)
     result.overlaid_image_path = overlaid_path
 
     # Determine if this was a full or partial success
@@ -170,8 +175,10 @@ def automatic_alignment(
         reference_image: np.ndarray,
         test_image: np.ndarray,
         result: PreProcessResult,
+        control: ProcessingControl | None = None,
 ) -> FileStatus:
     matches_path, aligned_path, overlaid_path = build_image_paths(working_directory)
+    checkpoint(control)
 
     # detect keypoints and extract features
     orb = cv2.ORB_create(MAX_FEATURES)
@@ -200,7 +207,7 @@ def automatic_alignment(
         None,
     )
     logger.info(f'Writing matches image: {matches_path}')
-    cv2.imwrite(str(matches_path), matched_image)
+    write_image(matches_path, matched_image)
     result.matches_image_path = matches_path
 
     # prep the keypoints to compute a homography matrix
@@ -210,19 +217,21 @@ def automatic_alignment(
         test_points[idx] = test_keypoints[match.queryIdx].pt
         ref_points[idx] = ref_keypoints[match.trainIdx].pt
 
+    checkpoint(control)
+
     # compute the homography matrix and align the images using it
     (matrix_h, _) = cv2.findHomography(test_points, ref_points, method=cv2.RANSAC)
     (h, w) = reference_image.shape[:2]
     aligned_image = cv2.warpPerspective(test_image, matrix_h, (w, h))
     logger.info(f'Writing aligned image: {aligned_path}')
-    cv2.imwrite(str(aligned_path), aligned_image)
+    write_image(aligned_path, aligned_image)
     result.aligned_image_path = aligned_path
 
     # Save an overlaid image to assist in debugging
     overlaid_image = aligned_image.copy()
     cv2.addWeighted(reference_image, 0.5, aligned_image, 0.5, 0, overlaid_image)
     logger.info(f'Writing overlaid image: {overlaid_path}')
-    cv2.imwrite(str(overlaid_path), overlaid_image)
+    write_image(overlaid_path, overlaid_image)
     result.overlaid_image_path = overlaid_path
 
     # update the pre-process result
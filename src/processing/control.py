@@ -0,0 +1,72 @@
+import asyncio
+import threading
+
+# how often paused coroutines check if they can carry on
+PAUSE_POLL_SECONDS = 0.2
+
+
+class ProcessingCancelled(Exception):
+    pass
+
+
+class ProcessingControl:
+    def __init__(self, release_when_paused: bool = False):
+        self._running = threading.Event()
+        self._running.set()
+        self._cancelled = threading.Event()
+
+        # work that shares its threads with others gives them up on a pause instead of waiting in them
+        self._release_when_paused = release_when_paused
+
+    def reset(self) -> None:
+        self._cancelled.clear()
+        self._running.set()
+
+    def pause(self) -> None:
+        self._running.clear()
+
+    def resume(self) -> None:
+        self._running.set()
+
+    def cancel(self) -> None:
+        # wake up anything that is paused so it can see the cancel
+        self._cancelled.set()
+        self._running.set()
+
+    def is_paused(self) -> bool:
+        return not self._running.is_set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def should_stop(self) -> bool:
+        # the work in progress has to be handed back, not just held
+        return self.is_cancelled() or (self._release_when_paused and self.is_paused())
+
+    def wait_for_cancel(self, timeout: float) -> bool:
+        # sleeps without missing a cancel, returns True if one came in
+        return self._cancelled.wait(timeout)
+
+    def checkpoint(self) -> None:
+        # called between units of work, blocks while paused and bails out once cancelled
+        if self.should_stop():
+            raise ProcessingCancelled()
+        self._running.wait()
+        if self._cancelled.is_set():
+            raise ProcessingCancelled()
+
+
+def checkpoint(control: ProcessingControl | None) -> None:
+    if control is not None:
+        control.checkpoint()
+
+
+async def async_checkpoint(control: ProcessingControl | None) -> None:
+    # same as checkpoint() but yields to the event loop instead of blocking it while paused
+    if control is None:
+        return
+
+    while control.is_paused() and not control.should_stop():
+        await asyncio.sleep(PAUSE_POLL_SECONDS)
+    if control.should_stop():
+        raise ProcessingCancelled()
@@ -309,6 +309,9 @@ def build_export_df(mode: ExportMode, job: Job) -> pd.DataFrame:
             logger.error(f'Input file ({input_file.path.name}) has not been processed')
             continue
 
+        if not input_file.fully_processed():
+            logger.warning(f'Input file ({input_file.path.name}) was only partially processed')
+
         logger.info(f'Exporting input file: {input_file.path.name}')
         for region in input_file.process_result.regions.values():
             if mode is ExportMode.STRICT and not region.human_verified:
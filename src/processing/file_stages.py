@@ -0,0 +1,179 @@
+import logging
+import requests
+import threading
+from collections.abc import Callable
+from concurrent.futures import Executor
+
+from src.util.google_api import open_api_session
+from src.util.status import FileStatus
+from src.util.types import TaskStage
+
+from .control import checkpoint
+from .memory_budget import estimate_file_bytes, get_memory_budget
+from .pipeline import PipelineItem, PipelineStage, StagedPipeline
+from .pre_process_worker import PreProcessInputs, load_pre_process_inputs, align_file, run_alignment
+from .process_worker import FileProcessor, ProcessInputs, run_ocr_requests
+from .task_queue import cancel_task, finish_task, lease_task, queue_tasks
+
+logger = logging.getLogger(__name__)
+
+PRE_PROCESSING_STEP = 'Pre-Processing'
+PROCESSING_STEP = 'Processing'
+
+# loading and preparing files is mostly disk reads, a couple threads keep the CPU stages fed
+DEFAULT_IO_WORKERS = 2
+
+# which step a stage belongs to, used to report stages that blew up
+STAGE_STEPS = {
+    'load': PRE_PROCESSING_STEP,
+    'align': PRE_PROCESSING_STEP,
+    'prepare': PROCESSING_STEP,
+    'ocr': PROCESSING_STEP,
+    'persist': PROCESSING_STEP,
+}
+STEP_TASK_STAGES = {
+    PRE_PROCESSING_STEP: TaskStage.PRE_PROCESSING,
+    PROCESSING_STEP: TaskStage.PROCESSING,
+}
+
+_thread_data = threading.local()
+
+
+def get_thread_api_session() -> requests.Session:
+    # requests sessions are not thread safe, so each OCR thread keeps its own
+    if not hasattr(_thread_data, 'api_session'):
+        _thread_data.api_session = open_api_session()
+    return _thread_data.api_session
+
+
+def get_item_statuses(item: PipelineItem) -> dict[str, FileStatus]:
+    statuses = dict(item.statuses)
+    if item.failed_stage is not None:
+        statuses[STAGE_STEPS[item.failed_stage]] = FileStatus.FAILED
+    return statuses
+
+
+def record_stopped_stage(item: PipelineItem) -> None:
+    if item.failed_stage is not None:
+        finish_task(item.file_id, STEP_TASK_STAGES[STAGE_STEPS[item.failed_stage]], FileStatus.FAILED)
+    elif item.cancelled_stage is not None:
+        cancel_task(item.file_id, STEP_TASK_STAGES[STAGE_STEPS[item.cancelled_stage]])
+
+
+def admit_item(item: PipelineItem, stage_name: str) -> None:
+    # an item keeps its memory until it leaves the pipeline, stages past the entry never wait on the budget
+    stage = STEP_TASK_STAGES[STAGE_STEPS[stage_name]]
+    item.reserved_bytes = get_memory_budget().acquire(estimate_file_bytes(item.job_id, stage), item.control)
+
+
+def release_item(item: PipelineItem) -> None:
+    get_memory_budget().release(item.reserved_bytes)
+    item.reserved_bytes = 0
+
+
+def load_stage(item: PipelineItem) -> bool:
+    lease_task(item.job_id, item.file_id, TaskStage.PRE_PROCESSING)
+
+    inputs = load_pre_process_inputs(item.job_id, item.file_id, item.log, item.control)
+    if isinstance(inputs, PreProcessInputs):
+        item.data = inputs
+        return True
+
+    # container files have no status of their own
+    if inputs is not None:
+        item.statuses[PRE_PROCESSING_STEP] = inputs
+    finish_task(item.file_id, TaskStage.PRE_PROCESSING, inputs)
+
+    # a reused alignment skips the align stage and goes straight on to OCR
+    if inputs in (FileStatus.SUCCESS, FileStatus.WARNING):
+        queue_tasks(item.job_id, TaskStage.PROCESSING, [item.file_id])
+        item.data = None
+        return True
+    return False
+
+
+def build_align_stage(process_pool: Executor | None) -> Callable[[PipelineItem], bool]:
+    def align_stage(item: PipelineItem) -> bool:
+        inputs, item.data = item.data, None
+        # the load stage already reused an earlier alignment
+        if inputs is None:
+            return True
+
+        if process_pool is None:
+            status = align_file(item.job_id, item.file_id, inputs, item.log, item.control)
+        else:
+            checkpoint(item.control)
+            status = FileStatus[process_pool.submit(run_alignment, item.job_id, item.file_id, inputs).result()]
+
+        item.statuses[PRE_PROCESSING_STEP] = status
+        finish_task(item.file_id, TaskStage.PRE_PROCESSING, status)
+
+        if status not in (FileStatus.SUCCESS, FileStatus.WARNING):
+            return False
+
+        queue_tasks(item.job_id, TaskStage.PROCESSING, [item.file_id])
+        return True
+
+    return align_stage
+
+
+def prepare_stage(item: PipelineItem) -> bool:
+    lease_task(item.job_id, item.file_id, TaskStage.PROCESSING)
+
+    item.data = FileProcessor(item.job_id, item.file_id, item.log, item.control).prepare()
+    if isinstance(item.data, ProcessInputs):
+        return True
+
+    # container files have no status of their own, a reused result is already saved
+    status, item.data = item.data, None
+    if status is not None:
+        item.statuses[PROCESSING_STEP] = status
+    finish_task(item.file_id, TaskStage.PROCESSING, status)
+    return False
+
+
+def ocr_stage(item: PipelineItem) -> bool:
+    for region_requests in item.data.ocr_requests.values():
+        run_ocr_requests(
+            region_requests,
+            item.data.aligned_image,
+            item.log,
+            item.control,
+            get_thread_api_session(),
+            item.file_id,
+        )
+    return True
+
+
+def persist_stage(item: PipelineItem) -> bool:
+    inputs, item.data = item.data, None
+    processor = FileProcessor(item.job_id, item.file_id, item.log, item.control)
+    item.statuses[PROCESSING_STEP] = processor.persist(inputs)
+    finish_task(item.file_id, TaskStage.PROCESSING, item.statuses[PROCESSING_STEP])
+    return True
+
+
+def build_file_pipeline(
+        align_workers: int,
+        ocr_workers: int,
+        on_item_finished: Callable[[PipelineItem], None] | None = None,
+        process_pool: Executor | None = None,
+) -> StagedPipeline:
+    def item_finished(item: PipelineItem) -> None:
+        release_item(item)
+        record_stopped_stage(item)
+        if on_item_finished is not None:
+            on_item_finished(item)
+
+    # persist is the only stage that writes results, a single writer keeps SQLite happy
+    return StagedPipeline(
+        stages=[
+            PipelineStage('load', load_stage, workers=DEFAULT_IO_WORKERS),
+            PipelineStage('align', build_align_stage(process_pool), workers=align_workers),
+            PipelineStage('prepare', prepare_stage, workers=DEFAULT_IO_WORKERS),
+            PipelineStage('ocr', ocr_stage, workers=ocr_workers),
+            PipelineStage('persist', persist_stage, workers=1),
+        ],
+        on_item_finished=item_finished,
+        on_item_submitted=admit_item,
+    )
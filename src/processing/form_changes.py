@@ -0,0 +1,119 @@
+import logging
+from collections import defaultdict
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from src.database import DB_ENGINE
+from src.database.input_file import InputFile
+from src.database.job import Job
+from src.database.processing.processed_region import ProcessedRegion
+from src.database.processing.process_result import ProcessResult
+from src.database.processing_task import ProcessingTask
+from src.database.region_fingerprint import RegionFingerprint
+from src.database.rows import delete_subtree, split_tables, table_of
+from src.util.types import TaskStage, TaskState
+
+from .result_memo import drop_fingerprint, form_version_hash, region_version_hashes
+from .task_queue import queue_tasks
+
+logger = logging.getLogger(__name__)
+
+
+def _stale_regions(session: Session, job_id: int, current: dict[int, str]) -> dict[int, dict[int, int]]:
+    # local IDs by processed region ID for each input file, for regions whose form region was edited or removed
+    stored = {
+        (file_id, local_id): fingerprint
+        for file_id, local_id, fingerprint in session.execute(
+            select(RegionFingerprint.input_file_id, RegionFingerprint.region_local_id, RegionFingerprint.fingerprint)
+            .join(InputFile, InputFile.id == RegionFingerprint.input_file_id)
+            .where(InputFile.job_id == job_id)
+        )
+    }
+
+    stale = defaultdict(dict)
+    processed = session.execute(
+        select(ProcessResult.input_file_id, ProcessedRegion.id, ProcessedRegion.local_id)
+        .join(ProcessResult, ProcessResult.id == ProcessedRegion.process_result_id)
+        .join(InputFile, InputFile.id == ProcessResult.input_file_id)
+        .where(InputFile.job_id == job_id)
+    )
+    for file_id, region_id, local_id in processed:
+        # regions saved before their version was recorded are left alone
+        fingerprint = stored.get((file_id, local_id))
+        if local_id not in current or (fingerprint is not None and fingerprint != current[local_id]):
+            stale[file_id][region_id] = local_id
+
+    return stale
+
+
+def _files_missing_regions(session: Session, job_id: int, current: dict[int, str]) -> set[int]:
+    # a region added to the form has to be processed for every file that was already done,
+    # files that were cut off part way are still queued and pick it up on their own
+    open_file_ids = set(
+        session.scalars(
+            select(ProcessingTask.input_file_id).where(
+                ProcessingTask.job_id == job_id,
+                ProcessingTask.stage == TaskStage.PROCESSING,
+                ProcessingTask.state != TaskState.DONE,
+            )
+        )
+    )
+
+    done_regions = defaultdict(set)
+    for file_id, local_id in session.execute(
+        select(ProcessResult.input_file_id, ProcessedRegion.local_id)
+        .join(ProcessResult, ProcessResult.id == ProcessedRegion.process_result_id)
+        .join(InputFile, InputFile.id == ProcessResult.input_file_id)
+        .where(InputFile.job_id == job_id)
+    ):
+        done_regions[file_id].add(local_id)
+
+    return {
+        file_id
+        for file_id, local_ids in done_regions.items()
+        if file_id not in open_file_ids and not current.keys() <= local_ids
+    }
+
+
+def requeue_changed_regions(job_id: int) -> int:
+    # drops the processed regions an edit to the reference form made out of date and queues their files for OCR,
+    # regions the edit did not touch are kept. Returns the number of files queued.
+    with Session(DB_ENGINE) as session:
+        job = session.get(Job, job_id)
+        form = job.reference_form
+        if form is None:
+            return 0
+
+        connection = session.connection()
+        current = region_version_hashes(connection, form, use_cache=False)
+        # later fingerprints have to see the edit too, not a hash cached from before it
+        form_version_hash(connection, form, use_cache=False)
+
+        stale = _stale_regions(session, job_id, current)
+        file_ids = set(stale) | _files_missing_regions(session, job_id, current)
+        if not file_ids:
+            return 0
+
+        _, result_tables = split_tables()
+        region_table = table_of(ProcessedRegion)
+        child_tables = [table for table in result_tables if table is not region_table]
+        region_ids = [region_id for regions in stale.values() for region_id in regions]
+        delete_subtree(connection, region_table, region_ids, child_tables)
+
+        for file_id, regions in stale.items():
+            connection.execute(
+                delete(RegionFingerprint).where(
+                    RegionFingerprint.input_file_id == file_id,
+                    RegionFingerprint.region_local_id.in_(list(regions.values())),
+                )
+            )
+
+        # the old result can no longer be handed out as it is
+        for file_id in file_ids:
+            drop_fingerprint(session, file_id, TaskStage.PROCESSING)
+
+        session.commit()
+
+    logger.info(f'Reference form changed, queued {len(file_ids)} files to process their changed regions again')
+    queue_tasks(job_id, TaskStage.PROCESSING, sorted(file_ids))
+    return len(file_ids)
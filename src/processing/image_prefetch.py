@@ -0,0 +1,195 @@
+import cv2
+import logging
+import numpy as np
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import NamedTuple
+from sqlalchemy.orm import Session
+
+from src.database import DB_ENGINE
+from src.database.input_file import InputFile
+from src.util.settings import SettingsManager
+from src.util.types import TaskStage
+
+logger = logging.getLogger(__name__)
+
+# every job of a session usually shares one or two reference forms
+REFERENCE_CACHE_SIZE = 4
+
+_IMAGE_PREFETCHER: 'ImagePrefetcher | None' = None
+_IMAGE_PREFETCHER_LOCK = threading.Lock()
+
+_REFERENCE_IMAGES: OrderedDict[Path, tuple[int, np.ndarray]] = OrderedDict()
+_REFERENCE_LOCK = threading.Lock()
+
+
+class PrefetchedImage(NamedTuple):
+    path: Path
+    mtime_ns: int
+    flags: int
+    image: np.ndarray
+
+
+def stage_image_flags(stage: TaskStage) -> int:
+    # alignment starts from the scan, OCR from the grayscale image alignment saved
+    match stage:
+        case TaskStage.PRE_PROCESSING:
+            return cv2.IMREAD_COLOR
+        case TaskStage.PROCESSING:
+            return cv2.IMREAD_GRAYSCALE
+        case _:
+            raise RuntimeError(f'Unknown task stage: {stage}')
+
+
+def _stage_image_path(file_id: int, stage: TaskStage) -> Path | None:
+    with Session(DB_ENGINE) as session:
+        input_file = session.get(InputFile, file_id)
+        if input_file is None or input_file.container_file:
+            return None
+
+        match stage:
+            case TaskStage.PRE_PROCESSING:
+                # PDF pages do not exist until their worker extracts them
+                path = input_file.path
+            case TaskStage.PROCESSING:
+                result = input_file.pre_process_result
+                path = result.aligned_image_path if result is not None else None
+            case _:
+                raise RuntimeError(f'Unknown task stage: {stage}')
+
+        return path if path is not None and path.exists() else None
+
+
+def _read_image(file_id: int, stage: TaskStage) -> PrefetchedImage | None:
+    path = _stage_image_path(file_id, stage)
+    if path is None:
+        return None
+
+    flags = stage_image_flags(stage)
+    mtime_ns = path.stat().st_mtime_ns
+    image = cv2.imread(str(path), flags)
+    if image is None:
+        return None
+
+    return PrefetchedImage(path=path, mtime_ns=mtime_ns, flags=flags, image=image)
+
+
+class ImagePrefetcher:
+    def __init__(self, depth: int):
+        self.depth = max(0, depth)
+
+        # room for both stages to read ahead when alignment and OCR run together
+        self._max_images = self.depth * 2
+        self._images: OrderedDict[tuple[int, TaskStage], Future[PrefetchedImage | None]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor: ThreadPoolExecutor | None = None
+
+        self.hits = 0
+        self.misses = 0
+
+    def prefetch(self, stage: TaskStage, file_ids: Iterable[int]) -> None:
+        if not self.depth:
+            return
+
+        with self._lock:
+            if self._executor is None:
+                # a single thread, reads from a network share only get slower when they compete
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-prefetch')
+
+            for file_id in list(file_ids)[:self.depth]:
+                key = (file_id, stage)
+                if key in self._images:
+                    continue
+
+                self._images[key] = self._executor.submit(_read_image, file_id, stage)
+                while len(self._images) > self._max_images:
+                    _, future = self._images.popitem(last=False)
+                    future.cancel()
+
+    def take(self, file_id: int, stage: TaskStage, path: Path) -> np.ndarray | None:
+        flags = stage_image_flags(stage)
+        with self._lock:
+            future = self._images.pop((file_id, stage), None)
+
+        prefetched = None
+        # a read that has not started yet is quicker done here than waited on
+        if future is not None and not future.cancel():
+            try:
+                prefetched = future.result()
+            except Exception:
+                logger.exception(f'Prefetching the image of input file {file_id} failed')
+
+        # the file can change between the prefetch and now, i.e. when a file is re-aligned
+        if (
+                prefetched is not None
+                and prefetched.path == path
+                and prefetched.flags == flags
+                and prefetched.mtime_ns == path.stat().st_mtime_ns
+        ):
+            self.hits += 1
+            return prefetched.image
+
+        self.misses += 1
+        return cv2.imread(str(path), flags)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for future in self._images.values():
+                future.cancel()
+            self._images.clear()
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+        if self.hits or self.misses:
+            logger.info(f'Image prefetch: {self.hits} hits, {self.misses} misses')
+
+
+def get_image_prefetcher() -> ImagePrefetcher:
+    global _IMAGE_PREFETCHER
+
+    with _IMAGE_PREFETCHER_LOCK:
+        if _IMAGE_PREFETCHER is None:
+            _IMAGE_PREFETCHER = ImagePrefetcher(SettingsManager().prefetch_images)
+        return _IMAGE_PREFETCHER
+
+
+def shutdown_image_prefetcher() -> None:
+    global _IMAGE_PREFETCHER
+
+    with _IMAGE_PREFETCHER_LOCK:
+        if _IMAGE_PREFETCHER is not None:
+            _IMAGE_PREFETCHER.shutdown()
+            _IMAGE_PREFETCHER = None
+
+
+def prefetch_input_images(stage: TaskStage, file_ids: Iterable[int]) -> None:
+    get_image_prefetcher().prefetch(stage, file_ids)
+
+
+def read_input_image(file_id: int, stage: TaskStage, path: Path) -> np.ndarray | None:
+    return get_image_prefetcher().take(file_id, stage, path)
+
+
+def read_reference_image(path: Path) -> np.ndarray:
+    # every file of a job aligns against the same reference, so it is only decoded once
+    mtime_ns = path.stat().st_mtime_ns
+    with _REFERENCE_LOCK:
+        cached = _REFERENCE_IMAGES.get(path)
+        if cached is not None and cached[0] == mtime_ns:
+            _REFERENCE_IMAGES.move_to_end(path)
+            return cached[1]
+
+    image = cv2.cvtColor(cv2.imread(str(path)), cv2.COLOR_BGR2GRAY)
+    # shared between the workers, nothing may draw on it
+    image.flags.writeable = False
+
+    with _REFERENCE_LOCK:
+        _REFERENCE_IMAGES[path] = (mtime_ns, image)
+        while len(_REFERENCE_IMAGES) > REFERENCE_CACHE_SIZE:
+            _REFERENCE_IMAGES.popitem(last=False)
+
+    return image
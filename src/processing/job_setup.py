@@ -0,0 +1,65 @@
+import logging
+import pymupdf
+import shutil
+import uuid
+from pathlib import Path
+from sqlalchemy.orm import Session
+
+from src.database import DB_ENGINE
+from src.database.input_file import InputFile
+from src.database.job import Job
+from src.util.paths import LocalPaths, is_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def create_job(job_name: str) -> int:
+    with Session(DB_ENGINE) as session:
+        new_job = Job(name=job_name, uuid=uuid.uuid4())
+        session.add(new_job)
+        session.commit()
+
+        LocalPaths.set_up_job_directory(new_job.uuid)
+
+        logger.info(f'Created new job with ID: {new_job.id}')
+        return new_job.id
+
+
+def get_pdf_page_count(path: Path) -> int:
+    with pymupdf.open(path) as document:
+        return document.page_count
+
+
+def add_input_file(session: Session, job: Job, file_path: Path) -> InputFile:
+    input_file = InputFile(path=file_path)
+    job.input_files.append(input_file)
+
+    # commit so that we get a primary key assigned
+    session.commit()
+
+    # Copy the file into our internal storage
+    input_file_directory = LocalPaths.input_file_directory(job.uuid, input_file.id)
+    input_file_directory.mkdir()
+    input_file.path = input_file_directory / file_path.name
+
+    logger.info(f'Copying: "{file_path}" -> "{input_file.path}"')
+    shutil.copy(file_path, input_file.path)
+
+    # if this is a PDF, create an input file per-page
+    if is_pdf(input_file.path):
+        input_file.container_file = True
+
+        for idx in range(get_pdf_page_count(input_file.path)):
+            page_path = input_file.path.with_name(f'{input_file.path.stem}_page{idx+1}.png')
+
+            page_file = InputFile(path=page_path)
+            page_file.linked_input_file_id = input_file.id
+            job.input_files.append(page_file)
+            session.commit()
+
+            page_file_directory = LocalPaths.input_file_directory(job.uuid, page_file.id)
+            page_file_directory.mkdir()
+            page_file.path = page_file_directory / page_path.name
+
+    session.commit()
+    return input_file
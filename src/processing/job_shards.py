@@ -0,0 +1,275 @@
+import logging
+import math
+import shutil
+import uuid
+from collections import defaultdict
+from functools import partial
+from pathlib import Path, PureWindowsPath
+from typing import Any, NamedTuple
+from sqlalchemy import Engine, Table, delete, insert, select, update
+from sqlalchemy.orm import Session
+
+from src.database import DB_ENGINE, OrmBase, create_db
+from src.database.input_file import InputFile
+from src.database.job import Job
+from src.database.processing_task import ProcessingTask
+from src.database.reference_form import ReferenceForm
+from src.database.rows import chunks, delete_rows, insert_rows, select_subtree, split_tables, table_of
+from src.database.util import DbPath
+from src.util.paths import PRIMARY_DB_NAME, LocalPaths, get_working_dir
+from src.util.types import TaskStage, TaskState
+
+logger = logging.getLogger(__name__)
+
+# folders of a working directory that stored paths point into
+WORKING_DIR_FOLDERS = ('jobs', 'reference_forms')
+
+
+class ShardError(Exception):
+    pass
+
+
+class ShardMergeSummary(NamedTuple):
+    job_name: str
+    file_count: int
+    result_rows: int
+
+
+def rebase_path(path: Path, working_dir: Path) -> Path:
+    # stored paths are absolute, point them at the same file under another working directory
+    # parsed as a windows path so paths written on either platform split on their separators
+    parts = PureWindowsPath(str(path)).parts
+    for idx in reversed(range(len(parts) - 1)):
+        if parts[idx] in WORKING_DIR_FOLDERS:
+            return working_dir.joinpath(*parts[idx:])
+
+    return path
+
+
+def relocate_paths(engine: Engine, working_dir: Path) -> None:
+    # bundles are copied between machines, so every stored path is pointed at where the bundle is now
+    with engine.begin() as connection:
+        for table in OrmBase.metadata.sorted_tables:
+            path_columns = [column for column in table.columns if isinstance(column.type, DbPath)]
+            if not path_columns:
+                continue
+
+            for row in connection.execute(select(table.c.id, *path_columns)):
+                values = {
+                    column.name: rebase_path(row._mapping[column.name], working_dir)
+                    for column in path_columns
+                    if row._mapping[column.name] is not None
+                }
+                if values:
+                    connection.execute(update(table).where(table.c.id == row.id).values(values))
+
+
+def _file_needs_work(file: InputFile) -> bool:
+    if file.pre_process_result is None:
+        return True
+    return file.pre_process_result.successful_alignment and not file.fully_processed()
+
+
+def _file_units(job: Job) -> list[list[InputFile]]:
+    # pages stay with their PDF, only units with work left are sent out
+    pages = defaultdict(list)
+    for file in job.input_files:
+        if file.linked_input_file_id is not None:
+            pages[file.linked_input_file_id].append(file)
+
+    units = []
+    for file in sorted(job.input_files, key=lambda file: file.id):
+        if file.linked_input_file_id is not None:
+            continue
+
+        unit = [file, *sorted(pages[file.id], key=lambda page: page.id)]
+        if any(_file_needs_work(member) for member in unit if not member.container_file):
+            units.append(unit)
+
+    return units
+
+
+def _group_units(units: list[list[InputFile]], shard_count: int) -> list[list[list[InputFile]]]:
+    # neighbouring files stay together, so only the first file of a shard loses its link to the previous file
+    target = math.ceil(sum(len(unit) for unit in units) / shard_count)
+
+    groups: list[list[list[InputFile]]] = [[]]
+    group_size = 0
+    for unit in units:
+        if group_size >= target and len(groups) < shard_count:
+            groups.append([])
+            group_size = 0
+
+        groups[-1].append(unit)
+        group_size += len(unit)
+
+    return [group for group in groups if group]
+
+
+def _bundle_tasks(files: list[InputFile]) -> list[dict[str, Any]]:
+    tasks = []
+    for file in files:
+        if file.container_file:
+            continue
+
+        if file.pre_process_result is None:
+            stage = TaskStage.PRE_PROCESSING
+        elif file.pre_process_result.successful_alignment and not file.fully_processed():
+            stage = TaskStage.PROCESSING
+        else:
+            continue
+
+        tasks.append({'job_id': file.job_id, 'input_file_id': file.id, 'stage': stage, 'state': TaskState.PENDING})
+    return tasks
+
+
+def _write_bundle(
+        bundle_dir: Path,
+        job_id: int,
+        job_uuid: uuid.UUID,
+        form_id: int,
+        form_path: Path,
+        files: list[InputFile],
+) -> None:
+    form_tables, result_tables = split_tables()
+    file_ids = [file.id for file in files]
+
+    # copy the files first, a bundle with missing images is no use to anyone
+    reference_forms_dir = bundle_dir / 'reference_forms'
+    reference_forms_dir.mkdir()
+    shutil.copy(form_path, reference_forms_dir / form_path.name)
+    for file_id in file_ids:
+        shutil.copytree(
+            LocalPaths.input_file_directory(job_uuid, file_id),
+            bundle_dir / 'jobs' / str(job_uuid) / 'input_files' / str(file_id),
+        )
+
+    # the form, job and files keep their IDs so the results can be matched back up when merging
+    with DB_ENGINE.connect() as source:
+        form_rows = select_subtree(source, table_of(ReferenceForm), [form_id], form_tables)
+        job_rows = select_subtree(source, table_of(Job), [job_id], [])
+        file_rows = select_subtree(source, table_of(InputFile), file_ids, result_tables)
+
+    engine = create_db(bundle_dir / PRIMARY_DB_NAME)
+    try:
+        with engine.begin() as target:
+            id_maps: dict[Table, dict[int, int]] = {}
+            rebase = partial(rebase_path, working_dir=bundle_dir)
+            insert_rows(target, form_rows, [table_of(ReferenceForm), *form_tables], True, id_maps, rebase)
+            insert_rows(target, job_rows, [table_of(Job)], True, id_maps, rebase)
+            insert_rows(target, file_rows, [table_of(InputFile)], True, id_maps, rebase)
+            insert_rows(target, file_rows, result_tables, False, id_maps, rebase)
+
+            tasks = _bundle_tasks(files)
+            if tasks:
+                target.execute(insert(table_of(ProcessingTask)), tasks)
+    finally:
+        engine.dispose()
+
+
+def split_job(job_id: int, shard_count: int, output_dir: Path) -> list[Path]:
+    if shard_count < 1:
+        raise ShardError('A job needs to be split into at least one shard')
+
+    with Session(DB_ENGINE) as session:
+        job = session.get(Job, job_id)
+        if job.reference_form is None:
+            raise ShardError(f'Job "{job.name}" does not have a reference form')
+
+        groups = _group_units(_file_units(job), shard_count)
+        if not groups:
+            raise ShardError(f'Job "{job.name}" has no files left to process')
+
+        bundle_dirs = [output_dir / f'{job.name}_shard{idx + 1}' for idx in range(len(groups))]
+        for bundle_dir in bundle_dirs:
+            if bundle_dir.exists():
+                raise ShardError(f'Shard directory already exists: {bundle_dir}')
+
+        for bundle_dir, group in zip(bundle_dirs, groups):
+            files = [file for unit in group for file in unit]
+            logger.info(f'Writing {len(files)} input files of job {job_id} to {bundle_dir}')
+
+            bundle_dir.mkdir(parents=True)
+            _write_bundle(bundle_dir.resolve(), job_id, job.uuid, job.reference_form.id, job.reference_form.path, files)
+
+    return bundle_dirs
+
+
+def merge_shard(bundle_dir: Path) -> ShardMergeSummary:
+    db_path = bundle_dir / PRIMARY_DB_NAME
+    if not db_path.exists():
+        raise ShardError(f'Not a shard bundle, {PRIMARY_DB_NAME} is missing: {bundle_dir}')
+
+    _, result_tables = split_tables()
+    file_table = table_of(InputFile)
+    task_table = table_of(ProcessingTask)
+
+    engine = create_db(db_path)
+    try:
+        with engine.connect() as source:
+            shard_jobs = source.execute(select(table_of(Job))).all()
+            if len(shard_jobs) != 1:
+                raise ShardError(f'Expected one job in the shard bundle, found {len(shard_jobs)}')
+
+            shard_job = shard_jobs[0]
+            file_ids = list(source.scalars(select(file_table.c.id)))
+            shard_rows = select_subtree(source, file_table, file_ids, result_tables)
+            shard_tasks = [dict(row._mapping) for row in source.execute(select(task_table))]
+    finally:
+        engine.dispose()
+
+    with Session(DB_ENGINE) as session:
+        job = session.scalars(select(Job).where(Job.uuid == shard_job.uuid)).first()
+        if job is None:
+            raise ShardError(f'The job this shard was split from is not in this database: "{shard_job.name}"')
+
+        job_id, job_name = job.id, job.name
+        missing = set(file_ids) - {file.id for file in job.input_files}
+        if missing:
+            raise ShardError(f'Shard has input files that are not part of job "{job_name}": {sorted(missing)}')
+
+    # the files go first so the merged results never point at images that are not there
+    working_dir = get_working_dir()
+    for file_id in file_ids:
+        shard_file_dir = bundle_dir / 'jobs' / str(shard_job.uuid) / 'input_files' / str(file_id)
+        if shard_file_dir.exists():
+            shutil.copytree(shard_file_dir, LocalPaths.input_file_directory(shard_job.uuid, file_id), dirs_exist_ok=True)
+
+    with DB_ENGINE.begin() as target:
+        # the shard holds the full state of its files, including anything they had before the split
+        delete_rows(target, select_subtree(target, file_table, file_ids, result_tables), result_tables)
+        for chunk in chunks(file_ids):
+            target.execute(delete(task_table).where(task_table.c.input_file_id.in_(chunk)))
+
+        id_maps: dict[Table, dict[int, int]] = {file_table: {file_id: file_id for file_id in file_ids}}
+        rebase = partial(rebase_path, working_dir=working_dir)
+        result_rows = insert_rows(target, shard_rows, result_tables, False, id_maps, rebase)
+
+        # tasks the shard did not get to are picked up by the next run of the job here
+        tasks = [
+            {
+                'job_id': job_id,
+                'input_file_id': task['input_file_id'],
+                'stage': task['stage'],
+                'state': TaskState.PENDING if task['state'] is TaskState.LEASED else task['state'],
+                'attempts': task['attempts'],
+            }
+            for task in shard_tasks
+        ]
+        if tasks:
+            target.execute(insert(task_table), tasks)
+
+    logger.info(f'Merged {len(file_ids)} input files and {result_rows} result rows from {bundle_dir}')
+    return ShardMergeSummary(job_name=job_name, file_count=len(file_ids), result_rows=result_rows)
+
+
+def relocate_bundle(bundle_dir: Path) -> None:
+    db_path = bundle_dir / PRIMARY_DB_NAME
+    if not db_path.exists():
+        raise ShardError(f'Not a shard bundle, {PRIMARY_DB_NAME} is missing: {bundle_dir}')
+
+    engine = create_db(db_path)
+    try:
+        relocate_paths(engine, bundle_dir.resolve())
+    finally:
+        engine.dispose()
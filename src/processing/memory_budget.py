@@ -0,0 +1,171 @@
+import contextlib
+import cv2
+import functools
+import logging
+import psutil
+import threading
+import time
+from collections.abc import Iterator
+from sqlalchemy.orm import Session
+
+from src.database import DB_ENGINE
+from src.database.job import Job
+from src.util.settings import SettingsManager
+from src.util.types import TaskStage
+
+from .control import ProcessingCancelled, ProcessingControl
+
+logger = logging.getLogger(__name__)
+
+# rough number of bytes a worker holds per page pixel, counting every full page copy it keeps around
+STAGE_BYTES_PER_PIXEL = {
+    # BGR input and reference, gray and threshold copies, rotated candidates and BGR debug images
+    TaskStage.PRE_PROCESSING: 16,
+    # gray aligned page, BGR and gray reference
+    TaskStage.PROCESSING: 6,
+}
+
+# a letter page scanned at 300 dpi, used when the reference form can not be read
+DEFAULT_PAGE_PIXELS = 2550 * 3300
+
+# how often a file waiting for memory checks if it was cancelled
+ADMISSION_POLL_SECONDS = 0.2
+
+# how often the resident set size is sampled while work is running
+RSS_SAMPLE_SECONDS = 0.25
+
+_MEMORY_BUDGET: 'MemoryBudget | None' = None
+_RSS_MONITOR: 'RssMonitor | None' = None
+_GLOBALS_LOCK = threading.Lock()
+
+
+def format_bytes(size: int) -> str:
+    return f'{size / (1024 * 1024):,.0f} MB'
+
+
+class MemoryBudget:
+    def __init__(self, limit_bytes: int):
+        self._limit = max(1, limit_bytes)
+        self._in_use = 0
+        self._condition = threading.Condition()
+
+    def limit(self) -> int:
+        return self._limit
+
+    def in_use(self) -> int:
+        with self._condition:
+            return self._in_use
+
+    def acquire(self, size: int, control: ProcessingControl | None = None) -> int:
+        # a file bigger than the whole budget still gets to run, just on its own
+        size = min(size, self._limit)
+
+        with self._condition:
+            while self._in_use and self._in_use + size > self._limit:
+                if control is not None and control.should_stop():
+                    raise ProcessingCancelled()
+                self._condition.wait(timeout=ADMISSION_POLL_SECONDS)
+
+            self._in_use += size
+            return size
+
+    def release(self, size: int) -> None:
+        with self._condition:
+            self._in_use = max(0, self._in_use - size)
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def reserve(self, size: int, control: ProcessingControl | None = None) -> Iterator[int]:
+        reserved = self.acquire(size, control)
+        try:
+            yield reserved
+        finally:
+            self.release(reserved)
+
+
+class RssMonitor:
+    def __init__(self):
+        self._process = psutil.Process()
+        self._lock = threading.Lock()
+        self._active: dict[str, int] = {}
+        self._peaks: dict[str, int] = {}
+        self._thread: threading.Thread | None = None
+
+    def _sample(self) -> None:
+        rss = self._process.memory_info().rss
+        with self._lock:
+            for label, count in self._active.items():
+                if count:
+                    self._peaks[label] = max(self._peaks.get(label, 0), rss)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not any(self._active.values()):
+                    self._thread = None
+                    return
+
+            self._sample()
+            time.sleep(RSS_SAMPLE_SECONDS)
+
+    @contextlib.contextmanager
+    def track(self, label: str) -> Iterator[None]:
+        # the peak is for the whole process while the label was running, stages that overlap share it
+        with self._lock:
+            self._active[label] = self._active.get(label, 0) + 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='rss-monitor', daemon=True)
+                self._thread.start()
+
+        try:
+            yield
+        finally:
+            self._sample()
+            with self._lock:
+                self._active[label] -= 1
+
+    def peaks(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._peaks)
+
+
+def get_memory_budget() -> MemoryBudget:
+    global _MEMORY_BUDGET
+
+    with _GLOBALS_LOCK:
+        if _MEMORY_BUDGET is None:
+            limit = SettingsManager().memory_budget_bytes(psutil.virtual_memory().total)
+            logger.info(f'Limiting in-flight page images to {format_bytes(limit)}')
+            _MEMORY_BUDGET = MemoryBudget(limit)
+        return _MEMORY_BUDGET
+
+
+def get_rss_monitor() -> RssMonitor:
+    global _RSS_MONITOR
+
+    with _GLOBALS_LOCK:
+        if _RSS_MONITOR is None:
+            _RSS_MONITOR = RssMonitor()
+        return _RSS_MONITOR
+
+
+@functools.cache
+def _reference_pixels(job_id: int) -> int:
+    # input pages are scans of the reference form, so it is a good stand in for their size
+    with Session(DB_ENGINE) as session:
+        reference_path = session.get(Job, job_id).reference_form.path
+
+    image = cv2.imread(str(reference_path), flags=cv2.IMREAD_GRAYSCALE)
+    return image.size if image is not None else DEFAULT_PAGE_PIXELS
+
+
+def estimate_file_bytes(job_id: int, stage: TaskStage) -> int:
+    return _reference_pixels(job_id) * STAGE_BYTES_PER_PIXEL[stage]
+
+
+@contextlib.contextmanager
+def admit_file(job_id: int, stage: TaskStage, control: ProcessingControl | None = None) -> Iterator[None]:
+    # wait for room in the budget, then track the memory used while the file is worked on
+    with get_memory_budget().reserve(estimate_file_bytes(job_id, stage), control):
+        with get_rss_monitor().track(stage.name):
+            yield
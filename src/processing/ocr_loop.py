@@ -0,0 +1,76 @@
+import asyncio
+import concurrent.futures
+import logging
+import threading
+from collections.abc import Coroutine
+from typing import Any, TypeVar
+
+from src.util.async_google_api import AsyncVisionClient
+
+from .control import ProcessingCancelled, ProcessingControl
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# how often a thread waiting on the loop checks if its work was cancelled
+CANCEL_POLL_SECONDS = 0.2
+
+_OCR_LOOP: 'OcrEventLoop | None' = None
+_OCR_LOOP_LOCK = threading.Lock()
+
+
+class OcrEventLoop:
+    def __init__(self):
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run_loop, name='ocr-loop', daemon=True)
+        self._thread.start()
+
+        # every file shares the one client, so its semaphore bounds the calls for the whole app
+        self.client = AsyncVisionClient()
+        self.submit(self.client.open()).result()
+        logger.info(f'Started the OCR event loop with up to {self.client.max_in_flight()} requests in flight')
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> concurrent.futures.Future[T]:
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine: Coroutine[Any, Any, T], control: ProcessingControl | None = None) -> T:
+        # blocks the calling worker thread, cancelling the coroutine if the control is cancelled
+        future = self.submit(coroutine)
+        while True:
+            try:
+                return future.result(timeout=CANCEL_POLL_SECONDS)
+            except concurrent.futures.TimeoutError:
+                if control is not None and control.is_cancelled():
+                    future.cancel()
+                    raise ProcessingCancelled()
+
+    def shutdown(self) -> None:
+        self.submit(self.client.close()).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+def get_ocr_loop() -> OcrEventLoop:
+    global _OCR_LOOP
+
+    # worker threads ask for the loop, so only let one of them create it
+    with _OCR_LOOP_LOCK:
+        if _OCR_LOOP is None:
+            _OCR_LOOP = OcrEventLoop()
+        return _OCR_LOOP
+
+
+def shutdown_ocr_loop() -> None:
+    global _OCR_LOOP
+
+    with _OCR_LOOP_LOCK:
+        if _OCR_LOOP is not None:
+            logger.info('Shutting down the OCR event loop')
+            _OCR_LOOP.shutdown()
+            _OCR_LOOP = None
@@ -0,0 +1,64 @@
+import hashlib
+import logging
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from src.database import DB_ENGINE
+from src.database.page_ocr_words import PageOcrWords
+from src.util.google_api import annotate_url
+from src.util.settings import current_settings
+from src.util.types import BoxBounds, OcrWord
+
+logger = logging.getLogger(__name__)
+
+
+def page_fingerprint(aligned_image: np.ndarray) -> str:
+    # words from another endpoint, i.e. the local stand-in, are not the same words
+    digest = hashlib.sha256(np.ascontiguousarray(aligned_image).data)
+    digest.update(f'{aligned_image.shape}|{annotate_url()}'.encode())
+    return digest.hexdigest()
+
+
+def _contains(outer: BoxBounds, inner: BoxBounds) -> bool:
+    return (
+        outer.x <= inner.x
+        and outer.y <= inner.y
+        and inner.x + inner.width <= outer.x + outer.width
+        and inner.y + inner.height <= outer.y + outer.height
+    )
+
+
+def load_page_words(fingerprint: str, bounds: BoxBounds) -> list[OcrWord] | None:
+    # saved words only stand in for a new call when they came from the same image and cover the whole area,
+    # a region whose boxes moved into another region's area can use that region's words
+    if not current_settings().keep_page_words:
+        return None
+
+    with Session(DB_ENGINE) as session:
+        rows = session.scalars(
+            select(PageOcrWords).where(PageOcrWords.fingerprint == fingerprint).order_by(PageOcrWords.id.desc())
+        )
+        for row in rows:
+            if _contains(row.bounds, bounds):
+                return row.words
+
+    return None
+
+
+def save_page_words(input_file_id: int, fingerprint: str, bounds: BoxBounds, words: list[OcrWord]) -> None:
+    if not current_settings().keep_page_words:
+        return
+
+    with Session(DB_ENGINE) as session:
+        # anything inside the new area is covered by these words
+        for row in session.scalars(select(PageOcrWords).where(PageOcrWords.fingerprint == fingerprint)):
+            if _contains(bounds, row.bounds):
+                session.delete(row)
+
+        session.add(PageOcrWords(input_file_id=input_file_id, fingerprint=fingerprint, bounds=bounds, words=words))
+        session.commit()
+
+
+def clear_page_words(session: Session, input_file_id: int) -> None:
+    session.execute(delete(PageOcrWords).where(PageOcrWords.input_file_id == input_file_id))
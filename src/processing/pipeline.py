@@ -0,0 +1,217 @@
+import logging
+import queue
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from typing import Any, NamedTuple
+
+from src.util.logging import NamedLoggerAdapter
+from src.util.status import FileStatus
+
+from .control import ProcessingCancelled, ProcessingControl
+from .memory_budget import get_rss_monitor
+
+logger = logging.getLogger(__name__)
+
+# how many items a stage can have waiting per worker before upstream stages block
+QUEUE_ITEMS_PER_WORKER = 2
+
+
+@dataclass
+class PipelineItem:
+    job_id: int
+    file_id: int
+    log: logging.Logger | NamedLoggerAdapter
+    control: ProcessingControl | None = None
+    data: Any = None
+    statuses: dict[str, FileStatus] = field(default_factory=dict)
+    failed_stage: str | None = None
+    cancelled_stage: str | None = None
+    reserved_bytes: int = 0
+
+
+# a stage returns True to hand the item to the next stage or False when the item is done
+StageFunction = Callable[[PipelineItem], bool]
+
+
+class StageStats(NamedTuple):
+    name: str
+    workers: int
+    queued: int
+    queue_size: int
+    busy: int
+    completed: int
+    failed: int
+    busy_seconds: float
+
+
+class PipelineStage:
+    def __init__(self, name: str, function: StageFunction, workers: int, queue_size: int | None = None):
+        self.name = name
+        self.function = function
+        self.workers = max(1, workers)
+        self.queue_size = queue_size if queue_size is not None else self.workers * QUEUE_ITEMS_PER_WORKER
+
+        self._queue: queue.Queue[PipelineItem | None] = queue.Queue(maxsize=self.queue_size)
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._completed = 0
+        self._failed = 0
+        self._busy_seconds = 0.0
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def put(self, item: PipelineItem | None) -> None:
+        # blocks while the stage is backed up, which is what throttles the stages before it
+        self._queue.put(item)
+
+    def get(self) -> PipelineItem | None:
+        return self._queue.get()
+
+    def run(self, item: PipelineItem) -> bool:
+        with self._lock:
+            self._busy += 1
+
+        start = time.perf_counter()
+        failed = False
+        try:
+            with get_rss_monitor().track(self.name):
+                return self.function(item)
+        except ProcessingCancelled:
+            item.log.info(f'Cancelled in the "{self.name}" stage')
+            item.cancelled_stage = self.name
+            return False
+        except Exception:
+            item.log.exception(f'Unhandled exception in the "{self.name}" stage')
+            item.failed_stage = self.name
+            failed = True
+            return False
+        finally:
+            with self._lock:
+                self._busy -= 1
+                self._busy_seconds += time.perf_counter() - start
+                if failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+
+    def stats(self) -> StageStats:
+        with self._lock:
+            return StageStats(
+                name=self.name,
+                workers=self.workers,
+                queued=self.queue_depth(),
+                queue_size=self.queue_size,
+                busy=self._busy,
+                completed=self._completed,
+                failed=self._failed,
+                busy_seconds=self._busy_seconds,
+            )
+
+
+class StagedPipeline:
+    def __init__(
+            self,
+            stages: list[PipelineStage],
+            on_item_finished: Callable[[PipelineItem], None] | None = None,
+            on_item_submitted: Callable[[PipelineItem, str], None] | None = None,
+    ):
+        assert stages, 'A pipeline needs at least one stage'
+        self._stages = stages
+        self._on_item_finished = on_item_finished
+        self._on_item_submitted = on_item_submitted
+
+        self._threads: list[threading.Thread] = []
+        self._condition = threading.Condition()
+        self._in_flight = 0
+
+    def __enter__(self) -> 'StagedPipeline':
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.shutdown()
+
+    def start(self) -> None:
+        for index, stage in enumerate(self._stages):
+            logger.info(f'Starting stage "{stage.name}" with {stage.workers} workers (queue size: {stage.queue_size})')
+            for worker in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._run_stage,
+                    args=(index,),
+                    name=f'{stage.name}-{worker}',
+                    daemon=True,
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, item: PipelineItem, stage_name: str | None = None) -> None:
+        # items can skip ahead, i.e. files that were already aligned by an earlier run
+        stage = self._stages[0]
+        if stage_name is not None:
+            stage = next(candidate for candidate in self._stages if candidate.name == stage_name)
+
+        # runs on the submitting thread, so it can hold items back (i.e. until there is memory for them)
+        if self._on_item_submitted is not None:
+            self._on_item_submitted(item, stage.name)
+
+        with self._condition:
+            self._in_flight += 1
+
+        stage.put(item)
+
+    def wait(self) -> None:
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight == 0)
+
+    def shutdown(self) -> None:
+        self.wait()
+
+        # one sentinel per worker, every item is done so nothing is left behind them
+        for stage in self._stages:
+            for _ in range(stage.workers):
+                stage.put(None)
+
+        for thread in self._threads:
+            thread.join()
+        self._threads.clear()
+
+    def stats(self) -> list[StageStats]:
+        return [stage.stats() for stage in self._stages]
+
+    def describe(self) -> str:
+        return ' | '.join(
+            f'{stats.name}: {stats.queued}/{stats.queue_size} queued, {stats.busy}/{stats.workers} busy'
+            for stats in self.stats()
+        )
+
+    def _run_stage(self, index: int) -> None:
+        stage = self._stages[index]
+        next_stage = self._stages[index + 1] if index + 1 < len(self._stages) else None
+
+        while (item := stage.get()) is not None:
+            # drain cancelled items without running them so the pipeline can empty out
+            if item.control is not None and item.control.is_cancelled():
+                item.cancelled_stage = stage.name
+                self._finish_item(item)
+                continue
+
+            if stage.run(item) and next_stage is not None:
+                next_stage.put(item)
+            else:
+                self._finish_item(item)
+
+    def _finish_item(self, item: PipelineItem) -> None:
+        logger.debug(f'Pipeline state: {self.describe()}')
+
+        if self._on_item_finished is not None:
+            try:
+                self._on_item_finished(item)
+            except Exception:
+                logger.exception('Unhandled exception in pipeline item callback')
+
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
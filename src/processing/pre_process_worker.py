@@ -2,9 +2,12 @@ import cv2
 import logging
 import numpy as np
 import pymupdf
+import threading
+from concurrent.futures import Executor
+from dataclasses import dataclass
 from sqlalchemy.orm import Session
 
-from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal, QMutex, QMutexLocker
+from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal
 
 from src.database import DB_ENGINE
 from src.database.input_file import InputFile
@@ -13,139 +16,263 @@ from src.database.pre_processing.pre_process_result import PreProcessResult
 from src.util.logging import NamedLoggerAdapter
 from src.util.paths import LocalPaths
 from src.util.status import FileStatus
-from src.util.types import FormAlignmentMethod
+from src.util.types import FormAlignmentMethod, TaskStage
 
 from .alignment import AlignmentError, AlignmentFailed, reference_mark_alignment, automatic_alignment
+from .control import ProcessingCancelled, ProcessingControl, checkpoint
+from .image_prefetch import read_input_image, read_reference_image
+from .memory_budget import admit_file
+from .page_words import clear_page_words
+from .result_memo import clear_result, drop_fingerprint, record_result, reuse_result
+from .task_queue import reopen_task, run_task
 
 logger = logging.getLogger(__name__)
 
+# PyMuPDF is not thread safe, only let one worker touch a document at a time
+PDF_LOCK = threading.Lock()
+
+
+def clear_pre_process_result(session: Session, input_file: InputFile) -> None:
+    # a file being re-run (i.e. after a crash) replaces its old result, OCR of the old alignment goes with it
+    if input_file.process_result is not None:
+        clear_result(session, input_file, TaskStage.PROCESSING)
+        drop_fingerprint(session, input_file.id, TaskStage.PROCESSING)
+        reopen_task(session, input_file.id, TaskStage.PROCESSING)
+    clear_page_words(session, input_file.id)
+
+    result = input_file.pre_process_result
+    if result is None:
+        return
+
+    for attempt in result.rotation_attempts.values():
+        session.delete(attempt)
+    session.delete(result)
+
+    session.flush()
+    session.expire(input_file, ['pre_process_result'])
+
+
+@dataclass
+class PreProcessInputs:
+    input_image: np.ndarray
+    reference_image: np.ndarray
+
+
+def load_pre_process_inputs(
+        job_id: int,
+        file_id: int,
+        log: logging.Logger | NamedLoggerAdapter,
+        control: ProcessingControl | None = None,
+) -> PreProcessInputs | FileStatus | None:
+    checkpoint(control)
+
+    with Session(DB_ENGINE, autoflush=False) as session:
+        job = session.get(Job, job_id)
+        input_file = session.get(InputFile, file_id)
+
+        # do not pre-process container files
+        if input_file.container_file:
+            log.info('File is marked as a container file, skipping')
+            return None
+
+        # if we are linked, check if we need to save off our page from the PDF
+        if input_file.linked_input_file_id is not None and not input_file.path.exists():
+            linked_file = session.get(InputFile, input_file.linked_input_file_id)
+            if linked_file is None:
+                log.error(f'Could not find the linked file with ID: {input_file.linked_input_file_id}')
+                return FileStatus.FAILED
+
+            log.info(f'Extracting page from linked file: {linked_file.path.name}')
+
+            # TODO: could put the page number in the DB?
+            page_number = int(str(input_file.path.stem).split('page')[-1])
+
+            # extract the page from the PDF and save it to our path
+            with PDF_LOCK:
+                document = pymupdf.open(linked_file.path)
+                page_pixmap = document.load_page(page_number-1).get_pixmap(dpi=300)
+                page_pixmap.save(input_file.path)
+
+        # check that we have valid files
+        valid_files = True
+        if not input_file.path.exists():
+            log.error(f'Test image did not exist: {input_file.path}')
+            valid_files = False
+        elif not job.reference_form.path.exists():
+            log.error(f'Ref image did not exist: {job.reference_form.path}')
+            valid_files = False
+
+        if not valid_files:
+            clear_pre_process_result(session, input_file)
+            input_file.pre_process_result = PreProcessResult(successful_alignment=False, fully_aligned=False)
+            session.commit()
+            return FileStatus.FAILED
+
+        # a file aligned before against the same form is not aligned again
+        status = reuse_result(session, input_file, TaskStage.PRE_PROCESSING, log)
+        if status is not None:
+            return status
+
+        # Load and grayscale both images
+        input_image = read_input_image(file_id, TaskStage.PRE_PROCESSING, input_file.path)
+        input_image_gray = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
+        _, input_image_threshold = cv2.threshold(input_image_gray, 127, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+        reference_image_gray = read_reference_image(job.reference_form.path)
+
+        return PreProcessInputs(input_image=input_image_threshold, reference_image=reference_image_gray)
+
+
+def align_file(
+        job_id: int,
+        file_id: int,
+        inputs: PreProcessInputs,
+        log: logging.Logger | NamedLoggerAdapter,
+        control: ProcessingControl | None = None,
+) -> FileStatus:
+    checkpoint(control)
+
+    # only flush on commit so we do not hold the SQLite write lock while aligning
+    with Session(DB_ENGINE, autoflush=False) as session:
+        job = session.get(Job, job_id)
+        input_file = session.get(InputFile, file_id)
+
+        log.info(f'Using reference: {job.reference_form.name}')
+        clear_pre_process_result(session, input_file)
+        input_file.pre_process_result = PreProcessResult(successful_alignment=False, fully_aligned=False)
+
+        # Build the paths for our output results
+        pre_process_directory = LocalPaths.pre_processing_directory(job.uuid, input_file.id)
+        pre_process_directory.mkdir(exist_ok=True)
+
+        # Align the images based on the method in the reference form
+        match job.reference_form.alignment_method:
+            case FormAlignmentMethod.ALIGNMENT_MARKS:
+                log.info('Aligning images using alignment marks')
+
+                # rotate and attempt to align the images
+                try:
+                    status = reference_mark_alignment(
+                        logger=log,
+                        session=session,
+                        working_directory=pre_process_directory,
+                        reference_image=inputs.reference_image,
+                        test_image=inputs.input_image,
+                        alignment_mark_count=job.reference_form.alignment_mark_count,  # noqa
+                        result=input_file.pre_process_result,  # noqa
+                        control=control,
+                    )
+                except (AlignmentError, AlignmentFailed):
+                    status = FileStatus.FAILED
+
+            case FormAlignmentMethod.AUTOMATIC:
+                log.info('Aligning images using automatic alignment')
+
+                try:
+                    status = automatic_alignment(
+                        logger=log,
+                        session=session,
+                        working_directory=pre_process_directory,
+                        reference_image=inputs.reference_image,
+                        test_image=inputs.input_image,
+                        result=input_file.pre_process_result,  # noqa
+                        control=control,
+                    )
+                except (AlignmentError, AlignmentFailed):
+                    status = FileStatus.FAILED
+
+            case _:
+                raise RuntimeError(f'Unknown alignment method: {job.reference_form.alignment_method}')
+
+        record_result(session, input_file, TaskStage.PRE_PROCESSING, status)
+        session.commit()
+        return status
+
+
+def _load_and_align(
+        job_id: int,
+        file_id: int,
+        log: logging.Logger | NamedLoggerAdapter,
+        control: ProcessingControl | None = None,
+) -> FileStatus | None:
+    inputs = load_pre_process_inputs(job_id, file_id, log, control)
+    if not isinstance(inputs, PreProcessInputs):
+        return inputs
+
+    return align_file(job_id, file_id, inputs, log, control)
+
+
+def pre_process_file(
+        job_id: int,
+        file_id: int,
+        log: logging.Logger | NamedLoggerAdapter,
+        control: ProcessingControl | None = None,
+) -> FileStatus | None:
+    with admit_file(job_id, TaskStage.PRE_PROCESSING, control):
+        return _load_and_align(job_id, file_id, log, control)
+
+
+def run_pre_processing(job_id: int, file_id: int) -> str | None:
+    # entry point for child processes, enums are returned by name so they survive pickling.
+    # the parent admitted the file before handing it over, so it is not charged again here
+    log = NamedLoggerAdapter(logger, f'Process: {file_id}')
+    status = _load_and_align(job_id, file_id, log)
+    return None if status is None else status.name
+
+
+def run_alignment(job_id: int, file_id: int, inputs: PreProcessInputs) -> str:
+    # entry point for child processes that only run the alignment stage
+    log = NamedLoggerAdapter(logger, f'Process: {file_id}')
+    return align_file(job_id, file_id, inputs, log).name
+
 
 class PreProcessingWorker(QObject):
     updateStatus = pyqtSignal(int, FileStatus)
     processingComplete = pyqtSignal(int)
 
-    def __init__(self, job_id: int, file_id: int, mutex: QMutex):
+    def __init__(
+            self,
+            job_id: int,
+            file_id: int,
+            process_pool: Executor | None = None,
+            control: ProcessingControl | None = None,
+    ):
         super().__init__()
-        self.mutex = mutex
         self.job_id = job_id
         self.file_id = file_id
-
-        self.job: Job | None = None
-        self.input_file: InputFile | None = None
+        self.process_pool = process_pool
+        self.control = control
 
         self.log = NamedLoggerAdapter(logger, f'Thread: {file_id}')
 
-    def finish(self, session: Session, status: FileStatus) -> None:
-        session.commit()
-        self.updateStatus.emit(self.input_file.id, status)
-        self.processingComplete.emit(self.input_file.id)
-
-    def process(self) -> None:
-        with Session(DB_ENGINE) as session:
-            self.job = session.get(Job, self.job_id)
-            self.input_file = session.get(InputFile, self.file_id)
-
-            # do not pre-process container files
-            if self.input_file.container_file:
-                self.log.info('File is marked as a container file, skipping')
-                self.processingComplete.emit(self.input_file.id)
-                return
-
-            # if we are linked, check if we need to save off our page from the PDF
-            if self.input_file.linked_input_file_id is not None and not self.input_file.path.exists():
-                linked_file = session.get(InputFile, self.input_file.linked_input_file_id)
-                if linked_file is None:
-                    self.log.error(f'Could not find the linked file with ID: {self.input_file.linked_input_file_id}')
-                    self.updateStatus.emit(self.input_file.id, FileStatus.FAILED)
-                    self.processingComplete.emit(self.input_file.id)
-                    return
-
-                self.log.info(f'Extracting page from linked file: {linked_file.path.name}')
-
-                # TODO: could put the page number in the DB?
-                page_number = int(str(self.input_file.path.stem).split('page')[-1])
-
-                # extract the page from the PDF and save it to our path
-                document = pymupdf.open(linked_file.path)
-                page_pixmap = document.load_page(page_number-1).get_pixmap(dpi=300)
-                page_pixmap.save(self.input_file.path)
-
-            self.log.info(f'Using reference: {self.job.reference_form.name}')
-            self.input_file.pre_process_result = PreProcessResult(successful_alignment=False, fully_aligned=False)
-
-            # check that we have valid files
-            if not self.input_file.path.exists():
-                self.log.error(f'Test image did not exist: {self.input_file.path}')
-                self.finish(session, FileStatus.FAILED)
-                return
-
-            if not self.job.reference_form.path.exists():
-                self.log.error(f'Ref image did not exist: {self.job.reference_form.path}')
-                self.finish(session, FileStatus.FAILED)
-                return
-
-            # Build the paths for our output results
-            pre_process_directory = LocalPaths.pre_processing_directory(self.job.uuid, self.input_file.id)
-            pre_process_directory.mkdir(exist_ok=True)
-
-            # Load and grayscale both images
-            input_image = cv2.imread(str(self.input_file.path))
-            input_image_gray = cv2.cvtColor(input_image, cv2.COLOR_BGR2GRAY)
-            _, input_image_threshold = cv2.threshold(input_image_gray, 127, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
-
-            reference_image = cv2.imread(str(self.job.reference_form.path))
-            reference_image_gray = cv2.cvtColor(reference_image, cv2.COLOR_BGR2GRAY)
-
-            # Align the images based on the method in the reference form
-            match self.job.reference_form.alignment_method:
-                case FormAlignmentMethod.ALIGNMENT_MARKS:
-                    self.log.info('Aligning images using alignment marks')
-
-                    # rotate and attempt to align the images
-                    try:
-                        status = reference_mark_alignment(
-                            logger=self.log,
-                            session=session,
-                            working_directory=pre_process_directory,
-                            reference_image=reference_image_gray,
-                            test_image=input_image_threshold,
-                            alignment_mark_count=self.job.reference_form.alignment_mark_count,  # noqa
-                            result=self.input_file.pre_process_result,  # noqa
-                        )
-                        self.finish(session, status)
-
-                    except (AlignmentError, AlignmentFailed):
-                        self.finish(session, FileStatus.FAILED)
-
-                case FormAlignmentMethod.AUTOMATIC:
-                    self.log.info('Aligning images using automatic alignment')
-
-                    try:
-                        status = automatic_alignment(
-                            logger=self.log,
-                            session=session,
-                            working_directory=pre_process_directory,
-                            reference_image=reference_image_gray,
-                            test_image=input_image_threshold,
-                            result=self.input_file.pre_process_result,  # noqa
-                        )
-                        self.finish(session, status)
-
-                    except (AlignmentError, AlignmentFailed):
-                        self.finish(session, FileStatus.FAILED)
-
-                case _:
-                    raise RuntimeError(f'Unknown alignment method: {self.job.reference_form.alignment_method}')
+    def process(self) -> FileStatus | None:
+        if self.process_pool is None:
+            return pre_process_file(self.job_id, self.file_id, self.log, self.control)
+
+        # child processes can not see the pause/cancel state, so only check before handing the file over
+        checkpoint(self.control)
+
+        # hand the file to a child process and wait for it here so the pool slot stays busy
+        with admit_file(self.job_id, TaskStage.PRE_PROCESSING, self.control):
+            self.log.info('Pre-processing in a child process')
+            status_name = self.process_pool.submit(run_pre_processing, self.job_id, self.file_id).result()
+        return None if status_name is None else FileStatus[status_name]
 
     @pyqtSlot()
     def start(self) -> None:
-        locker = QMutexLocker(self.mutex)
         self.log.info('Staring thread')
 
         try:
-            self.process()
+            status = run_task(self.job_id, self.file_id, TaskStage.PRE_PROCESSING, self.process)
+        except ProcessingCancelled:
+            self.log.info('Pre-processing was cancelled')
+            status = FileStatus.PENDING
         except Exception:
             # don't let unhandled exceptions cause issues with threads
             self.log.exception('Unhandled exception during pre-processing')
-            self.updateStatus.emit(self.input_file.id, FileStatus.FAILED)
-            self.processingComplete.emit(self.input_file.id)
+            status = FileStatus.FAILED
+
+        # container files have no status of their own
+        if status is not None:
+            self.updateStatus.emit(self.file_id, status)
+        self.processingComplete.emit(self.file_id)
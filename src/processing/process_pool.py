@@ -0,0 +1,44 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from src.util.cpu_governor import apply_cpu_plan
+from src.util.logging import configure_child_logger, get_current_logfile
+from src.util.settings import SettingsManager
+
+logger = logging.getLogger(__name__)
+
+_PROCESS_POOL: ProcessPoolExecutor | None = None
+
+
+def _init_child_process(log_file: Path | None, min_level: int, worker_count: int) -> None:
+    configure_child_logger(log_file, min_level)
+    apply_cpu_plan(worker_count)
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    global _PROCESS_POOL
+
+    if _PROCESS_POOL is None:
+        worker_count = SettingsManager().pre_processing_worker_count()
+        logger.info(f'Starting process pool with {worker_count} workers')
+
+        # always spawn so children behave the same on every platform and never inherit Qt state
+        _PROCESS_POOL = ProcessPoolExecutor(
+            max_workers=worker_count,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_child_process,
+            initargs=(get_current_logfile(), logging.getLogger().getEffectiveLevel(), worker_count),
+        )
+
+    return _PROCESS_POOL
+
+
+def shutdown_process_pool() -> None:
+    global _PROCESS_POOL
+
+    if _PROCESS_POOL is not None:
+        logger.info('Shutting down process pool')
+        _PROCESS_POOL.shutdown(wait=True, cancel_futures=True)
+        _PROCESS_POOL = None
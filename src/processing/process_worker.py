@@ -1,18 +1,22 @@
-import cv2
+import asyncio
 import logging
 import numpy as np
 import requests
-import shutil
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Collection, NamedTuple, TypeVar
 from sqlalchemy.orm import Session
 
-from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal, QMutex, QMutexLocker
+from PyQt6.QtCore import QObject, pyqtSlot, pyqtSignal
 
 import src.util.processing as process_util
 from src.database import DB_ENGINE
 from src.database.fields.circled_field import CircledField
 from src.database.fields.checkbox_field import CheckboxField
 from src.database.fields.multi_checkbox_field import MultiCheckboxField
+from src.database.fields.multi_checkbox_option import MultiCheckboxOption
 from src.database.fields.text_field import TextField
 from src.database.input_file import InputFile
 from src.database.job import Job
@@ -27,35 +31,296 @@ from src.database.processed_fields.processed_text_field import ProcessedTextFiel
 from src.database.processed_fields.processed_sub_circled_option import ProcessedSubCircledOption
 from src.database.processing.processed_region import ProcessedRegion
 from src.database.processing.process_result import ProcessResult
+from src.database.reference_form import ReferenceForm
 from src.database.validation.validation_result import ValidationResult
-from src.util.google_api import open_api_session, ocr_text_region
+from src.util.async_google_api import AsyncVisionClient
+from src.util.google_api import (
+    DOCUMENT_TEXT_DETECTION, TEXT_DETECTION, open_api_session, ocr_text_regions, parse_annotate_response,
+    parse_annotate_words,
+)
 from src.util.logging import NamedLoggerAdapter
 from src.util.paths import LocalPaths
+from src.util.settings import current_settings
 from src.util.status import FileStatus
-from src.util.types import FormLinkingMethod
+from src.util.types import BoxBounds, FormLinkingMethod, TaskStage
 
 from . import validation
+from .control import ProcessingCancelled, ProcessingControl, async_checkpoint, checkpoint
+from .image_prefetch import read_input_image, read_reference_image
+from .memory_budget import admit_file
+from .ocr_loop import get_ocr_loop
+from .page_words import load_page_words, page_fingerprint, save_page_words
+from .result_memo import record_region_versions, record_result, reuse_result
+from .task_queue import run_task
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
 
-class ProcessWorker(QObject):
-    updateStatus = pyqtSignal(int, FileStatus)
-    processingComplete = pyqtSignal(int)
 
-    def __init__(self, job_id: int, file_id: int, mutex: QMutex):
-        super().__init__()
-        self.mutex = mutex
+class OcrTarget(NamedTuple):
+    kind: str
+    db_id: int
+
+
+@dataclass
+class OcrRequest:
+    image: np.ndarray
+    # where the image came from on the aligned page, stitched lines are in the order they were stitched
+    boxes: list[BoxBounds]
+    text: str | None = None
+
+
+@dataclass
+class ProcessInputs:
+    aligned_image: np.ndarray
+    reference_image: np.ndarray
+
+    # requests are grouped by region so each region can be OCR'd and saved on its own
+    ocr_requests: dict[int, dict[OcrTarget, OcrRequest]]
+
+    def region_requests(self, local_id: int) -> dict[OcrTarget, OcrRequest]:
+        return self.ocr_requests.get(local_id, {})
+
+
+def text_field_target(field: TextField) -> OcrTarget:
+    return OcrTarget('text', field.id)
+
+
+def checkbox_text_target(checkbox: MultiCheckboxOption) -> OcrTarget:
+    return OcrTarget('checkbox', checkbox.id)
+
+
+def plan_text_field(field: TextField, aligned_image: np.ndarray) -> OcrRequest | None:
+    if field.synthetic_only:
+        return None
+
+    # a checked default option replaces the OCR text
+    if field.checkbox_region is not None and process_util.get_checked(aligned_image, field.checkbox_region):
+        return None
+
+    ocr_region = field.visual_region
+    if field.text_regions is not None:
+        if len(field.text_regions) == 1:
+            ocr_region = field.text_regions[0]
+        else:
+            # Multiline images need to be stitched together for OCR
+            if any(process_util.should_ocr_region(aligned_image, region) for region in field.text_regions):
+                image = process_util.stitch_images(aligned_image, field.text_regions)
+                return OcrRequest(image=image, boxes=list(field.text_regions))
+            return None
+
+    if process_util.should_ocr_region(aligned_image, ocr_region):
+        return OcrRequest(image=process_util.snip_roi_image(aligned_image, ocr_region), boxes=[ocr_region])
+    return None
+
+
+def plan_ocr_requests(
+        reference_form: ReferenceForm,
+        aligned_image: np.ndarray,
+        skip_regions: Collection[int] = (),
+) -> dict[int, dict[OcrTarget, OcrRequest]]:
+    # work out every image that needs OCR up front so the requests can be run apart from the DB work
+    ocr_requests: dict[int, dict[OcrTarget, OcrRequest]] = {}
+    for local_id, page_region in reference_form.regions.items():
+        if local_id in skip_regions:
+            continue
+
+        region_requests = ocr_requests.setdefault(local_id, {})
+        for group in page_region.groups:
+            for field in group.fields:
+                if field.text_field is not None:
+                    request = plan_text_field(field.text_field, aligned_image)
+                    if request is not None:
+                        region_requests[text_field_target(field.text_field)] = request
+
+                elif field.multi_checkbox_field is not None:
+                    for checkbox in field.multi_checkbox_field.checkboxes:
+                        if checkbox.text_region is None:
+                            continue
+                        if process_util.should_ocr_region(aligned_image, checkbox.text_region):
+                            image = process_util.snip_roi_image(aligned_image, checkbox.text_region)
+                            region_requests[checkbox_text_target(checkbox)] = OcrRequest(
+                                image=image,
+                                boxes=[checkbox.text_region],
+                            )
+
+    return ocr_requests
+
+
+def run_ocr_batch(
+        session: requests.Session,
+        images: list[np.ndarray],
+        add_border: bool,
+        parse: Callable[[dict], T | None],
+        feature: str,
+        control: ProcessingControl | None,
+) -> list[T | None]:
+    checkpoint(control)
+    return ocr_text_regions(session, images, add_border, parse=parse, feature=feature)
+
+
+async def ocr_images_async(
+        client: AsyncVisionClient,
+        images: list[np.ndarray],
+        add_border: bool,
+        parse: Callable[[dict], T | None],
+        feature: str,
+        control: ProcessingControl | None = None,
+) -> list[T | None]:
+    async def run_image(image: np.ndarray) -> T | None:
+        await async_checkpoint(control)
+        return await client.ocr_text_region(image, add_border=add_border, parse=parse, feature=feature)
+
+    # the client packs these into shared calls and limits how many calls are on the network
+    tasks = [asyncio.ensure_future(run_image(image)) for image in images]
+    try:
+        return list(await asyncio.gather(*tasks))
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+def ocr_images(
+        images: list[np.ndarray],
+        add_border: bool,
+        parse: Callable[[dict], T | None],
+        log: logging.Logger | NamedLoggerAdapter,
+        control: ProcessingControl | None = None,
+        session: requests.Session | None = None,
+        feature: str = TEXT_DETECTION,
+) -> list[T | None]:
+    settings = current_settings()
+    if settings.ocr_async_client:
+        log.info(f'Running OCR on {len(images)} images')
+        ocr_loop = get_ocr_loop()
+        return ocr_loop.run(ocr_images_async(ocr_loop.client, images, add_border, parse, feature, control), control)
+
+    session = session or open_api_session()
+
+    # several images go in each call, the calls themselves run side by side
+    batch_size = settings.ocr_batch_size_count()
+    batches = [images[idx:idx + batch_size] for idx in range(0, len(images), batch_size)]
+    concurrency = min(settings.ocr_concurrency_count(), len(batches))
+    log.info(f'Running OCR on {len(images)} images in {len(batches)} calls ({concurrency} at a time)')
+
+    if concurrency == 1:
+        results = []
+        for batch in batches:
+            results.extend(run_ocr_batch(session, batch, add_border, parse, feature, control))
+        return results
+
+    # the images do not depend on each other, identifiers and linking only look at the text once it is all back
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='ocr') as executor:
+        futures = [
+            executor.submit(run_ocr_batch, session, batch, add_border, parse, feature, control) for batch in batches
+        ]
+        try:
+            return [result for future in futures for result in future.result()]
+        except BaseException:
+            # one failure or a cancel sinks the region, so do not send what is left
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def run_page_ocr(
+        request_list: list[OcrRequest],
+        aligned_image: np.ndarray,
+        log: logging.Logger | NamedLoggerAdapter,
+        control: ProcessingControl | None = None,
+        session: requests.Session | None = None,
+        input_file_id: int | None = None,
+) -> None:
+    # one image around all the fields, each field gets the words that fall in its boxes
+    boxes = [box for request in request_list for box in request.boxes]
+    bounds = process_util.page_ocr_bounds(aligned_image, boxes)
+
+    # words saved by an earlier run of this page are re-read when the form's boxes changed, no OCR needed
+    words = None
+    fingerprint = None
+    if input_file_id is not None:
+        fingerprint = page_fingerprint(aligned_image)
+        words = load_page_words(fingerprint, process_util.page_ocr_bounds(aligned_image, boxes, margin=0))
+    if words is not None:
+        log.info(f'Assigning {len(words)} saved OCR words to {len(request_list)} fields')
+    else:
+        log.info(f'Running OCR on a {bounds.width}x{bounds.height} area holding {len(request_list)} fields')
+        page_image = process_util.snip_roi_image(aligned_image, bounds)
+        words = ocr_images([page_image], False, parse_annotate_words, log, control, session, DOCUMENT_TEXT_DETECTION)[0]
+        if words is None:
+            for request in request_list:
+                request.text = None
+            return
+
+        words = process_util.offset_words(words, bounds.x, bounds.y)
+        if input_file_id is not None:
+            save_page_words(input_file_id, fingerprint, bounds, words)
+
+    box_words = process_util.assign_words(words, boxes)
+    cursor = 0
+    for request in request_list:
+        texts = [process_util.words_to_text(words) for words in box_words[cursor:cursor + len(request.boxes)]]
+        request.text = ' '.join(text for text in texts if text)
+        cursor += len(request.boxes)
+
+
+def run_ocr_requests(
+        ocr_requests: dict[OcrTarget, OcrRequest],
+        aligned_image: np.ndarray,
+        log: logging.Logger | NamedLoggerAdapter,
+        control: ProcessingControl | None = None,
+        session: requests.Session | None = None,
+        input_file_id: int | None = None,
+) -> None:
+    if not ocr_requests:
+        return
+
+    request_list = list(ocr_requests.values())
+    settings = current_settings()
+    if settings.ocr_full_page:
+        run_page_ocr(request_list, aligned_image, log, control, session, input_file_id)
+        return
+
+    images = [request.image for request in request_list]
+    if not settings.ocr_mosaic:
+        texts = ocr_images(images, True, parse_annotate_response, log, control, session)
+        for request, text in zip(request_list, texts):
+            request.text = text
+        return
+
+    # small field images are packed into a few large ones, the words are mapped back by where they sit
+    mosaics = process_util.build_mosaics(images)
+    log.info(f'Packed {len(images)} OCR regions into {len(mosaics)} mosaic images')
+
+    mosaic_words = ocr_images([mosaic.image for mosaic in mosaics], False, parse_annotate_words, log, control, session)
+    for mosaic, words in zip(mosaics, mosaic_words):
+        for idx, text in zip(mosaic.indexes, mosaic.tile_texts(words)):
+            request_list[idx].text = text
+
+
+class FileProcessor:
+    def __init__(
+            self,
+            job_id: int,
+            file_id: int,
+            log: logging.Logger | NamedLoggerAdapter,
+            control: ProcessingControl | None = None,
+    ):
         self._job_id = job_id
         self._file_id = file_id
+        self._control = control
 
-        self.log = NamedLoggerAdapter(logger, f'Thread: {file_id}')
+        # linked fields from this run only get an ID once the session is flushed
+        self._unflushed_links: list[tuple[ProcessedTextField, ProcessedTextField]] = []
+
+        self.log = log
 
     def process_text_field(
             self,
-            session: requests.Session,
             field: TextField,
             aligned_image: np.ndarray,
+            ocr_request: OcrRequest | None,
             roi_dest_path: Path,
             linking_method: FormLinkingMethod,
             current_region: ProcessedRegion,
@@ -78,22 +343,6 @@ class ProcessWorker(QObject):
         # Snip and save off the ROI image
         process_util.snip_roi_image(aligned_image, field.visual_region, save_path=roi_dest_path)
 
-        ocr_region = field.visual_region
-
-        # Check if we need to change the region we OCR
-        force_ocr = False
-        roi_image = None
-        if field.text_regions is not None:
-            if len(field.text_regions) == 1:
-                ocr_region = field.text_regions[0]
-            else:
-                # Multiline images need to be stitched together for OCR
-                ocr_region = None
-                roi_image = process_util.stitch_images(aligned_image, field.text_regions)
-                force_ocr = any(
-                    [process_util.should_ocr_region(aligned_image, region) for region in field.text_regions]
-                )
-
         ocr_error = False
         from_controlled_language = False if field.checkbox_region is not None else None
         if field.checkbox_region is not None and process_util.get_checked(aligned_image, field.checkbox_region):
@@ -101,14 +350,8 @@ class ProcessWorker(QObject):
             self.log.info(f'Detected checked default option, using: {field.checkbox_text}')
             ocr_result = field.checkbox_text
             from_controlled_language = True
-        elif force_ocr or process_util.should_ocr_region(aligned_image, ocr_region):
-            ocr_result = ocr_text_region(
-                session,
-                aligned_image,
-                ocr_region,
-                roi_image=roi_image,
-                add_border=True,
-            )
+        elif ocr_request is not None:
+            ocr_result = ocr_request.text
             ocr_error = ocr_result is None
             self.log.info(f'OCR returned: "{ocr_result}"')
         else:
@@ -121,6 +364,7 @@ class ProcessWorker(QObject):
         # Check if we should search for a linking field
         copied_from_linked = False if field.allow_copy else None
         linked_field_id = None
+        link_field = None
         if field.allow_copy:
             link_field = process_util.locate_linked_field(
                 link_method=linking_method,
@@ -148,7 +392,7 @@ class ProcessWorker(QObject):
             self.log.info(f'Validation correction: "{ocr_result}" -> "{validation_result.correction}"')
             text = validation_result.correction
 
-        field = ProcessedTextField(
+        processed_field = ProcessedTextField(
             name=field.name,
             roi_path=roi_dest_path,
             text=text,
@@ -159,7 +403,10 @@ class ProcessWorker(QObject):
             validation_result=validation_result,
             text_field=field,
         )
-        return ocr_error, field
+        if field.allow_copy and link_field is not None and linked_field_id is None:
+            self._unflushed_links.append((processed_field, link_field))
+
+        return ocr_error, processed_field
 
     def process_checkbox_field(
             self,
@@ -181,9 +428,9 @@ class ProcessWorker(QObject):
 
     def process_multi_checkbox_field(
             self,
-            session: requests.Session,
             field: MultiCheckboxField,
             aligned_image: np.ndarray,
+            ocr_requests: dict[OcrTarget, OcrRequest],
             roi_dest_path: Path,
     ) -> tuple[bool, ProcessedMultiCheckboxField]:
         # Snip and save off the ROI image
@@ -198,9 +445,10 @@ class ProcessWorker(QObject):
             # If the checkbox has a text region, check if we should run OCR
             optional_text: str | None = None
             if checkbox.text_region is not None:
-                if process_util.should_ocr_region(aligned_image, checkbox.text_region):
-                    optional_text = ocr_text_region(session, aligned_image, checkbox.text_region, add_border=True)
-                    ocr_error = optional_text is None
+                ocr_request = ocr_requests.get(checkbox_text_target(checkbox))
+                if ocr_request is not None:
+                    optional_text = ocr_request.text
+                    ocr_error = ocr_error or optional_text is None
                     self.log.info(f'OCR returned: "{optional_text}"')
                 else:
                     self.log.info(f'Detected mostly white image, skipping OCR')
@@ -273,48 +521,99 @@ class ProcessWorker(QObject):
         )
         return False, field
 
-    @pyqtSlot()
-    def start(self) -> None:
-        locker = QMutexLocker(self.mutex)
-        self.log.info('Staring thread')
+    def link_unflushed_fields(self, session: Session) -> None:
+        if not self._unflushed_links:
+            return
+
+        # assign the IDs now that the linked fields exist in the DB
+        session.flush()
+        for processed_field, link_field in self._unflushed_links:
+            processed_field.linked_field_id = link_field.id
+        self._unflushed_links.clear()
 
+    def prepare(self) -> ProcessInputs | FileStatus | None:
         with Session(DB_ENGINE) as session:
-            job = session.get(Job, self._job_id)
             input_file = session.get(InputFile, self._file_id)
 
             # do not process container files
             if input_file.container_file:
                 self.log.info('File is marked as a container file, skipping')
-                self.processingComplete.emit(input_file.id)
-                return
+                return None
 
             assert input_file.pre_process_result.aligned_image_path.exists(), \
                 f'Path does not exist: {input_file.pre_process_result.aligned_image_path}'
 
+            # a file OCR'd before with the same aligned image and form is not sent to the API again
+            status = reuse_result(session, input_file, TaskStage.PROCESSING, self.log)
+            if status is not None:
+                return status
+
             # Load the reference and aligned image from our pre-processing
-            aligned_image = cv2.imread(
-                str(input_file.pre_process_result.aligned_image_path),
-                flags=cv2.IMREAD_GRAYSCALE,
+            aligned_image = read_input_image(
+                self._file_id,
+                TaskStage.PROCESSING,
+                input_file.pre_process_result.aligned_image_path,
+            )
+            reference_image = read_reference_image(input_file.job.reference_form.path)
+
+            # regions saved by an earlier run are not OCR'd again
+            finished_regions = []
+            if input_file.process_result is not None:
+                finished_regions = list(input_file.process_result.regions.keys())
+                self.log.info(f'Resuming processing, {len(finished_regions)} regions are already done')
+
+            return ProcessInputs(
+                aligned_image=aligned_image,
+                reference_image=reference_image,
+                ocr_requests=plan_ocr_requests(input_file.job.reference_form, aligned_image, finished_regions),
             )
-            reference_image = cv2.cvtColor(cv2.imread(str(input_file.job.reference_form.path)), cv2.COLOR_BGR2GRAY)
 
-            # Create a working directory to store our ROI snips
-            processing_directory = LocalPaths.processing_directory(job.uuid, input_file.id)
-            if processing_directory.exists():
-                self.log.warning(f'Processing directory already exists: {processing_directory}')
-                shutil.rmtree(processing_directory)
-            processing_directory.mkdir()
+    def persist(
+            self,
+            inputs: ProcessInputs,
+            run_ocr: bool = False,
+            api_session: requests.Session | None = None,
+    ) -> FileStatus:
+        aligned_image = inputs.aligned_image
+        reference_image = inputs.reference_image
+
+        # only flush on commit so we do not hold the SQLite write lock while building results
+        with Session(DB_ENGINE, autoflush=False) as session:
+            job = session.get(Job, self._job_id)
+            input_file = session.get(InputFile, self._file_id)
 
-            # Establish a session to the Google API
-            api_session = open_api_session()
+            # Create a working directory to store our ROI snips, keeping any from regions that are already done
+            processing_directory = LocalPaths.processing_directory(job.uuid, input_file.id)
+            processing_directory.mkdir(exist_ok=True)
 
-            result = ProcessResult()
-            input_file.process_result = result
+            # each region is committed as it finishes, so pick up where an earlier run stopped
+            result = input_file.process_result
+            if result is None:
+                result = ProcessResult()
+                input_file.process_result = result
+                session.commit()
 
             # Work through all regions in the reference form
-            processing_error = False
             identifier_field: ProcessedTextField | None = None
             for local_id, page_region in job.reference_form.regions.items():
+                if local_id in result.regions:
+                    self.log.info(f'Region "{page_region.name}" ({local_id}) was already processed, skipping')
+                    continue
+
+                # a cancel drops the region that is in progress, the session rolls it back on exit
+                checkpoint(self._control)
+
+                region_requests = inputs.region_requests(local_id)
+                if run_ocr:
+                    run_ocr_requests(
+                        region_requests,
+                        aligned_image,
+                        self.log,
+                        self._control,
+                        api_session,
+                        self._file_id,
+                    )
+
                 self.log.info('-' * 15)
                 self.log.info(f'Processing region: "{page_region.name}" ({local_id})')
                 processed_region = ProcessedRegion(
@@ -333,7 +632,7 @@ class ProcessWorker(QObject):
 
                     # snip the visual region for the whole group
                     if group.visual_region is not None:
-                        processed_field_group.roi_path = processing_directory / f'fg_{field.id}.png'
+                        processed_field_group.roi_path = processing_directory / f'fg_{group.id}.png'
                         process_util.snip_roi_image(
                             aligned_image,
                             group.visual_region,
@@ -341,15 +640,17 @@ class ProcessWorker(QObject):
                         )
 
                     for field in group.fields:
+                        checkpoint(self._control)
+
                         roi_path = processing_directory / f'{field.id}.png'
                         processed_field = ProcessedField(processing_error=False)
 
                         if field.text_field is not None:
                             self.log.info(f'Processing Text Field: {field.text_field.name}')
                             had_error, result_field = self.process_text_field(
-                                session=api_session,
                                 field=field.text_field,
                                 aligned_image=aligned_image,
+                                ocr_request=region_requests.get(text_field_target(field.text_field)),
                                 roi_dest_path=roi_path,
                                 linking_method=job.reference_form.linking_method,
                                 current_region=processed_region,
@@ -381,9 +682,9 @@ class ProcessWorker(QObject):
                         elif field.multi_checkbox_field is not None:
                             self.log.info(f'Processing Multi-Checkbox Field: {field.multi_checkbox_field.name}')
                             had_error, result_field = self.process_multi_checkbox_field(
-                                session=api_session,
                                 field=field.multi_checkbox_field,
                                 aligned_image=aligned_image,
+                                ocr_requests=region_requests,
                                 roi_dest_path=roi_path,
                             )
 
@@ -407,10 +708,76 @@ class ProcessWorker(QObject):
                             processed_field.processing_error = True
 
                         # Add the processed field to our region
-                        processing_error = processed_field.processing_error
                         processed_field_group.fields.append(processed_field)
 
-            # Commit the results to the DB and signal out that our status is changed
+                # Checkpoint the region so a rerun starts at the next one
+                self.link_unflushed_fields(session)
+                record_region_versions(session, input_file, [local_id])
+                session.commit()
+
+            processing_error = any(
+                field.processing_error
+                for region in result.regions.values()
+                for group in region.groups
+                for field in group.fields
+            )
+            status = FileStatus.SUCCESS if not processing_error else FileStatus.FAILED
+
+            record_result(session, input_file, TaskStage.PROCESSING, status)
             session.commit()
-            self.updateStatus.emit(input_file.id, FileStatus.SUCCESS if not processing_error else FileStatus.FAILED)
-            self.processingComplete.emit(input_file.id)
+            return status
+
+    def process(self) -> FileStatus | None:
+        inputs = self.prepare()
+        if not isinstance(inputs, ProcessInputs):
+            return inputs
+
+        # OCR runs a region at a time, right before that region is saved
+        return self.persist(inputs, run_ocr=True)
+
+
+def process_file(
+        job_id: int,
+        file_id: int,
+        log: logging.Logger | NamedLoggerAdapter,
+        control: ProcessingControl | None = None,
+) -> FileStatus | None:
+    with admit_file(job_id, TaskStage.PROCESSING, control):
+        return FileProcessor(job_id, file_id, log, control).process()
+
+
+class ProcessWorker(QObject):
+    updateStatus = pyqtSignal(int, FileStatus)
+    processingComplete = pyqtSignal(int)
+
+    def __init__(self, job_id: int, file_id: int, control: ProcessingControl | None = None):
+        super().__init__()
+        self._job_id = job_id
+        self._file_id = file_id
+        self._control = control
+
+        self.log = NamedLoggerAdapter(logger, f'Thread: {file_id}')
+
+    @pyqtSlot()
+    def start(self) -> None:
+        self.log.info('Staring thread')
+
+        try:
+            status = run_task(
+                self._job_id,
+                self._file_id,
+                TaskStage.PROCESSING,
+                lambda: process_file(self._job_id, self._file_id, self.log, self._control),
+            )
+        except ProcessingCancelled:
+            self.log.info('Processing was cancelled')
+            status = FileStatus.PENDING
+        except Exception:
+            # don't let unhandled exceptions cause issues with threads
+            self.log.exception('Unhandled exception during processing')
+            status = FileStatus.FAILED
+
+        # container files have no status of their own
+        if status is not None:
+            self.updateStatus.emit(self._file_id, status)
+        self.processingComplete.emit(self._file_id)
@@ -0,0 +1,351 @@
+import hashlib
+import json
+import logging
+import shutil
+import threading
+import time
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+from sqlalchemy import Connection, delete, select
+from sqlalchemy.orm import Session
+
+from src.database.form_region import FormRegion
+from src.database.input_file import InputFile
+from src.database.pre_processing.pre_process_result import PreProcessResult
+from src.database.processing.process_result import ProcessResult
+from src.database.reference_form import ReferenceForm
+from src.database.region_fingerprint import RegionFingerprint
+from src.database.result_fingerprint import ResultFingerprint
+from src.database.rows import Rows, delete_subtree, insert_rows, select_subtree, split_tables, table_of
+from src.database.util import DbPath
+from src.util.google_api import OCR_FIXES, annotate_url
+from src.util.logging import NamedLoggerAdapter
+from src.util.paths import LocalPaths
+from src.util.processing import (
+    CHECKBOX_WHITE_PIXEL_THRESHOLD, CIRCLED_WHITE_PIXEL_THRESHOLD, OCR_WHITE_PIXEL_THRESHOLD,
+)
+from src.util.settings import current_settings
+from src.util.status import FileStatus
+from src.util.types import FormLinkingMethod, TaskStage
+
+from .alignment import ALLOWED_ROTATIONS, KEYPOINT_KEEP_THRESHOLD, MAX_FEATURES
+
+logger = logging.getLogger(__name__)
+
+# bump when a change to alignment or processing gives different results for the same inputs
+FINGERPRINT_VERSION = 1
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# how long a form's hash is reused for, a run only reads a form and it can not be edited while files are processed
+FORM_HASH_SECONDS = 300
+
+_form_hashes: dict[int, tuple[float, str]] = {}
+_region_hashes: dict[int, tuple[float, dict[int, str]]] = {}
+_form_image_hashes: dict[tuple[Path, int, int], str] = {}
+_form_hash_lock = threading.Lock()
+
+RESULT_MODELS = {
+    TaskStage.PRE_PROCESSING: PreProcessResult,
+    TaskStage.PROCESSING: ProcessResult,
+}
+RESULT_DIRECTORIES = {
+    TaskStage.PRE_PROCESSING: LocalPaths.pre_processing_directory,
+    TaskStage.PROCESSING: LocalPaths.processing_directory,
+}
+
+
+def hash_file(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open('rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _hash_json(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _form_image_hash(path: Path) -> str:
+    stat = path.stat()
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    with _form_hash_lock:
+        cached = _form_image_hashes.get(key)
+    if cached is None:
+        cached = hash_file(path)
+        with _form_hash_lock:
+            _form_image_hashes[key] = cached
+    return cached
+
+
+def form_version_hash(connection: Connection, form: ReferenceForm, use_cache: bool = True) -> str:
+    # every file of a run shares the form, so it is only hashed once a run instead of once a file
+    now = time.monotonic()
+    if use_cache:
+        with _form_hash_lock:
+            cached = _form_hashes.get(form.id)
+        if cached is not None and now - cached[0] < FORM_HASH_SECONDS:
+            return cached[1]
+
+    form_hash = _hash_form(connection, form)
+    with _form_hash_lock:
+        _form_hashes[form.id] = (now, form_hash)
+    return form_hash
+
+
+def _hash_rows(rows: Rows, image_path: Path) -> str:
+    content = {
+        table.name: [
+            {name: value for name, value in row.items() if not isinstance(table.c[name].type, DbPath)}
+            for row in table_rows
+        ]
+        for table, table_rows in rows.items()
+    }
+    return _hash_json({'rows': content, 'image': _form_image_hash(image_path)})
+
+
+def _hash_form(connection: Connection, form: ReferenceForm) -> str:
+    # the regions, fields and validators all hang off the form, the image is hashed on its own
+    form_tables, _ = split_tables()
+    return _hash_rows(select_subtree(connection, table_of(ReferenceForm), [form.id], form_tables), form.path)
+
+
+def region_version_hashes(connection: Connection, form: ReferenceForm, use_cache: bool = True) -> dict[int, str]:
+    # a processed region only depends on its own form region, so an edit only costs the regions it touched
+    now = time.monotonic()
+    if use_cache:
+        with _form_hash_lock:
+            cached = _region_hashes.get(form.id)
+        if cached is not None and now - cached[0] < FORM_HASH_SECONDS:
+            return cached[1]
+
+    form_tables, _ = split_tables()
+    region_table = table_of(FormRegion)
+    child_tables = [table for table in form_tables if table is not region_table]
+
+    hashes = {}
+    regions = connection.execute(
+        select(region_table.c.id, region_table.c.local_id).where(region_table.c.reference_form_id == form.id)
+    )
+    for region_id, local_id in regions:
+        hashes[local_id] = _hash_rows(select_subtree(connection, region_table, [region_id], child_tables), form.path)
+
+    with _form_hash_lock:
+        _region_hashes[form.id] = (now, hashes)
+    return hashes
+
+
+def record_region_versions(session: Session, input_file: InputFile, local_ids: Iterable[int]) -> None:
+    # saved next to the processed regions, so a later edit to the form can tell which of them are out of date
+    hashes = region_version_hashes(session.connection(), input_file.job.reference_form)
+    existing = {
+        row.region_local_id: row
+        for row in session.scalars(select(RegionFingerprint).where(RegionFingerprint.input_file_id == input_file.id))
+    }
+
+    for local_id in local_ids:
+        fingerprint = hashes.get(local_id)
+        row = existing.get(local_id)
+        if fingerprint is None:
+            if row is not None:
+                session.delete(row)
+        elif row is None:
+            session.add(
+                RegionFingerprint(input_file_id=input_file.id, region_local_id=local_id, fingerprint=fingerprint)
+            )
+        else:
+            row.fingerprint = fingerprint
+
+
+def stage_settings(stage: TaskStage) -> dict[str, Any]:
+    match stage:
+        case TaskStage.PRE_PROCESSING:
+            return {
+                'rotations': [float(rotation) for rotation in ALLOWED_ROTATIONS],
+                'max_features': MAX_FEATURES,
+                'keypoint_keep_threshold': KEYPOINT_KEEP_THRESHOLD,
+            }
+        case TaskStage.PROCESSING:
+            return {
+                'ocr_white_threshold': OCR_WHITE_PIXEL_THRESHOLD,
+                'checkbox_white_threshold': CHECKBOX_WHITE_PIXEL_THRESHOLD,
+                'circled_white_threshold': CIRCLED_WHITE_PIXEL_THRESHOLD,
+                'ocr_fixes': OCR_FIXES,
+                'annotate_url': annotate_url(),
+                'ocr_mosaic': current_settings().ocr_mosaic,
+                'ocr_full_page': current_settings().ocr_full_page,
+            }
+        case _:
+            raise RuntimeError(f'Unknown task stage: {stage}')
+
+
+def stage_input_path(input_file: InputFile, stage: TaskStage) -> Path | None:
+    # OCR only sees the aligned image, so that is what its results depend on
+    match stage:
+        case TaskStage.PRE_PROCESSING:
+            return input_file.path
+        case TaskStage.PROCESSING:
+            result = input_file.pre_process_result
+            return result.aligned_image_path if result is not None else None
+        case _:
+            raise RuntimeError(f'Unknown task stage: {stage}')
+
+
+def file_fingerprint(session: Session, input_file: InputFile, stage: TaskStage) -> str | None:
+    form = input_file.job.reference_form
+
+    # linked fields copy from the file before, so the results depend on more than this file
+    if stage is TaskStage.PROCESSING and form.linking_method is not FormLinkingMethod.NO_LINKING:
+        return None
+
+    path = stage_input_path(input_file, stage)
+    if path is None or not path.exists() or not form.path.exists():
+        return None
+
+    return _hash_json({
+        'version': FINGERPRINT_VERSION,
+        'stage': stage.name,
+        'input': hash_file(path),
+        'form': form_version_hash(session.connection(), form),
+        'settings': stage_settings(stage),
+    })
+
+
+def _has_reusable_result(input_file: InputFile, stage: TaskStage) -> bool:
+    match stage:
+        case TaskStage.PRE_PROCESSING:
+            result = input_file.pre_process_result
+            return (
+                result is not None
+                and result.successful_alignment
+                and result.aligned_image_path is not None
+                and result.aligned_image_path.exists()
+            )
+        case TaskStage.PROCESSING:
+            return input_file.fully_processed()
+        case _:
+            raise RuntimeError(f'Unknown task stage: {stage}')
+
+
+def _find_source(session: Session, fingerprint: str, stage: TaskStage) -> ResultFingerprint | None:
+    # the newest match first, older ones may have been re-run or cleared since
+    candidates = session.scalars(
+        select(ResultFingerprint)
+        .where(ResultFingerprint.fingerprint == fingerprint, ResultFingerprint.stage == stage)
+        .order_by(ResultFingerprint.id.desc())
+    )
+    for candidate in candidates:
+        source = session.get(InputFile, candidate.input_file_id)
+        if source is not None and _has_reusable_result(source, stage):
+            return candidate
+
+    return None
+
+
+def clear_result(session: Session, input_file: InputFile, stage: TaskStage) -> None:
+    connection = session.connection()
+    _, result_tables = split_tables()
+    root = table_of(RESULT_MODELS[stage])
+
+    result_ids = connection.scalars(select(root.c.id).where(root.c.input_file_id == input_file.id)).all()
+    delete_subtree(connection, root, result_ids, [table for table in result_tables if table is not root])
+    if stage is TaskStage.PROCESSING:
+        connection.execute(delete(RegionFingerprint).where(RegionFingerprint.input_file_id == input_file.id))
+
+    session.expire(input_file)
+
+
+def _copy_result(session: Session, source: InputFile, target: InputFile, stage: TaskStage) -> None:
+    connection = session.connection()
+    _, result_tables = split_tables()
+    root = table_of(RESULT_MODELS[stage])
+    tables = [root, *(table for table in result_tables if table is not root)]
+
+    # the images go first so the copied rows never point at files that are not there
+    source_dir = RESULT_DIRECTORIES[stage](source.job.uuid, source.id)
+    target_dir = RESULT_DIRECTORIES[stage](target.job.uuid, target.id)
+    if source_dir.exists():
+        shutil.copytree(source_dir, target_dir, dirs_exist_ok=True)
+
+    def rebase(path: Path) -> Path:
+        return target_dir / path.relative_to(source_dir) if path.is_relative_to(source_dir) else path
+
+    # anything the target had, i.e. regions from an interrupted run, is replaced
+    clear_result(session, target, stage)
+
+    source_ids = connection.scalars(select(root.c.id).where(root.c.input_file_id == source.id)).all()
+    rows = select_subtree(connection, root, source_ids, tables[1:])
+    insert_rows(connection, rows, tables, False, {table_of(InputFile): {source.id: target.id}}, rebase)
+
+    session.expire(target)
+
+
+def _store_fingerprint(
+        session: Session,
+        file_id: int,
+        stage: TaskStage,
+        fingerprint: str | None,
+        status: FileStatus | None,
+) -> None:
+    existing = session.scalars(
+        select(ResultFingerprint).where(ResultFingerprint.input_file_id == file_id, ResultFingerprint.stage == stage)
+    ).first()
+
+    if fingerprint is None:
+        if existing is not None:
+            session.delete(existing)
+    elif existing is None:
+        session.add(ResultFingerprint(input_file_id=file_id, stage=stage, fingerprint=fingerprint, status=status))
+    else:
+        existing.fingerprint = fingerprint
+        existing.status = status
+
+
+def drop_fingerprint(session: Session, file_id: int, stage: TaskStage) -> None:
+    _store_fingerprint(session, file_id, stage, None, None)
+
+
+def reuse_result(
+        session: Session,
+        input_file: InputFile,
+        stage: TaskStage,
+        log: logging.Logger | NamedLoggerAdapter,
+) -> FileStatus | None:
+    # returns the status of the result that was reused, or None when the stage has to run
+    if not current_settings().reuse_results:
+        return None
+
+    fingerprint = file_fingerprint(session, input_file, stage)
+    if fingerprint is None:
+        return None
+
+    match = _find_source(session, fingerprint, stage)
+    if match is None:
+        return None
+
+    status = match.status
+    if match.input_file_id == input_file.id:
+        log.info(f'Inputs are unchanged since the last {stage.name} run, keeping its result')
+    else:
+        source = session.get(InputFile, match.input_file_id)
+        log.info(f'Reusing the {stage.name} result of input file {source.id} ({source.path.name})')
+        _copy_result(session, source, input_file, stage)
+
+    # the form matched, so every region is up to date with it
+    if stage is TaskStage.PROCESSING:
+        record_region_versions(session, input_file, input_file.process_result.regions.keys())
+
+    _store_fingerprint(session, input_file.id, stage, fingerprint, status)
+    session.commit()
+    return status
+
+
+def record_result(session: Session, input_file: InputFile, stage: TaskStage, status: FileStatus | None) -> None:
+    # only results worth handing out again are fingerprinted, anything else drops an older fingerprint
+    fingerprint = None
+    if status in (FileStatus.SUCCESS, FileStatus.WARNING) and current_settings().reuse_results:
+        fingerprint = file_fingerprint(session, input_file, stage)
+
+    _store_fingerprint(session, input_file.id, stage, fingerprint, status)
@@ -0,0 +1,393 @@
+import datetime
+import logging
+import os
+import psutil
+import socket
+import threading
+import time
+from collections.abc import Callable, Iterable
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from src.database import DB_ENGINE
+from src.database.input_file import InputFile
+from src.database.job import Job
+from src.database.processing_task import ProcessingTask
+from src.util.status import FileStatus
+from src.util.types import TaskStage, TaskState
+
+from .control import ProcessingCancelled
+
+logger = logging.getLogger(__name__)
+
+# a task that keeps taking the app down with it is marked failed instead of being retried forever
+MAX_TASK_ATTEMPTS = 3
+
+TASK_OWNER = f'{socket.gethostname()}:{os.getpid()}'
+
+# leases are renewed while the owner is alive, one that goes quiet this long belongs to a dead worker
+LEASE_TIMEOUT = datetime.timedelta(minutes=5)
+LEASE_HEARTBEAT_SECONDS = 60
+
+_heartbeat_thread: threading.Thread | None = None
+_heartbeat_lock = threading.Lock()
+
+
+def lease_expired(task: ProcessingTask, now: datetime.datetime | None = None) -> bool:
+    if task.state is not TaskState.LEASED or task.leased_at is None:
+        return False
+    return (now or datetime.datetime.now()) - task.leased_at > LEASE_TIMEOUT
+
+
+def held_by_other_worker(task: ProcessingTask) -> bool:
+    return task.state is TaskState.LEASED and task.lease_owner != TASK_OWNER and not lease_expired(task)
+
+
+def _get_task(session: Session, job_id: int, file_id: int, stage: TaskStage) -> ProcessingTask:
+    task = session.scalars(
+        select(ProcessingTask).where(ProcessingTask.input_file_id == file_id, ProcessingTask.stage == stage)
+    ).first()
+
+    if task is None:
+        task = ProcessingTask(job_id=job_id, input_file_id=file_id, stage=stage)
+        session.add(task)
+
+    return task
+
+
+def queue_tasks(job_id: int, stage: TaskStage, file_ids: Iterable[int]) -> None:
+    with Session(DB_ENGINE) as session:
+        for file_id in file_ids:
+            task = _get_task(session, job_id, file_id, stage)
+
+            # another worker sharing the job is on it right now
+            if held_by_other_worker(task):
+                logger.info(f'{stage.name} task for input file {file_id} is leased by {task.lease_owner}, leaving it')
+                continue
+
+            # a task that never finished keeps its count, so a file that takes the app down can not loop forever
+            if task.state in (TaskState.PENDING, TaskState.LEASED):
+                if task.attempts >= MAX_TASK_ATTEMPTS:
+                    logger.warning(
+                        f'{stage.name} task for input file {file_id} failed {task.attempts} times, marking it as failed'
+                    )
+                    task.state = TaskState.FAILED
+                    task.lease_owner = None
+                    continue
+            else:
+                task.attempts = 0
+
+            task.state = TaskState.PENDING
+            task.lease_owner = None
+            task.leased_at = None
+
+        session.commit()
+
+
+def reopen_task(session: Session, file_id: int, stage: TaskStage) -> None:
+    # a finished task whose result was thrown away is picked back up the next time the job runs
+    session.execute(
+        update(ProcessingTask)
+        .where(
+            ProcessingTask.input_file_id == file_id,
+            ProcessingTask.stage == stage,
+            ProcessingTask.state.in_((TaskState.DONE, TaskState.FAILED)),
+        )
+        .values(state=TaskState.CANCELLED)
+    )
+
+
+def lease_task(job_id: int, file_id: int, stage: TaskStage) -> None:
+    with Session(DB_ENGINE) as session:
+        task = _get_task(session, job_id, file_id, stage)
+        task.state = TaskState.LEASED
+        task.attempts += 1
+        task.lease_owner = TASK_OWNER
+        task.leased_at = datetime.datetime.now()
+        session.commit()
+
+
+def _set_task_state(file_id: int, stage: TaskStage, state: TaskState) -> None:
+    with Session(DB_ENGINE) as session:
+        task = session.scalars(
+            select(ProcessingTask).where(ProcessingTask.input_file_id == file_id, ProcessingTask.stage == stage)
+        ).first()
+        if task is None:
+            logger.warning(f'No {stage.name} task found for input file {file_id}')
+            return
+
+        task.state = state
+        # a released task remembers who had it, so that machine can offer to finish it
+        if state is not TaskState.PENDING:
+            task.lease_owner = None
+        session.commit()
+
+
+def finish_task(file_id: int, stage: TaskStage, status: FileStatus | None) -> None:
+    _set_task_state(file_id, stage, TaskState.FAILED if status is FileStatus.FAILED else TaskState.DONE)
+
+
+def cancel_task(file_id: int, stage: TaskStage) -> None:
+    _set_task_state(file_id, stage, TaskState.CANCELLED)
+
+
+def release_task(file_id: int, stage: TaskStage) -> None:
+    # hands the task back so another worker can claim it
+    _set_task_state(file_id, stage, TaskState.PENDING)
+
+
+def claim_task(job_id: int, stage: TaskStage) -> int | None:
+    # several workers (maybe on other hosts) share the DB, the guarded update makes sure only one of them wins a task
+    with Session(DB_ENGINE) as session:
+        while True:
+            now = datetime.datetime.now()
+            task = session.scalars(
+                select(ProcessingTask)
+                .where(
+                    ProcessingTask.job_id == job_id,
+                    ProcessingTask.stage == stage,
+                    (ProcessingTask.state == TaskState.PENDING)
+                    | ((ProcessingTask.state == TaskState.LEASED) & (ProcessingTask.leased_at < now - LEASE_TIMEOUT)),
+                )
+                .order_by(ProcessingTask.input_file_id)
+                .limit(1)
+            ).first()
+            if task is None:
+                return None
+
+            new_state = TaskState.LEASED
+            if task.state is TaskState.LEASED and task.attempts >= MAX_TASK_ATTEMPTS:
+                logger.warning(
+                    f'{stage.name} task for input file {task.input_file_id} failed {task.attempts} times, '
+                    f'marking it as failed'
+                )
+                new_state = TaskState.FAILED
+
+            result = session.execute(
+                update(ProcessingTask)
+                .where(
+                    ProcessingTask.id == task.id,
+                    ProcessingTask.state == task.state,
+                    ProcessingTask.lease_owner.is_not_distinct_from(task.lease_owner),
+                    ProcessingTask.leased_at.is_not_distinct_from(task.leased_at),
+                )
+                .values(
+                    state=new_state,
+                    attempts=ProcessingTask.attempts + 1,
+                    lease_owner=TASK_OWNER if new_state is TaskState.LEASED else None,
+                    leased_at=now,
+                )
+            )
+            session.commit()
+
+            if result.rowcount == 1 and new_state is TaskState.LEASED:
+                return task.input_file_id
+
+
+def renew_leases() -> None:
+    with Session(DB_ENGINE) as session:
+        session.execute(
+            update(ProcessingTask)
+            .where(ProcessingTask.state == TaskState.LEASED, ProcessingTask.lease_owner == TASK_OWNER)
+            .values(leased_at=datetime.datetime.now())
+        )
+        session.commit()
+
+
+def _run_lease_heartbeat() -> None:
+    while True:
+        time.sleep(LEASE_HEARTBEAT_SECONDS)
+        try:
+            renew_leases()
+        except Exception:
+            logger.exception('Failed to renew task leases')
+
+
+def start_lease_heartbeat() -> None:
+    # keeps our leases from expiring while long files are worked on
+    global _heartbeat_thread
+
+    with _heartbeat_lock:
+        if _heartbeat_thread is None:
+            _heartbeat_thread = threading.Thread(target=_run_lease_heartbeat, name='lease-heartbeat', daemon=True)
+            _heartbeat_thread.start()
+
+
+def cancel_tasks(job_id: int, stage: TaskStage | None = None) -> None:
+    # anything waiting or held by us is cancelled, it gets picked back up the next time the job runs
+    with Session(DB_ENGINE) as session:
+        query = select(ProcessingTask).where(
+            ProcessingTask.job_id == job_id,
+            (ProcessingTask.state == TaskState.PENDING)
+            | ((ProcessingTask.state == TaskState.LEASED) & (ProcessingTask.lease_owner == TASK_OWNER)),
+        )
+        if stage is not None:
+            query = query.where(ProcessingTask.stage == stage)
+
+        for task in session.scalars(query):
+            task.state = TaskState.CANCELLED
+            task.lease_owner = None
+
+        session.commit()
+
+
+def run_task(
+        job_id: int,
+        file_id: int,
+        stage: TaskStage,
+        function: Callable[[], FileStatus | None],
+) -> FileStatus | None:
+    lease_task(job_id, file_id, stage)
+
+    try:
+        status = function()
+    except ProcessingCancelled:
+        cancel_task(file_id, stage)
+        raise
+    except Exception:
+        finish_task(file_id, stage, FileStatus.FAILED)
+        raise
+
+    finish_task(file_id, stage, status)
+    return status
+
+
+def _owner_is_running(owner: str) -> bool:
+    pid = owner.rsplit(':', 1)[-1]
+    return pid.isdigit() and int(pid) != os.getpid() and psutil.pid_exists(int(pid))
+
+
+def release_stale_leases() -> int:
+    # leases held by an earlier run on this machine were cut short by a crash or the app closing
+    host = TASK_OWNER.split(':')[0]
+
+    released = 0
+    with Session(DB_ENGINE) as session:
+        stale_tasks = session.scalars(
+            select(ProcessingTask).where(
+                ProcessingTask.state == TaskState.LEASED,
+                ProcessingTask.lease_owner.startswith(f'{host}:'),
+                ProcessingTask.lease_owner != TASK_OWNER,
+            )
+        ).all()
+
+        for task in stale_tasks:
+            # other workers can share this machine, only their leases are still good
+            if _owner_is_running(task.lease_owner):
+                continue
+
+            if task.attempts >= MAX_TASK_ATTEMPTS:
+                logger.warning(
+                    f'{task.stage.name} task for input file {task.input_file_id} failed {task.attempts} times, '
+                    f'marking it as failed'
+                )
+                task.state = TaskState.FAILED
+                task.lease_owner = None
+            else:
+                # the owner is kept, it marks the task as work this machine did not get to finish
+                task.state = TaskState.PENDING
+                released += 1
+
+        session.commit()
+
+    if released:
+        logger.info(f'Released {released} interrupted tasks')
+    return released
+
+
+def _has_result(file: InputFile, stage: TaskStage) -> bool:
+    match stage:
+        case TaskStage.PRE_PROCESSING:
+            return file.pre_process_result is not None
+        case TaskStage.PROCESSING:
+            return file.fully_processed()
+        case _:
+            raise RuntimeError(f'Unknown task stage: {stage}')
+
+
+def get_unfinished_file_ids(job_id: int, stage: TaskStage) -> list[int]:
+    with Session(DB_ENGINE) as session:
+        job = session.get(Job, job_id)
+        tasks = {
+            task.input_file_id: task
+            for task in session.scalars(
+                select(ProcessingTask).where(ProcessingTask.job_id == job_id, ProcessingTask.stage == stage)
+            )
+        }
+
+        file_ids = []
+        for file in job.input_files:
+            if file.container_file:
+                continue
+
+            # only aligned files can be processed
+            if stage is TaskStage.PROCESSING and (
+                    file.pre_process_result is None or not file.pre_process_result.successful_alignment
+            ):
+                continue
+
+            # files from before tasks were tracked fall back to checking for a result
+            # files another worker is on right now are left to it
+            task = tasks.get(file.id)
+            if task is None:
+                finished = _has_result(file, stage)
+            else:
+                finished = task.state in (TaskState.DONE, TaskState.FAILED) or held_by_other_worker(task)
+
+            if not finished:
+                file_ids.append(file.id)
+
+        return file_ids
+
+
+def get_pending_file_ids(job_id: int, stage: TaskStage, limit: int) -> list[int]:
+    # the files workers will claim next, in the order claim_task hands them out
+    with Session(DB_ENGINE) as session:
+        return list(
+            session.scalars(
+                select(ProcessingTask.input_file_id)
+                .where(
+                    ProcessingTask.job_id == job_id,
+                    ProcessingTask.stage == stage,
+                    ProcessingTask.state == TaskState.PENDING,
+                )
+                .order_by(ProcessingTask.input_file_id)
+                .limit(limit)
+            )
+        )
+
+
+def count_open_tasks(job_id: int) -> int:
+    # tasks that are waiting or being worked on by any worker, including ones that may still expire
+    with Session(DB_ENGINE) as session:
+        return session.scalar(
+            select(func.count(ProcessingTask.id)).where(
+                ProcessingTask.job_id == job_id,
+                ProcessingTask.state.in_((TaskState.PENDING, TaskState.LEASED)),
+            )
+        )
+
+
+def get_interrupted_job_ids() -> list[int]:
+    # only work this machine started and did not finish, jobs queued for workers and never started are left alone
+    host = TASK_OWNER.split(':')[0]
+    now = datetime.datetime.now()
+
+    with Session(DB_ENGINE) as session:
+        tasks = session.scalars(
+            select(ProcessingTask)
+            .where(
+                ProcessingTask.state.in_((TaskState.PENDING, TaskState.LEASED)),
+                ProcessingTask.attempts > 0,
+                ProcessingTask.lease_owner.startswith(f'{host}:'),
+            )
+            .order_by(ProcessingTask.job_id.desc())
+        )
+
+        job_ids = []
+        for task in tasks:
+            if task.state is TaskState.LEASED and not lease_expired(task, now):
+                continue
+            if task.job_id not in job_ids:
+                job_ids.append(task.job_id)
+        return job_ids
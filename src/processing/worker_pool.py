@@ -0,0 +1,130 @@
+import logging
+from collections import deque
+from collections.abc import Callable
+from itertools import islice
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal, pyqtSlot
+
+logger = logging.getLogger(__name__)
+
+# extra threads kept free so a file someone is waiting on can start right away
+PRIORITY_SLOTS = 1
+
+
+class WorkerRunnable(QRunnable):
+    def __init__(self, pool: 'WorkerPool', task_id: int, worker: QObject):
+        super().__init__()
+        self._pool = pool
+        self._task_id = task_id
+        self._worker = worker
+
+    def run(self) -> None:
+        try:
+            self._worker.start()
+        finally:
+            # always free the slot, even if the worker did not signal completion
+            self._pool.taskFinished.emit(self._task_id)
+
+
+class WorkerPool(QObject):
+    taskFinished = pyqtSignal(int)
+    allTasksComplete = pyqtSignal()
+
+    def __init__(self, max_workers: int, parent: QObject | None = None):
+        super().__init__(parent)
+        self._max_workers = max(1, max_workers)
+
+        self._thread_pool = QThreadPool(self)
+        self._thread_pool.setMaxThreadCount(self._max_workers + PRIORITY_SLOTS)
+
+        self._pending: deque[tuple[int, QObject]] = deque()
+        self._active: dict[int, QObject] = {}
+        self._priority_ids: set[int] = set()
+
+        # told which tasks are next in line whenever one starts, so their inputs can be read ahead
+        self._prefetch: Callable[[list[int]], None] | None = None
+        self._prefetch_count = 0
+
+        self.taskFinished.connect(self._handle_task_finished)
+
+    def max_workers(self) -> int:
+        return self._max_workers
+
+    def set_max_workers(self, max_workers: int) -> None:
+        self._max_workers = max(1, max_workers)
+        self._thread_pool.setMaxThreadCount(self._max_workers + PRIORITY_SLOTS)
+        self._dispatch()
+
+    def set_prefetch(self, callback: Callable[[list[int]], None] | None, count: int) -> None:
+        self._prefetch = callback
+        self._prefetch_count = count
+
+    def is_busy(self) -> bool:
+        return bool(self._pending or self._active)
+
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def active_count(self) -> int:
+        return len(self._active)
+
+    def submit(self, task_id: int, worker: QObject, priority: bool = False) -> None:
+        if priority:
+            self._priority_ids.add(task_id)
+            self._pending.appendleft((task_id, worker))
+        else:
+            self._pending.append((task_id, worker))
+        self._dispatch()
+
+    def prioritize(self, task_id: int) -> bool:
+        # move a waiting task to the front, returns False if it is not waiting
+        for index, (pending_id, worker) in enumerate(self._pending):
+            if pending_id == task_id:
+                del self._pending[index]
+                self._priority_ids.add(task_id)
+                self._pending.appendleft((task_id, worker))
+                self._dispatch()
+                return True
+
+        return False
+
+    def cancel_pending(self) -> list[int]:
+        # drop anything that has not started, the running workers stop on their own
+        task_ids = [task_id for task_id, _ in self._pending]
+        self._pending.clear()
+        return task_ids
+
+    def clear(self) -> None:
+        # drop anything that has not started and wait for the running workers
+        self._pending.clear()
+        self._thread_pool.waitForDone()
+        self._active.clear()
+        self._priority_ids.clear()
+
+    def _dispatch(self) -> None:
+        started = False
+        while self._pending:
+            # priority tasks can use the reserved slots, everything else waits for a regular one
+            task_id, worker = self._pending[0]
+            limit = self._max_workers + (PRIORITY_SLOTS if task_id in self._priority_ids else 0)
+            if len(self._active) >= limit:
+                break
+
+            self._pending.popleft()
+            self._active[task_id] = worker
+
+            logger.debug(f'Starting task {task_id} ({len(self._active)}/{self._max_workers} workers busy)')
+            self._thread_pool.start(WorkerRunnable(self, task_id, worker))
+            started = True
+
+        if started and self._prefetch is not None and self._prefetch_count:
+            self._prefetch([task_id for task_id, _ in islice(self._pending, self._prefetch_count)])
+
+    @pyqtSlot(int)
+    def _handle_task_finished(self, task_id: int) -> None:
+        self._active.pop(task_id, None)
+        self._priority_ids.discard(task_id)
+        self._dispatch()
+
+        if not self.is_busy():
+            self.allTasksComplete.emit()
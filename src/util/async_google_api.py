@@ -0,0 +1,251 @@
+import asyncio
+import httpx
+import logging
+import numpy as np
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Any, TypeVar
+
+from .google_api import (
+    API_TIMEOUT_SECONDS, MAX_API_ATTEMPTS, MAX_BATCH_BYTES, TEXT_DETECTION, annotate_request_size, annotate_url,
+    api_headers, build_annotate_request, parse_annotate_response, retry_delay, save_api_settings,
+)
+from .ocr_cache import get_ocr_cache, request_key
+from .settings import current_settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# how long an image waits for others to share its call, crops of a region are all queued within a few ms
+BATCH_WAIT_SECONDS = 0.02
+
+
+@dataclass
+class PendingImage:
+    request: dict
+    size: int
+    future: asyncio.Future
+    parse: Callable[[dict], Any]
+    cache_key: str | None = None
+    attempts: int = 0
+
+
+class AsyncVisionClient:
+    def __init__(
+            self,
+            max_in_flight: int | None = None,
+            timeout: float = API_TIMEOUT_SECONDS,
+            batch_size: int | None = None,
+    ):
+        # the client lives as long as the app, so anything not given here is read from the settings as it is used
+        self._max_in_flight_override = max_in_flight
+        self._batch_size_override = batch_size
+        self._max_in_flight = self._current_max_in_flight()
+        self._timeout = timeout
+
+        # images from every file share calls, a call goes out once it is full or its images waited long enough
+        self._pending: list[PendingImage] = []
+        self._pending_bytes = 0
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self._batch_tasks: set[asyncio.Task] = set()
+
+        # created on the event loop that uses them
+        self._client: httpx.AsyncClient | None = None
+        self._semaphore: asyncio.Semaphore | None = None
+        self._token_lock: asyncio.Lock | None = None
+
+        # pools replaced after a settings change, calls that were already using them still finish on them
+        self._retired_clients: list[httpx.AsyncClient] = []
+
+    async def __aenter__(self) -> 'AsyncVisionClient':
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb) -> None:
+        await self.close()
+
+    def max_in_flight(self) -> int:
+        return self._max_in_flight
+
+    def _current_max_in_flight(self) -> int:
+        return self._max_in_flight_override or current_settings().ocr_max_in_flight_count()
+
+    def _current_batch_size(self) -> int:
+        return self._batch_size_override or current_settings().ocr_batch_size_count()
+
+    def _open_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(self._timeout),
+            limits=httpx.Limits(max_connections=self._max_in_flight, max_keepalive_connections=self._max_in_flight),
+        )
+
+    def _apply_max_in_flight(self) -> None:
+        max_in_flight = self._current_max_in_flight()
+        if max_in_flight == self._max_in_flight:
+            return
+
+        logger.info(f'OCR requests in flight changed from {self._max_in_flight} to {max_in_flight}')
+        self._max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._retired_clients.append(self._client)
+        self._client = self._open_client()
+
+    async def open(self) -> None:
+        self._semaphore = asyncio.Semaphore(self._max_in_flight)
+        self._token_lock = asyncio.Lock()
+        self._client = self._open_client()
+
+    async def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for image in self._pending:
+            image.future.cancel()
+        self._pending.clear()
+        for task in list(self._batch_tasks):
+            task.cancel()
+
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        for client in self._retired_clients:
+            await client.aclose()
+        self._retired_clients.clear()
+
+    async def _refresh_access_token(self, stale_authorization: str | None) -> None:
+        async with self._token_lock:
+            # another request may have refreshed the token while we waited, the next call reads the new one
+            if api_headers()['Authorization'] == stale_authorization:
+                await asyncio.to_thread(save_api_settings)
+
+    async def ocr_text_region(
+            self,
+            roi_image: np.ndarray,
+            add_border: bool = False,
+            parse: Callable[[dict], T | None] = parse_annotate_response,
+            feature: str = TEXT_DETECTION,
+    ) -> T | None:
+        assert self._client is not None, 'The client must be opened before use'
+        request = await asyncio.to_thread(build_annotate_request, roi_image, add_border, feature)
+
+        # images sent before, by any job, are answered from the cache
+        cache_key = None
+        cache = get_ocr_cache()
+        if cache is not None:
+            cache_key = request_key(request, annotate_url())
+            cached = await asyncio.to_thread(cache.get_many, [cache_key])
+            if cache_key in cached:
+                return parse(cached[cache_key])
+
+        future = asyncio.get_running_loop().create_future()
+        image = PendingImage(request, annotate_request_size(request), future, parse, cache_key)
+        self._queue_image(image)
+        return await image.future
+
+    def _queue_image(self, image: PendingImage) -> None:
+        if self._pending and self._pending_bytes + image.size > MAX_BATCH_BYTES:
+            self._flush()
+
+        self._pending.append(image)
+        self._pending_bytes += image.size
+
+        if len(self._pending) >= self._current_batch_size():
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = asyncio.get_running_loop().call_later(BATCH_WAIT_SECONDS, self._flush)
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        # images whose file was cancelled while they waited are not sent
+        images = [image for image in self._pending if not image.future.done()]
+        self._pending = []
+        self._pending_bytes = 0
+        if not images:
+            return
+
+        task = asyncio.ensure_future(self._send_batch(images))
+        self._batch_tasks.add(task)
+        task.add_done_callback(self._batch_tasks.discard)
+
+    async def _post(self, data_payload: dict) -> dict | None:
+        # only the network call holds a slot, waiting on a retry does not
+        attempts = 0
+        while attempts < MAX_API_ATTEMPTS:
+            logger.debug(f'API OCR attempt: {attempts}')
+
+            self._apply_max_in_flight()
+            headers = api_headers()
+            try:
+                async with self._semaphore:
+                    result = await self._client.post(annotate_url(), json=data_payload, headers=headers)
+                result.raise_for_status()
+                return result.json()
+            except httpx.HTTPStatusError as e:
+                attempts += 1
+
+                # If we got unauthorized, try updating the access token
+                if e.response.status_code == 401:
+                    logger.info('API Authentication failed, updating access token and retrying')
+                    await self._refresh_access_token(headers['Authorization'])
+                    continue
+                elif attempts < MAX_API_ATTEMPTS:
+                    logger.exception('API call failed, retrying')
+            except httpx.TransportError:
+                # covers timeouts as well as dropped connections
+                attempts += 1
+                if attempts < MAX_API_ATTEMPTS:
+                    logger.exception('API call did not complete, retrying')
+            except ValueError:
+                # a response that was cut off or is not JSON, i.e. an error page from a proxy
+                attempts += 1
+                if attempts < MAX_API_ATTEMPTS:
+                    logger.exception('API response was not valid JSON, retrying')
+
+            if attempts < MAX_API_ATTEMPTS:
+                await asyncio.sleep(retry_delay(attempts))
+
+        return None
+
+    async def _send_batch(self, images: list[PendingImage]) -> None:
+        logger.debug(f'Sending {len(images)} images in one OCR call')
+        try:
+            response_json = await self._post({'requests': [image.request for image in images]})
+        except asyncio.CancelledError:
+            for image in images:
+                image.future.cancel()
+            raise
+        except Exception as e:
+            for image in images:
+                if not image.future.done():
+                    image.future.set_exception(e)
+            return
+
+        # responses come back in the order the images were sent
+        responses = response_json.get('responses', []) if response_json is not None else []
+        for idx, image in enumerate(images):
+            if image.future.done():
+                continue
+
+            response = responses[idx] if idx < len(responses) else None
+            if response is not None and 'error' in response and image.attempts + 1 < MAX_API_ATTEMPTS:
+                # an image the API choked on is tried again in a later call without holding up the others
+                image.attempts += 1
+                logger.warning(f'API could not OCR an image, retrying: {response["error"].get("message")}')
+                self._queue_image(image)
+                continue
+
+            image.future.set_result(image.parse(response) if response is not None else None)
+
+        # saved after the images are answered so the files waiting on them are not held up
+        cache = get_ocr_cache()
+        if cache is not None:
+            fresh = {
+                image.cache_key: response
+                for image, response in zip(images, responses)
+                if image.cache_key is not None and 'error' not in response
+            }
+            await asyncio.to_thread(cache.put_many, fresh)
@@ -0,0 +1,83 @@
+import argparse
+import logging
+import os
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# thread pools of the native libraries numpy and OpenCV can load, read once when they are first imported
+NATIVE_THREAD_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+# the option each command sizes its CPU bound workers with
+WORKER_COUNT_OPTIONS = {'batch': '--workers', 'worker': '--threads', 'service': '--threads'}
+
+_CPU_PLAN: 'CpuPlan | None' = None
+
+
+class CpuPlan(NamedTuple):
+    cores: int
+    cpu_workers: int
+    threads_per_worker: int
+
+    def describe(self) -> str:
+        return (
+            f'{self.cores} cores available, {self.cpu_workers} CPU bound workers '
+            f'with {self.threads_per_worker} OpenCV/BLAS threads each'
+        )
+
+
+def available_cores() -> int:
+    # honour affinity masks and container limits where the platform exposes them
+    if hasattr(os, 'sched_getaffinity'):
+        return max(1, len(os.sched_getaffinity(0)))
+    if hasattr(os, 'process_cpu_count'):
+        return max(1, os.process_cpu_count() or 1)
+    return max(1, os.cpu_count() or 1)
+
+
+def plan_cpu(cpu_workers: int | None = None) -> CpuPlan:
+    # split the cores between the workers so each one's native thread pool only uses its share
+    cores = available_cores()
+    cpu_workers = max(1, cpu_workers or cores)
+    return CpuPlan(cores=cores, cpu_workers=cpu_workers, threads_per_worker=max(1, cores // cpu_workers))
+
+
+def worker_count_option(argv: list[str]) -> int | None:
+    # the limits are set before the command parses its arguments, so its worker count is picked out here.
+    # anything wrong with the arguments is left for the command's own parser to report
+    if not argv or argv[0] not in WORKER_COUNT_OPTIONS:
+        return None
+
+    parser = argparse.ArgumentParser(add_help=False, exit_on_error=False)
+    parser.add_argument(WORKER_COUNT_OPTIONS[argv[0]], dest='count')
+    try:
+        args, _ = parser.parse_known_args(argv[1:])
+    except argparse.ArgumentError:
+        return None
+    return int(args.count) if args.count is not None and args.count.isdigit() else None
+
+
+def limit_native_threads(cpu_workers: int | None = None) -> CpuPlan:
+    # has to run before numpy or cv2 are first imported, child processes inherit the environment
+    global _CPU_PLAN
+    _CPU_PLAN = plan_cpu(cpu_workers)
+
+    # anything set by hand wins
+    for env_var in NATIVE_THREAD_ENV_VARS:
+        os.environ.setdefault(env_var, str(_CPU_PLAN.threads_per_worker))
+
+    return _CPU_PLAN
+
+
+def apply_cpu_plan(cpu_workers: int | None = None) -> CpuPlan:
+    global _CPU_PLAN
+    if cpu_workers is not None or _CPU_PLAN is None:
+        _CPU_PLAN = plan_cpu(cpu_workers)
+
+    # imported here so limit_native_threads() can run before numpy is loaded
+    import cv2
+
+    # the pool is process wide, sizing it to one worker's share keeps all the workers together within the cores
+    cv2.setNumThreads(_CPU_PLAN.threads_per_worker)
+    logger.info(f'CPU plan: {_CPU_PLAN.describe()}')
+    return _CPU_PLAN
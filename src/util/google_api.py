@@ -3,19 +3,50 @@ import cv2
 import datetime
 import logging
 import numpy as np
+import random
 import requests
 import subprocess
+import threading
+import time
+from collections.abc import Callable
+from typing import TypeVar
+from requests.adapters import HTTPAdapter
 
-from .settings import SettingsManager
-from .types import BoxBounds
+from .ocr_cache import get_ocr_cache, request_key
+from .settings import SettingsManager, current_settings
+from .types import BoxBounds, OcrWord
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+ANNOTATE_URL = 'https://vision.googleapis.com/v1/images:annotate'
 MAX_API_ATTEMPTS = 3
+
+# a single images:annotate call can be up to 10MB of JSON, leave some room
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+
+# a request that hangs should be retried instead of holding its worker forever
+API_TIMEOUT_SECONDS = 30
+
+# the wait before a retry doubles with every failed attempt, up to the max
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 30.0
+
 OCR_FIXES = {
     '×': 'x',
 }
 
+# TEXT_DETECTION suits short field images, DOCUMENT_TEXT_DETECTION is tuned for whole pages of dense text
+TEXT_DETECTION = 'TEXT_DETECTION'
+DOCUMENT_TEXT_DETECTION = 'DOCUMENT_TEXT_DETECTION'
+
+# breaks the API puts after a word that mean a space follows it
+SPACE_BREAKS = ('SPACE', 'SURE_SPACE', 'EOL_SURE_SPACE', 'LINE_BREAK')
+
+# concurrent requests can all see the token expire at once, only one of them should refresh it
+_token_refresh_lock = threading.Lock()
+
 
 def save_api_settings() -> None:
     # TODO: This assumes that Google Cloud CLI has been set up
@@ -40,42 +71,52 @@ def save_api_settings() -> None:
         settings.google_access_token = access_token
 
 
+def annotate_url() -> str:
+    # a stand-in server can take the place of the API, i.e. scripts/ocr_stand_in.py
+    return current_settings().ocr_api_url or ANNOTATE_URL
+
+
+def api_headers() -> dict[str, str]:
+    settings = current_settings()
+    return {
+        'Authorization': f'Bearer {settings.google_access_token}',
+        'x-goog-user-project': settings.google_project_id,
+    }
+
+
+def retry_delay(attempts: int) -> float:
+    # half of the wait is random so workers that failed together do not all retry together
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
 def open_api_session() -> requests.Session:
-    settings = SettingsManager()
+    settings = current_settings()
 
     session = requests.Session()
-    session.headers.update(
-        {
-            'Authorization': f'Bearer {settings.google_access_token}',
-            'x-goog-user-project': settings.google_project_id,
-        }
-    )
+
+    # keep a connection open for every OCR request a file can have in flight
+    pool_size = settings.ocr_concurrency_count()
+    session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+    session.headers.update(api_headers())
     return session
 
 
 def update_session_config(session: requests.Session) -> requests.Session:
-    settings = SettingsManager()
-    session.headers.update(
-        {
-            'Authorization': f'Bearer {settings.google_access_token}',
-            'x-goog-user-project': settings.google_project_id,
-        }
-    )
+    session.headers.update(api_headers())
     return session
 
 
-def ocr_text_region(
-        session: requests.Session,
-        image: np.ndarray | None = None,
-        region: BoxBounds | None = None,
-        roi_image: np.ndarray | None = None,
-        add_border: bool = False,
-) -> str | None:
-    if roi_image is None:
-        assert image is not None
-        assert region is not None
-        roi_image = image[region.y:region.y + region.height, region.x:region.x + region.width]
+def refresh_access_token(session: requests.Session, stale_authorization: str | None) -> None:
+    with _token_refresh_lock:
+        # another request may have refreshed the token while we waited
+        if f'Bearer {SettingsManager().google_access_token}' == stale_authorization:
+            save_api_settings()
+        update_session_config(session)
 
+
+def build_annotate_request(roi_image: np.ndarray, add_border: bool = False, feature: str = TEXT_DETECTION) -> dict:
     if add_border:
         roi_image = cv2.copyMakeBorder(roi_image, 10, 10, 10, 10, cv2.BORDER_CONSTANT, None, (255, 255, 255))
 
@@ -83,64 +124,181 @@ def ocr_text_region(
     encoded_bytes = base64.b64encode(buffer.tobytes()).decode('ascii')
 
     # https://cloud.google.com/vision/docs/ocr
-    data_payload = {
-        'requests': [
+    return {
+        'image': {
+            'content': encoded_bytes,
+        },
+        'features': [
             {
-                'image': {
-                    'content': encoded_bytes,
-                },
-                'features': [
-                    {
-                        'type': 'TEXT_DETECTION',
-                    }
-                ],
-                'imageContext': {
-                    'languageHints': [
-                        'en-t-i0-handwrit',
-                    ],
-                },
-            },
+                'type': feature,
+            }
         ],
+        'imageContext': {
+            'languageHints': [
+                'en-t-i0-handwrit',
+            ],
+        },
     }
 
+
+def annotate_request_size(request: dict) -> int:
+    # the image content is nearly all of a request, the rest is a few hundred bytes
+    return len(request['image']['content']) + 256
+
+
+def clean_ocr_text(ocr_string: str) -> str:
+    ocr_string = ocr_string.strip().replace('\n', ' ')
+
+    # Correct common errors
+    for key, value in OCR_FIXES.items():
+        ocr_string = ocr_string.replace(key, value)
+
+    return ocr_string
+
+
+def parse_annotate_response(response: dict) -> str | None:
+    # each image of a request succeeds or fails on its own
+    if 'error' in response:
+        logger.warning(f'API could not OCR an image: {response["error"].get("message")}')
+        return None
+
+    ocr_string: str | None = None
+    if 'fullTextAnnotation' in response:
+        ocr_string = response['fullTextAnnotation']['text']
+
+    # logger.info(f'Detected: "{ocr_string}"')
+    return clean_ocr_text(ocr_string) if ocr_string is not None else ''
+
+
+def _vertices_bounds(bounding_poly: dict) -> BoxBounds:
+    # the API leaves out coordinates that are 0
+    xs = [vertex.get('x', 0) for vertex in bounding_poly.get('vertices', [])] or [0]
+    ys = [vertex.get('y', 0) for vertex in bounding_poly.get('vertices', [])] or [0]
+    return BoxBounds(min(xs), min(ys), max(xs) - min(xs), max(ys) - min(ys))
+
+
+def parse_annotate_words(response: dict) -> list[OcrWord] | None:
+    if 'error' in response:
+        logger.warning(f'API could not OCR an image: {response["error"].get("message")}')
+        return None
+
+    words = []
+    for page in response.get('fullTextAnnotation', {}).get('pages', []):
+        for block in page.get('blocks', []):
+            for paragraph in block.get('paragraphs', []):
+                for word in paragraph.get('words', []):
+                    symbols = word.get('symbols', [])
+                    text = ''.join(symbol.get('text', '') for symbol in symbols)
+                    if not text:
+                        continue
+
+                    detected_break = symbols[-1].get('property', {}).get('detectedBreak', {}).get('type')
+                    words.append(OcrWord(text, _vertices_bounds(word['boundingBox']), detected_break in SPACE_BREAKS))
+
+    return words
+
+
+def post_annotate(session: requests.Session, data_payload: dict) -> dict | None:
     attempts = 0
     while attempts < MAX_API_ATTEMPTS:
         logger.debug(f'API OCR attempt: {attempts}')
 
-        result = session.post(
-            'https://vision.googleapis.com/v1/images:annotate',
-            json=data_payload,
-        )
+        authorization = session.headers.get('Authorization')
         try:
+            result = session.post(annotate_url(), json=data_payload, timeout=API_TIMEOUT_SECONDS)
             result.raise_for_status()
-            break
+            return result.json()
         except requests.exceptions.HTTPError as e:
             attempts += 1
 
             # If we got unauthorized, try updating the access token
             if e.response.status_code == 401:
                 logger.info('API Authentication failed, updating acces token and retrying')
-                save_api_settings()
-                update_session_config(session)
-            else:
-                if attempts < MAX_API_ATTEMPTS:
-                    logger.exception('API call failed, retrying')
-                else:
-                    # TODO: Handle a None return at the call sites
-                    return None
+                refresh_access_token(session, authorization)
+                continue
+            elif attempts < MAX_API_ATTEMPTS:
+                logger.exception('API call failed, retrying')
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            attempts += 1
+            if attempts < MAX_API_ATTEMPTS:
+                logger.exception('API call did not complete, retrying')
+        except ValueError:
+            # a response that was cut off or is not JSON, i.e. an error page from a proxy
+            attempts += 1
+            if attempts < MAX_API_ATTEMPTS:
+                logger.exception('API response was not valid JSON, retrying')
 
-    ocr_string: str | None = None
-    for response in result.json()['responses']:
-        if 'fullTextAnnotation' in response:
-            ocr_string = response['fullTextAnnotation']['text']
+        if attempts < MAX_API_ATTEMPTS:
+            time.sleep(retry_delay(attempts))
 
-    # Clean up the string
-    if ocr_string is not None:
-        ocr_string = ocr_string.strip().replace('\n', ' ')
+    # TODO: Handle a None return at the call sites
+    return None
 
-        # Correct common errors
-        for key, value in OCR_FIXES.items():
-            ocr_string = ocr_string.replace(key, value)
 
-    # logger.info(f'Detected: "{ocr_string}"')
-    return ocr_string if ocr_string is not None else ''
+def batch_annotate_requests(requests_list: list[dict], batch_size: int) -> list[list[dict]]:
+    # split into calls that stay inside the API's limits on images and bytes per request
+    batches: list[list[dict]] = []
+    batch_bytes = 0
+    for request in requests_list:
+        size = annotate_request_size(request)
+        if not batches or len(batches[-1]) >= batch_size or batch_bytes + size > MAX_BATCH_BYTES:
+            batches.append([])
+            batch_bytes = 0
+
+        batches[-1].append(request)
+        batch_bytes += size
+
+    return batches
+
+
+def ocr_text_regions(
+        session: requests.Session,
+        roi_images: list[np.ndarray],
+        add_border: bool = False,
+        batch_size: int | None = None,
+        parse: Callable[[dict], T | None] = parse_annotate_response,
+        feature: str = TEXT_DETECTION,
+) -> list[T | None]:
+    requests_list = [build_annotate_request(roi_image, add_border, feature) for roi_image in roi_images]
+
+    # images sent before, by any job, are answered from the cache
+    cache = get_ocr_cache()
+    keys = [request_key(request, annotate_url()) for request in requests_list] if cache is not None else []
+    cached = cache.get_many(keys) if cache is not None else {}
+    responses: list[dict | None] = [cached.get(key) for key in keys] if cache is not None else [None] * len(roi_images)
+
+    missing = [idx for idx, response in enumerate(responses) if response is None]
+    pending = iter(missing)
+    batch_size = batch_size or current_settings().ocr_batch_size_count()
+    for batch in batch_annotate_requests([requests_list[idx] for idx in missing], batch_size):
+        batch_indexes = [next(pending) for _ in batch]
+        response_json = post_annotate(session, {'requests': batch})
+        if response_json is None:
+            continue
+
+        # responses come back in the order the images were sent
+        batch_responses = response_json.get('responses', [])
+        for idx, response in zip(batch_indexes, batch_responses):
+            responses[idx] = response
+
+        if cache is not None:
+            cache.put_many({
+                keys[idx]: response for idx, response in zip(batch_indexes, batch_responses) if 'error' not in response
+            })
+
+    return [parse(response) if response is not None else None for response in responses]
+
+
+def ocr_text_region(
+        session: requests.Session,
+        image: np.ndarray | None = None,
+        region: BoxBounds | None = None,
+        roi_image: np.ndarray | None = None,
+        add_border: bool = False,
+) -> str | None:
+    if roi_image is None:
+        assert image is not None
+        assert region is not None
+        roi_image = image[region.y:region.y + region.height, region.x:region.x + region.width]
+
+    return ocr_text_regions(session, [roi_image], add_border)[0]
@@ -35,20 +35,41 @@ def log_block(log_func: Callable, block_name: str) -> None:
         log_func('')
 
 
-def configure_root_logger(min_level: int) -> None:
+def configure_root_logger(min_level: int, console_level: int | None = None) -> None:
     global CURRENT_LOG_FILE
     CURRENT_LOG_FILE = LocalPaths.logs_directory() / f'eagle_eye_{datetime.now():%Y%m%d_%H%M%S}.log'
 
+    # the console can be quieter than the log file (i.e. for command line progress output)
+    console_handler = logging.StreamHandler()
+    if console_level is not None:
+        console_handler.setLevel(console_level)
+
     logging.basicConfig(
         format='%(asctime)s | %(levelname)s | %(name)s | %(message)s',
         level=min_level,
         handlers=[
-            logging.StreamHandler(),
+            console_handler,
             logging.FileHandler(CURRENT_LOG_FILE),
         ],
     )
 
 
+def configure_child_logger(log_file: Path | None, min_level: int) -> None:
+    # child processes append to the log file of the process that started them
+    global CURRENT_LOG_FILE
+    CURRENT_LOG_FILE = log_file
+
+    handlers: list[logging.Handler] = [logging.StreamHandler()]
+    if log_file is not None:
+        handlers.append(logging.FileHandler(log_file))
+
+    logging.basicConfig(
+        format='%(asctime)s | %(levelname)s | %(processName)s | %(name)s | %(message)s',
+        level=min_level,
+        handlers=handlers,
+    )
+
+
 def get_current_logfile() -> Path:
     return CURRENT_LOG_FILE
 
@@ -0,0 +1,166 @@
+import hashlib
+import json
+import logging
+import sqlalchemy
+import threading
+import time
+from pathlib import Path
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table, Text, delete, func, insert, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from .paths import LocalPaths
+from .settings import current_settings
+
+logger = logging.getLogger(__name__)
+
+# worker processes share the cache file, so wait on a lock like the primary DB does
+CACHE_LOCK_TIMEOUT = 30
+
+# the size is only summed every so many writes, eviction then trims to below the limit so it does not run every time
+SIZE_CHECK_INTERVAL = 64
+TRIM_FRACTION = 0.9
+
+# keeps each IN clause well under SQLite's variable limit
+DELETE_CHUNK_SIZE = 500
+
+_OCR_CACHE: 'OcrCache | None' = None
+_OCR_CACHE_LOCK = threading.Lock()
+
+# kept apart from the ORM tables, the cache is shared by every job and never part of a shard
+_metadata = MetaData()
+_cache_table = Table(
+    'ocr_response',
+    _metadata,
+    Column('key', String, primary_key=True),
+    Column('response', Text, nullable=False),
+    Column('size', Integer, nullable=False),
+    Column('last_used', Float, nullable=False, index=True),
+)
+
+
+def request_key(request: dict, url: str) -> str:
+    # the encoded image, the features and the language hints are all in the request
+    content = json.dumps({'url': url, 'request': request}, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+class OcrCache:
+    def __init__(self, path: Path, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._engine = sqlalchemy.create_engine(
+            f'sqlite+pysqlite:///{path}',
+            echo=False,
+            connect_args={'timeout': CACHE_LOCK_TIMEOUT},
+        )
+        _metadata.create_all(self._engine)
+
+        self._lock = threading.Lock()
+        self._unchecked_writes = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, keys: list[str]) -> dict[str, dict]:
+        if not keys:
+            return {}
+
+        found: dict[str, dict] = {}
+        try:
+            with self._engine.begin() as connection:
+                rows = connection.execute(
+                    select(_cache_table.c.key, _cache_table.c.response).where(_cache_table.c.key.in_(keys))
+                )
+                found = {key: json.loads(response) for key, response in rows}
+
+                if found:
+                    connection.execute(
+                        update(_cache_table).where(_cache_table.c.key.in_(list(found))).values(last_used=time.time())
+                    )
+        except SQLAlchemyError:
+            # the cache only saves calls, a broken or locked cache file just means calling the API
+            logger.exception('Could not read from the OCR cache')
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(set(keys)) - len(found)
+
+        return found
+
+    def put_many(self, responses: dict[str, dict]) -> None:
+        if not responses:
+            return
+
+        now = time.time()
+        try:
+            with self._engine.begin() as connection:
+                for key, response in responses.items():
+                    content = json.dumps(response, separators=(',', ':'))
+                    connection.execute(
+                        insert(_cache_table).prefix_with('OR REPLACE'),
+                        {'key': key, 'response': content, 'size': len(content), 'last_used': now},
+                    )
+        except SQLAlchemyError:
+            logger.exception('Could not save responses to the OCR cache')
+            return
+
+        with self._lock:
+            self._unchecked_writes += len(responses)
+            check_size = self._unchecked_writes >= SIZE_CHECK_INTERVAL
+            if check_size:
+                self._unchecked_writes = 0
+
+        if check_size:
+            try:
+                self.evict()
+            except SQLAlchemyError:
+                logger.exception('Could not evict responses from the OCR cache')
+
+    def evict(self) -> None:
+        with self._engine.begin() as connection:
+            total = connection.scalar(select(func.coalesce(func.sum(_cache_table.c.size), 0)))
+            if total <= self.max_bytes:
+                return
+
+            # least recently used first, down to a bit under the limit
+            target = int(self.max_bytes * TRIM_FRACTION)
+            evicted: list[str] = []
+            for key, size in connection.execute(
+                    select(_cache_table.c.key, _cache_table.c.size).order_by(_cache_table.c.last_used)
+            ):
+                if total <= target:
+                    break
+                evicted.append(key)
+                total -= size
+
+            for start in range(0, len(evicted), DELETE_CHUNK_SIZE):
+                chunk = evicted[start:start + DELETE_CHUNK_SIZE]
+                connection.execute(delete(_cache_table).where(_cache_table.c.key.in_(chunk)))
+
+        logger.info(f'Evicted {len(evicted)} responses from the OCR cache')
+
+    def close(self) -> None:
+        if self.hits or self.misses:
+            logger.info(f'OCR cache: {self.hits} hits, {self.misses} misses')
+        self._engine.dispose()
+
+
+def get_ocr_cache() -> OcrCache | None:
+    global _OCR_CACHE
+
+    max_mb = current_settings().ocr_cache_mb
+    if not max_mb:
+        return None
+
+    with _OCR_CACHE_LOCK:
+        if _OCR_CACHE is None:
+            _OCR_CACHE = OcrCache(LocalPaths.ocr_cache_file(), max_mb * 1024 * 1024)
+        return _OCR_CACHE
+
+
+def shutdown_ocr_cache() -> None:
+    global _OCR_CACHE
+
+    with _OCR_CACHE_LOCK:
+        if _OCR_CACHE is not None:
+            _OCR_CACHE.close()
+            _OCR_CACHE = None
@@ -7,6 +7,11 @@ from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# points every worker sharing a job at the same DB and job files, i.e. a mounted network share
+WORKING_DIR_ENV_VAR = 'EAGLE_EYE_WORKING_DIR'
+
+PRIMARY_DB_NAME = 'primary.db'
+
 
 def is_pdf(path: Path) -> bool:
     # TODO: is there a better way?
@@ -24,8 +29,11 @@ def get_user_data_dir() -> Path | None:
 
 
 def get_working_dir() -> Path | None:
-    work_dir = get_user_data_dir() / 'EagleEye'
-    work_dir.mkdir(exist_ok=True)
+    if override := os.getenv(WORKING_DIR_ENV_VAR):
+        work_dir = Path(override)
+    else:
+        work_dir = get_user_data_dir() / 'EagleEye'
+    work_dir.mkdir(parents=True, exist_ok=True)
 
     return work_dir
 
@@ -86,7 +94,21 @@ class LocalPaths:
 
     @staticmethod
     def database_file(primary: bool = True) -> Path:
-        return get_working_dir() / ('primary.db' if primary else 'secondary.db')
+        return get_working_dir() / (PRIMARY_DB_NAME if primary else 'secondary.db')
+
+    @staticmethod
+    def ocr_cache_file() -> Path:
+        return get_working_dir() / 'ocr_cache.db'
+
+    @staticmethod
+    def service_token_file() -> Path:
+        return get_working_dir() / 'service_token'
+
+    @staticmethod
+    def exports_directory() -> Path:
+        exports_dir = get_working_dir() / 'exports'
+        exports_dir.mkdir(exist_ok=True)
+        return exports_dir
 
     @staticmethod
     def set_up_job_directory(job_uuid: uuid.UUID) -> None:
@@ -1,28 +1,52 @@
 import cv2
 import logging
 import numpy as np
+import os
 import re
+from dataclasses import dataclass
 from pathlib import Path
 
 from src.database.fields.text_field import TextField
 from src.database.processed_fields.processed_text_field import ProcessedTextField
 from src.util.types import FormLinkingMethod
 
-from .types import BoxBounds
+from .google_api import clean_ocr_text
+from .types import BoxBounds, OcrWord
 from src.database.processing.processed_region import ProcessedRegion
 
 OCR_WHITE_PIXEL_THRESHOLD = 0.99  # Ignore images that are over X% white
 CHECKBOX_WHITE_PIXEL_THRESHOLD = 0.6  # Checked checkboxes should have less than X% white
 CIRCLED_WHITE_PIXEL_THRESHOLD = 0.9  # Circled fields should have less than X% white
 
+# field images packed into one OCR image, the gap between them is wider than the gap between lines of a field
+MOSAIC_PADDING = 10
+MOSAIC_SEPARATOR = 40
+MAX_MOSAIC_HEIGHT = 4096
+MAX_MOSAIC_TILES = 32
+
+# grid cell size of the box index, about the height of a line of handwriting on a scan
+BOX_INDEX_CELL_SIZE = 64
+
+# page OCR crops a little past the outermost field so words that run over its edge are whole
+PAGE_OCR_MARGIN = 20
+
 logger = logging.getLogger(__name__)
 
 
+def write_image(path: Path, image: np.ndarray) -> None:
+    # write next to the destination and swap it in, so a crash never leaves a half written image
+    temp_path = path.with_name(f'.{path.stem}.tmp{path.suffix}')
+    if not cv2.imwrite(str(temp_path), image):
+        raise RuntimeError(f'Failed to write image: {path}')
+
+    os.replace(temp_path, path)
+
+
 def snip_roi_image(image: np.ndarray, bounds: BoxBounds, save_path: Path | None = None) -> np.ndarray:
     roi = image[bounds.y:bounds.y + bounds.height, bounds.x:bounds.x + bounds.width]
     if save_path is not None:
-        assert not save_path.exists(), f'Path ({save_path}) already exists!'
-        cv2.imwrite(str(save_path), roi)
+        # snips from a region that was interrupted part way through are overwritten
+        write_image(save_path, roi)
 
     return roi
 
@@ -64,6 +88,138 @@ def stitch_images(image: np.ndarray, regions: list[BoxBounds]) -> np.ndarray:
     return stitch_canvas
 
 
+@dataclass
+class Mosaic:
+    image: np.ndarray
+    # where each packed image sits on the mosaic, and which of the packed images it is
+    tiles: list[BoxBounds]
+    indexes: list[int]
+
+    def tile_texts(self, words: list[OcrWord] | None) -> list[str | None]:
+        if words is None:
+            return [None] * len(self.tiles)
+        return [words_to_text(tile_words) for tile_words in assign_words(words, self.tiles)]
+
+
+def _pack_mosaic(images: list[np.ndarray], indexes: list[int]) -> Mosaic:
+    width = max(image.shape[1] for image in images) + 2 * MOSAIC_PADDING
+    height = sum(image.shape[0] for image in images) + MOSAIC_SEPARATOR * (len(images) - 1) + 2 * MOSAIC_PADDING
+
+    # Create a white canvas
+    canvas = np.full(shape=(height, width), fill_value=255, dtype=np.uint8)
+
+    # Stack the images down the canvas, each one on its own rows
+    tiles = []
+    cursor_y = MOSAIC_PADDING
+    for image in images:
+        tile = BoxBounds(MOSAIC_PADDING, cursor_y, image.shape[1], image.shape[0])
+        canvas[tile.y:tile.y + tile.height, tile.x:tile.x + tile.width] = image
+        tiles.append(tile)
+
+        cursor_y = cursor_y + tile.height + MOSAIC_SEPARATOR
+
+    return Mosaic(image=canvas, tiles=tiles, indexes=indexes)
+
+
+def build_mosaics(images: list[np.ndarray]) -> list[Mosaic]:
+    groups: list[list[int]] = []
+    group_height = 0
+    for idx, image in enumerate(images):
+        height = image.shape[0] + MOSAIC_SEPARATOR
+        if not groups or len(groups[-1]) >= MAX_MOSAIC_TILES or group_height + height > MAX_MOSAIC_HEIGHT:
+            groups.append([])
+            group_height = 2 * MOSAIC_PADDING
+
+        groups[-1].append(idx)
+        group_height += height
+
+    return [_pack_mosaic([images[idx] for idx in group], group) for group in groups]
+
+
+def _overlap_area(a: BoxBounds, b: BoxBounds) -> int:
+    width = min(a.x + a.width, b.x + b.width) - max(a.x, b.x)
+    height = min(a.y + a.height, b.y + b.height) - max(a.y, b.y)
+    return max(width, 0) * max(height, 0)
+
+
+class BoxIndex:
+    # buckets the boxes by the grid cells they cover, so a word is only compared with the boxes near it
+    def __init__(self, boxes: list[BoxBounds], cell_size: int = BOX_INDEX_CELL_SIZE):
+        self.boxes = boxes
+        self._cell_size = cell_size
+        self._cells: dict[tuple[int, int], list[int]] = {}
+        for idx, box in enumerate(boxes):
+            for cell in self._covered_cells(box):
+                self._cells.setdefault(cell, []).append(idx)
+
+    def _covered_cells(self, box: BoxBounds) -> list[tuple[int, int]]:
+        first_x, last_x = box.x // self._cell_size, (box.x + max(box.width - 1, 0)) // self._cell_size
+        first_y, last_y = box.y // self._cell_size, (box.y + max(box.height - 1, 0)) // self._cell_size
+        return [(x, y) for x in range(first_x, last_x + 1) for y in range(first_y, last_y + 1)]
+
+    def best_match(self, bounds: BoxBounds) -> int | None:
+        # the box the bounds overlap the most, lowest index on a tie
+        candidates = {idx for cell in self._covered_cells(bounds) for idx in self._cells.get(cell, [])}
+        best, best_area = None, 0
+        for idx in sorted(candidates):
+            area = _overlap_area(bounds, self.boxes[idx])
+            if area > best_area:
+                best, best_area = idx, area
+
+        return best
+
+
+def assign_words(words: list[OcrWord], boxes: list[BoxBounds]) -> list[list[OcrWord]]:
+    # a word belongs to the box it covers the most of, words outside every box are dropped
+    box_words: list[list[OcrWord]] = [[] for _ in boxes]
+    index = BoxIndex(boxes)
+    for word in words:
+        best = index.best_match(word.bounds)
+        if best is not None:
+            box_words[best].append(word)
+        else:
+            logger.debug(f'OCR word "{word.text}" at {word.bounds} is not in any box, dropping it')
+
+    return box_words
+
+
+def page_ocr_bounds(image: np.ndarray, boxes: list[BoxBounds], margin: int = PAGE_OCR_MARGIN) -> BoxBounds:
+    # everything the fields of a region cover, plus a margin, kept inside the image
+    left = max(min(box.x for box in boxes) - margin, 0)
+    top = max(min(box.y for box in boxes) - margin, 0)
+    right = min(max(box.x + box.width for box in boxes) + margin, image.shape[1])
+    bottom = min(max(box.y + box.height for box in boxes) + margin, image.shape[0])
+    return BoxBounds(left, top, right - left, bottom - top)
+
+
+def offset_words(words: list[OcrWord], x: int, y: int) -> list[OcrWord]:
+    return [word._replace(bounds=word.bounds._replace(x=word.bounds.x + x, y=word.bounds.y + y)) for word in words]
+
+
+def words_to_text(words: list[OcrWord]) -> str:
+    if not words:
+        return ''
+
+    # group the words into lines by their centers, then read each line left to right
+    line_height = sorted(word.bounds.height for word in words)[len(words) // 2]
+    lines: list[list[OcrWord]] = []
+    for word in sorted(words, key=lambda word: word.bounds.y + word.bounds.height / 2):
+        center = word.bounds.y + word.bounds.height / 2
+        if lines and center - (lines[-1][0].bounds.y + lines[-1][0].bounds.height / 2) <= line_height / 2:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+
+    text = ''
+    for line in lines:
+        for word in sorted(line, key=lambda word: word.bounds.x):
+            text += word.text + (' ' if word.space_after else '')
+        if not text.endswith(' '):
+            text += ' '
+
+    return clean_ocr_text(text)
+
+
 def get_checked(aligned_image: np.ndarray, region: BoxBounds) -> bool:
     option_roi = snip_roi_image(aligned_image, region)
     roi_pixels = region.height * region.width
@@ -0,0 +1,132 @@
+import os
+import requests
+import secrets
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Any
+
+from .paths import LocalPaths
+from .settings import SettingsManager
+
+# the service only listens on the loopback interface
+SERVICE_HOST = '127.0.0.1'
+
+# every request carries the token from the working directory, so only users who can read it can drive the service
+SERVICE_TOKEN_HEADER = 'X-Eagle-Eye-Token'
+
+# how long the service holds an events request open waiting for something to happen
+EVENTS_WAIT_SECONDS = 30
+REQUEST_TIMEOUT_SECONDS = 10
+
+
+class ServiceError(Exception):
+    pass
+
+
+class ServiceUnavailable(ServiceError):
+    pass
+
+
+def read_service_token() -> str | None:
+    path = LocalPaths.service_token_file()
+    return path.read_text().strip() if path.exists() else None
+
+
+def create_service_token() -> str:
+    # made once per install, the file is only readable by the user that created it
+    token = read_service_token()
+    if token:
+        return token
+
+    try:
+        handle = os.open(LocalPaths.service_token_file(), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # another service got there first
+        return read_service_token()
+
+    token = secrets.token_urlsafe(32)
+    with os.fdopen(handle, 'w') as file:
+        file.write(token)
+    return token
+
+
+class ServiceClient:
+    def __init__(self, port: int | None = None):
+        self._base_url = f'http://{SERVICE_HOST}:{port or SettingsManager().service_port}'
+        self._session = requests.Session()
+
+    def _request(self, method: str, path: str, timeout: float = REQUEST_TIMEOUT_SECONDS, **kwargs) -> Any:
+        # the service writes the token when it first starts
+        token = read_service_token()
+        if token is None:
+            raise ServiceUnavailable('The processing service has never been started in this working directory')
+        self._session.headers[SERVICE_TOKEN_HEADER] = token
+
+        try:
+            result = self._session.request(method, f'{self._base_url}{path}', timeout=timeout, **kwargs)
+        except requests.exceptions.ConnectionError as e:
+            raise ServiceUnavailable(f'The processing service is not running at {self._base_url}') from e
+
+        body = result.json() if result.content else {}
+        if not result.ok:
+            raise ServiceError(body.get('error', f'Service request failed: {result.status_code}'))
+        return body
+
+    def is_running(self) -> bool:
+        try:
+            self.jobs()
+        except ServiceUnavailable:
+            return False
+        return True
+
+    def jobs(self) -> list[dict[str, Any]]:
+        return self._request('GET', '/jobs')['jobs']
+
+    def find_job(self, job_name: str) -> dict[str, Any]:
+        for job in self.jobs():
+            if job['job_name'] == job_name:
+                return job
+        raise ServiceError(f'The service is not running job "{job_name}"')
+
+    def job(self, job_id: int) -> dict[str, Any]:
+        return self._request('GET', f'/jobs/{job_id}')
+
+    def submit(self, job_name: str) -> dict[str, Any]:
+        # attaches to the job if the service is already running it
+        return self._request('POST', '/jobs', json={'job_name': job_name})
+
+    def events(self, job_id: int, since: int = 0) -> dict[str, Any]:
+        return self._request(
+            'GET',
+            f'/jobs/{job_id}/events',
+            params={'since': since},
+            timeout=EVENTS_WAIT_SECONDS + REQUEST_TIMEOUT_SECONDS,
+        )
+
+    def follow(self, job_id: int, since: int = 0) -> Iterator[dict[str, Any]]:
+        # yields the file events of the job until it stops running
+        while True:
+            result = self.events(job_id, since)
+            yield from result['events']
+
+            since = result['next']
+            if not result['running']:
+                return
+
+    def pause(self, job_id: int) -> dict[str, Any]:
+        return self._request('POST', f'/jobs/{job_id}/pause')
+
+    def resume(self, job_id: int) -> dict[str, Any]:
+        return self._request('POST', f'/jobs/{job_id}/resume')
+
+    def cancel(self, job_id: int) -> dict[str, Any]:
+        return self._request('POST', f'/jobs/{job_id}/cancel')
+
+    def export(self, job_id: int, export_path: Path, mode: str) -> dict[str, Any]:
+        # the service only writes inside its export directory, a relative path is taken from there
+        return self._request(
+            'POST',
+            f'/jobs/{job_id}/export',
+            json={'path': str(export_path), 'mode': mode},
+            timeout=None,
+        )
@@ -1,12 +1,27 @@
 import datetime
 import logging
 import json
+import os
+import threading
 from dataclasses import dataclass
 
+from .cpu_governor import available_cores
 from .paths import LocalPaths
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_PROCESSING_WORKERS = 8
+DEFAULT_OCR_CONCURRENCY = 8
+DEFAULT_OCR_MAX_IN_FLIGHT = 32
+
+# the API takes at most 16 images in one images:annotate call
+MAX_OCR_BATCH_SIZE = 16
+DEFAULT_MEMORY_BUDGET_FRACTION = 0.5
+
+_current_settings: 'SettingsManager | None' = None
+_current_settings_stamp: tuple[int, int] | None = None
+_current_settings_lock = threading.Lock()
+
 
 class CustomEncoder(json.JSONEncoder):
     def default(self, obj: object) -> object:
@@ -40,6 +55,50 @@ class SettingsManager:
     google_project_id: str | None = None
     google_access_token: str | None = None
 
+    # Worker pool sizes, None picks a default for this machine
+    pre_processing_workers: int | None = None
+    processing_workers: int | None = None
+
+    # How many OCR requests a single file can have in flight, None picks the default
+    ocr_concurrency: int | None = None
+
+    # Send OCR requests from a shared event loop instead of a thread per request
+    ocr_async_client: bool = True
+    ocr_max_in_flight: int | None = None
+
+    # Field images sent in each OCR call, None sends as many as the API takes
+    ocr_batch_size: int | None = None
+
+    # Pack the field images of a file into a few large images and map the words back by position
+    ocr_mosaic: bool = False
+
+    # OCR each form region as one image and give each field the words inside its box, takes precedence over ocr_mosaic
+    ocr_full_page: bool = False
+
+    # Keep the words of full page OCR so a field box that was moved or split is re-read without calling OCR again
+    keep_page_words: bool = True
+
+    # Size of the on-disk cache of OCR responses, 0 turns it off
+    ocr_cache_mb: int = 512
+
+    # Send OCR requests somewhere other than the Google Vision API, None uses the API
+    ocr_api_url: str | None = None
+
+    # Run alignment in child processes instead of threads
+    pre_processing_use_processes: bool = False
+
+    # Memory the page images of in-flight files can use, None uses half of the machine's RAM
+    memory_budget_mb: int | None = None
+
+    # Input images read ahead of the workers on a background thread, 0 turns it off
+    prefetch_images: int = 4
+
+    # Reuse the results of an earlier run when a file, its reference form and the pipeline have not changed
+    reuse_results: bool = True
+
+    # Localhost port of the background processing service
+    service_port: int = 8765
+
     # Members with a proceeding underscore are NOT written to disk
 
     def __post_init__(self):
@@ -61,6 +120,39 @@ class SettingsManager:
             current_date = datetime.date.today()
             return current_date != self.google_api_update_date
 
+    def pre_processing_worker_count(self) -> int:
+        # alignment is CPU bound, so default to one worker per core
+        if self.pre_processing_workers:
+            return self.pre_processing_workers
+        return available_cores()
+
+    def processing_worker_count(self) -> int:
+        # OCR workers spend most of their time waiting on the network
+        if self.processing_workers:
+            return self.processing_workers
+        return DEFAULT_PROCESSING_WORKERS
+
+    def ocr_concurrency_count(self) -> int:
+        if self.ocr_concurrency:
+            return self.ocr_concurrency
+        return DEFAULT_OCR_CONCURRENCY
+
+    def ocr_max_in_flight_count(self) -> int:
+        # shared by every file in the app, so this is the limit on calls to the API at once
+        if self.ocr_max_in_flight:
+            return self.ocr_max_in_flight
+        return DEFAULT_OCR_MAX_IN_FLIGHT
+
+    def ocr_batch_size_count(self) -> int:
+        if self.ocr_batch_size:
+            return max(1, min(self.ocr_batch_size, MAX_OCR_BATCH_SIZE))
+        return MAX_OCR_BATCH_SIZE
+
+    def memory_budget_bytes(self, total_memory: int) -> int:
+        if self.memory_budget_mb:
+            return self.memory_budget_mb * 1024 * 1024
+        return int(total_memory * DEFAULT_MEMORY_BUDGET_FRACTION)
+
     def load(self) -> None:
         settings_file = LocalPaths.settings_file()
         logger.info(f'Loading settings: {settings_file}')
@@ -82,5 +174,29 @@ class SettingsManager:
                 # logger.info(f'Saving: "{member}" = "{value}"')
                 save_data[member] = value
 
-        with settings_file.open('wt') as file:
+        # written to the side and swapped in, so a worker reading the settings never sees a half written file
+        temp_file = settings_file.with_name(f'{settings_file.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+        with temp_file.open('wt') as file:
             json.dump(save_data, file, cls=CustomEncoder)
+        os.replace(temp_file, settings_file)
+
+
+def _settings_stamp() -> tuple[int, int] | None:
+    try:
+        stat = LocalPaths.settings_file().stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def current_settings() -> SettingsManager:
+    # for code that reads settings on every file or OCR call, the file is only parsed again once it changes.
+    # the instance is shared, so change settings through "with SettingsManager() as settings" instead
+    global _current_settings, _current_settings_stamp
+
+    stamp = _settings_stamp()
+    with _current_settings_lock:
+        if _current_settings is None or stamp != _current_settings_stamp:
+            _current_settings = SettingsManager()
+            _current_settings_stamp = stamp
+        return _current_settings
@@ -32,6 +32,12 @@ class BoxBounds(NamedTuple):
         return QPointF(self.x, self.y)
 
 
+class OcrWord(NamedTuple):
+    text: str
+    bounds: BoxBounds
+    space_after: bool
+
+
 class FileDetails(NamedTuple):
     db_id: int
     path: Path
@@ -92,3 +98,23 @@ def get_alignment_explanation(method: FormAlignmentMethod) -> str:
             """
         case _:
             raise RuntimeError(f"Unknown export mode: {method}")
+
+
+class TaskStage(Enum):
+    PRE_PROCESSING = 1
+    PROCESSING = 2
+
+
+class TaskState(Enum):
+    PENDING = 1
+    LEASED = 2
+    DONE = 3
+    FAILED = 4
+    CANCELLED = 5
+
+
+class ServiceJobState(Enum):
+    RUNNING = 1
+    FINISHED = 2
+    CANCELLED = 3
+    ERROR = 4